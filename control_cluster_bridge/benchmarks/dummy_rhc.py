@@ -0,0 +1,231 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.controllers.rhc import RHController
+from control_cluster_bridge.cluster_client.control_cluster_client import ControlClusterClient
+
+from perf_sleep.pyperfsleep import PerfSleep
+
+from typing import List, Dict
+
+import time
+
+import numpy as np
+
+# Dummy controller and cluster client used for benchmarking the server-controllers
+# round trip: no actual problem is solved, but the solution time can be emulated
+# (fixed or randomized, either sleeping or busy-waiting)
+
+def write_dummy_srdf(path: str,
+        jnt_names: List[str]):
+
+    # minimal SRDF with a (null) homing for the given joints
+    jnts = "\n".join([f'        <joint name="{name}" value="0.0"/>' for name in jnt_names])
+    srdf = '<?xml version="1.0"?>\n' + \
+        '<robot name="dummy">\n' + \
+        '    <group_state name="home" group="base">\n' + \
+        jnts + '\n' + \
+        '    </group_state>\n' + \
+        '</robot>\n'
+    with open(path, "w") as file:
+        file.write(srdf)
+
+class DummyRhc(RHController):
+
+    def __init__(self,
+            srdf_path: str,
+            n_nodes: int,
+            dt: float,
+            namespace: str,
+            jnt_names: List[str],
+            contact_names: List[str],
+            solve_time: float = 1e-3, # [s] emulated solution time
+            solve_jitter: float = 0.0, # [s] uniformly distributed extra solution time
+            busy_wait: bool = False, # if True, the solution time is spent computing (busy-waiting)
+            seed: int = None,
+            verbose = False, 
+            debug = False,
+            profiling: str = "off",
+            warmstart: bool = False, # if True, the (dummy) solutions are cached as by real controllers
+            warmstart_decimation: int = 10):
+        
+        # has to be set before the parent's initialization
+        self._jnt_names = jnt_names
+        self._contact_names = contact_names
+        self._solve_time = solve_time
+        self._solve_jitter = solve_jitter
+        self._busy_wait = busy_wait
+        self._rng = np.random.default_rng(seed)
+
+        self._q_cmd = None
+        self._v_cmd = None
+        self._f_sol = None
+        self._q_sol = None
+        self._v_sol = None
+        self._a_sol = None
+
+        super().__init__(srdf_path=srdf_path,
+                    n_nodes=n_nodes,
+                    dt=dt,
+                    namespace=namespace,
+                    verbose=verbose,
+                    debug=debug,
+                    profiling=profiling,
+                    warmstart=warmstart,
+                    warmstart_decimation=warmstart_decimation)
+
+    def _init_problem(self):
+
+        self.n_dofs = len(self._jnt_names)
+        self.n_contacts = len(self._contact_names)
+        self._assign_controller_side_jnt_names(jnt_names=self._jnt_names)
+        self._q_cmd = np.zeros((1, self.n_dofs), dtype=self._dtype)
+        self._v_cmd = np.zeros((1, self.n_dofs), dtype=self._dtype)
+        self._f_sol = np.zeros((3 * self.n_contacts, self._n_nodes), dtype=self._dtype)
+        # horizon trajectories (only used for warm starting)
+        self._q_sol = np.zeros((7 + self.n_dofs, self._n_nodes), dtype=self._dtype)
+        self._v_sol = np.zeros((6 + self.n_dofs, self._n_nodes), dtype=self._dtype)
+        self._a_sol = np.zeros((6 + self.n_dofs, self._n_nodes - 1), dtype=self._dtype)
+        if self.n_contacts > 0:
+            self._f_sol[2::3, :] = self._get_robot_mass() * 9.81 / self.n_contacts
+
+    def _solve(self) -> bool:
+
+        solve_time = self._solve_time
+        if self._solve_jitter > 0:
+            solve_time += self._rng.uniform(0.0, self._solve_jitter)
+        start = time.perf_counter()
+        if self._busy_wait:
+            while (time.perf_counter() - start) < solve_time:
+                pass
+        elif solve_time > 0:
+            PerfSleep.thread_sleep(int(solve_time * 1e9))
+        # the cmd just tracks the latest state
+        self._q_cmd[:, :] = np.reshape(self.robot_state.jnts_state.get(data_type="q", 
+                                    robot_idxs=self.controller_index), (1, -1))
+        self._profiling_data_dict["rti_solve_dt"] = time.perf_counter() - start
+        return True
+
+    def _get_cmd_jnt_q_from_sol(self) -> np.ndarray:
+        return self._q_cmd
+
+    def _get_cmd_jnt_v_from_sol(self) -> np.ndarray:
+        return self._v_cmd
+
+    def _get_cmd_jnt_eff_from_sol(self) -> np.ndarray:
+        return self._v_cmd
+
+    def _get_f_from_sol(self):
+        return self._f_sol
+
+    def _get_q_from_sol(self):
+        return self._q_sol
+
+    def _get_v_from_sol(self):
+        return self._v_sol
+
+    def _get_a_from_sol(self):
+        return self._a_sol
+
+    def _set_initial_guess(self,
+            sol: Dict[str, np.ndarray]) -> bool:
+        return True
+
+    def _reset(self):
+        pass
+
+    def _init_rhc_task_cmds(self):
+        return None # no task refs
+
+    def _get_robot_jnt_names(self):
+        return self._jnt_names
+
+    def _get_contact_names(self):
+        return self._contact_names
+    
+    def _get_contacts(self):
+        return self._contact_names
+
+    def _update_open_loop(self):
+        pass
+
+    def _update_closed_loop(self):
+        pass
+
+    def _get_ndofs(self):
+        return len(self._jnt_names)
+
+    def _get_robot_mass(self):
+        return 1.0
+
+class DummyClusterClient(ControlClusterClient):
+
+    def __init__(self,
+            namespace: str,
+            cluster_size: int,
+            srdf_path: str,
+            n_nodes: int,
+            cluster_dt: float,
+            jnt_names: List[str],
+            contact_names: List[str],
+            solve_time: float = 1e-3,
+            solve_jitter: float = 0.0,
+            busy_wait: bool = False,
+            profiling: str = "off",
+            warmstart: bool = False,
+            warmstart_decimation: int = 10,
+            verbose: bool = False,
+            debug: bool = False,
+            **kwargs): # forwarded to ControlClusterClient (e.g. workers, affinity)
+
+        self._srdf_path = srdf_path
+        self._n_nodes = n_nodes
+        self._cluster_dt = cluster_dt
+        self._jnt_names = jnt_names
+        self._contact_names = contact_names
+        self._solve_time = solve_time
+        self._solve_jitter = solve_jitter
+        self._busy_wait = busy_wait
+        self._profiling = profiling
+        self._warmstart = warmstart
+        self._warmstart_decimation = warmstart_decimation
+
+        super().__init__(namespace=namespace,
+                cluster_size=cluster_size,
+                processes_basename="DummyRhc",
+                verbose=verbose,
+                debug=debug,
+                **kwargs)
+
+    def _generate_controller(self,
+                        idx: int):
+        
+        return DummyRhc(srdf_path=self._srdf_path,
+                    n_nodes=self._n_nodes,
+                    dt=self._cluster_dt,
+                    namespace=self._namespace,
+                    jnt_names=self._jnt_names,
+                    contact_names=self._contact_names,
+                    solve_time=self._solve_time,
+                    solve_jitter=self._solve_jitter,
+                    busy_wait=self._busy_wait,
+                    seed=idx,
+                    verbose=self._verbose,
+                    debug=self._debug,
+                    profiling=self._profiling,
+                    warmstart=self._warmstart,
+                    warmstart_decimation=self._warmstart_decimation)
@@ -0,0 +1,313 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.cluster_server.control_cluster_server import ControlClusterServer
+from control_cluster_bridge.benchmarks.dummy_rhc import DummyClusterClient, write_dummy_srdf
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import StepPhasesDt
+
+from SharsorIPCpp.PySharsorIPC import Journal, LogType
+from SharsorIPCpp.PySharsorIPC import VLevel
+
+from typing import List, Dict
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+import platform
+import tempfile
+
+import multiprocess as mp
+
+import numpy as np
+import torch
+
+# Synthetic benchmark of the server-controllers round trip (pre_trigger -> 
+# trigger_solution -> wait_for_solution) with dummy controllers, over a grid of 
+# cluster sizes, n. of joints, n. of contacts and cluster dts. 
+# Runs headless and CPU-only; results are reported as JSON, e.g.
+# python -m control_cluster_bridge.benchmarks.round_trip --cluster_sizes 1 4 16 --output rt.json
+
+def _run_client(client_kwargs: Dict):
+
+    # runs in a separate process (spawns the controllers and keeps them alive 
+    # until a SIGINT is received)
+    client = DummyClusterClient(**client_kwargs)
+    client.run()
+
+def _percentiles(samples: np.ndarray,
+        q: List[float] = [50, 95, 99]):
+
+    samples = samples[~np.isnan(samples)]
+    if samples.shape[0] == 0:
+        return None
+    stats = {f"p{quantile:g}": np.percentile(samples, quantile).item() for quantile in q}
+    stats["mean"] = samples.mean().item()
+    stats["max"] = samples.max().item()
+    return stats
+
+class RoundTripBenchmark:
+
+    def __init__(self,
+            cluster_size: int,
+            n_jnts: int,
+            n_contacts: int,
+            cluster_dt: float,
+            n_steps: int = 1000,
+            n_warmup: int = 50,
+            n_nodes: int = 31,
+            solve_time: float = 1e-3, # [s] emulated solution time of the controllers
+            solve_jitter: float = 0.0, # [s]
+            busy_wait: bool = False,
+            realtime: bool = False, # if True, steps are paced at cluster_dt (otherwise free-running)
+            profiling: str = "timers", # profiling level of the controllers
+            ready_timeout: float = 120.0, # [s]
+            client_kwargs: Dict = None, # forwarded to the cluster client (e.g. use_workers)
+            server_kwargs: Dict = None, # forwarded to the server (e.g. packed_sol, step_packet)
+            namespace: str = None,
+            verbose: bool = False):
+
+        self._cluster_size = cluster_size
+        self._n_jnts = n_jnts
+        self._n_contacts = n_contacts
+        self._cluster_dt = cluster_dt
+        self._n_steps = n_steps
+        self._n_warmup = n_warmup
+        self._n_nodes = n_nodes
+        self._solve_time = solve_time
+        self._solve_jitter = solve_jitter
+        self._busy_wait = busy_wait
+        self._realtime = realtime
+        self._profiling = profiling
+        self._ready_timeout = ready_timeout
+        self._client_kwargs = {} if client_kwargs is None else client_kwargs
+        self._server_kwargs = {} if server_kwargs is None else server_kwargs
+        self._verbose = verbose
+
+        self._namespace = namespace
+        if self._namespace is None:
+            self._namespace = f"RoundTripBench{os.getpid()}_{cluster_size}_{n_jnts}_{n_contacts}"
+
+        self._jnt_names = [f"jnt_{i}" for i in range(self._n_jnts)]
+        self._contact_names = [f"contact_{i}" for i in range(self._n_contacts)]
+
+    def config(self):
+
+        return {"cluster_size": self._cluster_size,
+            "n_jnts": self._n_jnts,
+            "n_contacts": self._n_contacts,
+            "cluster_dt": self._cluster_dt,
+            "n_steps": self._n_steps,
+            "n_nodes": self._n_nodes,
+            "solve_time": self._solve_time,
+            "solve_jitter": self._solve_jitter,
+            "busy_wait": self._busy_wait,
+            "realtime": self._realtime,
+            "profiling": self._profiling,
+            "client_kwargs": self._client_kwargs,
+            "server_kwargs": self._server_kwargs}
+    
+    def run(self):
+
+        srdf_dir = tempfile.TemporaryDirectory()
+        srdf_path = os.path.join(srdf_dir.name, "dummy.srdf")
+        write_dummy_srdf(path=srdf_path, jnt_names=self._jnt_names)
+
+        server = ControlClusterServer(namespace=self._namespace,
+                            cluster_size=self._cluster_size,
+                            control_dt=self._cluster_dt,
+                            cluster_dt=self._cluster_dt,
+                            jnt_names=self._jnt_names,
+                            n_contact_sensors=self._n_contacts,
+                            contact_linknames=self._contact_names,
+                            use_gpu=False,
+                            verbose=self._verbose,
+                            vlevel=VLevel.V1,
+                            force_reconnection=True,
+                            **self._server_kwargs)
+        server.run()
+
+        client_kwargs = {"namespace": self._namespace,
+                "cluster_size": self._cluster_size,
+                "srdf_path": srdf_path,
+                "n_nodes": self._n_nodes,
+                "cluster_dt": self._cluster_dt,
+                "jnt_names": self._jnt_names,
+                "contact_names": self._contact_names,
+                "solve_time": self._solve_time,
+                "solve_jitter": self._solve_jitter,
+                "busy_wait": self._busy_wait,
+                "profiling": self._profiling,
+                "verbose": self._verbose}
+        client_kwargs.update(self._client_kwargs)
+        client_process = mp.get_context("spawn").Process(target=_run_client, 
+                                                name="RoundTripBenchClient",
+                                                args=(client_kwargs, ))
+        client_process.start()
+
+        try:
+            if not server.wait_for_ready_controllers(timeout=self._ready_timeout):
+                Journal.log(self.__class__.__name__,
+                    "run",
+                    f"Controllers not ready within {self._ready_timeout} s.",
+                    LogType.EXCEP,
+                    throw_when_excep = True)
+            server.activate_controllers(idxs=torch.arange(self._cluster_size))
+            results = self._run_steps(server=server)
+        finally:
+            self._stop_client(client_process)
+            server.close()
+            srdf_dir.cleanup()
+
+        results["config"] = self.config()
+        return results
+
+    def _stop_client(self,
+            client_process):
+
+        # the client terminates its controllers upon SIGINT
+        if client_process.is_alive():
+            os.kill(client_process.pid, signal.SIGINT)
+            client_process.join(timeout=10.0)
+        if client_process.is_alive():
+            client_process.terminate()
+            client_process.join()
+
+    def _run_steps(self,
+            server: ControlClusterServer):
+
+        n_total = self._n_warmup + self._n_steps
+        latencies = np.full((self._n_steps, ), fill_value=np.nan)
+        phases_dt = np.full((self._n_steps, len(StepPhasesDt.phases)), fill_value=np.nan)
+        n_late = 0
+        
+        for i in range(n_total):
+            if i == self._n_warmup:
+                start_time = time.perf_counter()
+            step_start = time.perf_counter()
+            server.pre_trigger()
+            server.trigger_solution()
+            server.wait_for_solution()
+            latency = time.perf_counter() - step_start
+            if i >= self._n_warmup:
+                latencies[i - self._n_warmup] = latency
+                phases = server.get_step_phases_dt()
+                phases_dt[i - self._n_warmup, :] = [phases[phase] for phase in StepPhasesDt.phases]
+                if latency > self._cluster_dt:
+                    n_late += 1
+            if self._realtime:
+                remaining = self._cluster_dt - (time.perf_counter() - step_start)
+                if remaining > 0:
+                    time.sleep(remaining)
+        wall_time = time.perf_counter() - start_time
+
+        results = {"wall_time": wall_time,
+            "throughput": self._n_steps / wall_time, # [steps/s]
+            "controller_solves_per_s": self._n_steps * self._cluster_size / wall_time,
+            "latency": _percentiles(latencies), # [s] whole round trip
+            "rt_factor": self._cluster_dt / np.median(latencies).item(),
+            "late_fraction": n_late / self._n_steps, # steps taking longer than cluster_dt
+            "phases": {phase: _percentiles(phases_dt[:, i]) \
+                    for i, phase in enumerate(StepPhasesDt.phases)}}
+        
+        if self._profiling != "off":
+            # controller-side data (last flush)
+            cntrl_data = server.get_stats().get_cntrl_profiling()
+            n_solves = cntrl_data["n_solves"]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_loop_dt = cntrl_data["solve_loop_dt_sum"] / n_solves
+            results["controllers"] = {"mean_solve_loop_dt": _percentiles(mean_loop_dt),
+                            "n_fails": np.nansum(cntrl_data["n_fails"]).item()}
+            for field in ["read_state_dt", "solve_dt", "write_cmds_dt", "solve_loop_dt"]:
+                results["controllers"][field] = _percentiles(cntrl_data[field])
+
+        return results
+
+def run_grid(cluster_sizes: List[int],
+        n_jnts: List[int],
+        n_contacts: List[int],
+        cluster_dts: List[float],
+        **kwargs): # forwarded to RoundTripBenchmark
+
+    results = []
+    for cluster_size, jnts, contacts, cluster_dt in itertools.product(cluster_sizes, 
+                                                n_jnts, n_contacts, cluster_dts):
+        benchmark = RoundTripBenchmark(cluster_size=cluster_size,
+                                n_jnts=jnts,
+                                n_contacts=contacts,
+                                cluster_dt=cluster_dt,
+                                **kwargs)
+        result = benchmark.run()
+        Journal.log("round_trip.py",
+            "run_grid",
+            f"cluster_size {cluster_size}, n_jnts {jnts}, n_contacts {contacts}, cluster_dt {cluster_dt} -> " + \
+                f"{result['throughput']:.1f} steps/s, p99 latency {result['latency']['p99'] * 1e3:.3f} ms",
+            LogType.STAT,
+            throw_when_excep = True)
+        results.append(result)
+    
+    return {"host": {"platform": platform.platform(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+                "python": sys.version.split()[0]},
+            "timestamp": time.time(),
+            "results": results}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Server-controllers round trip benchmark")
+    parser.add_argument('--cluster_sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--n_jnts', type=int, nargs='+', default=[12])
+    parser.add_argument('--n_contacts', type=int, nargs='+', default=[4])
+    parser.add_argument('--cluster_dts', type=float, nargs='+', default=[0.03])
+    parser.add_argument('--n_steps', type=int, default=1000)
+    parser.add_argument('--n_warmup', type=int, default=50)
+    parser.add_argument('--solve_time', type=float, default=1e-3, help='Emulated solution time [s]')
+    parser.add_argument('--solve_jitter', type=float, default=0.0, help='Max extra (uniform) solution time [s]')
+    parser.add_argument('--busy_wait', action='store_true', help='Busy-wait instead of sleeping when solving')
+    parser.add_argument('--realtime', action='store_true', help='Pace steps at cluster_dt')
+    parser.add_argument('--profiling', type=str, default="timers", help='Profiling level of the controllers')
+    parser.add_argument('--use_workers', action='store_true', help='Host multiple controllers per process')
+    parser.add_argument('--warmstart', action='store_true', help='Cache solutions for warm starting')
+    parser.add_argument('--warmstart_decimation', type=int, default=10, help='Solutions are cached once every this many solves')
+    parser.add_argument('--output', type=str, default=None, help='Path of the JSON report')
+
+    args = parser.parse_args()
+
+    report = run_grid(cluster_sizes=args.cluster_sizes,
+                n_jnts=args.n_jnts,
+                n_contacts=args.n_contacts,
+                cluster_dts=args.cluster_dts,
+                n_steps=args.n_steps,
+                n_warmup=args.n_warmup,
+                solve_time=args.solve_time,
+                solve_jitter=args.solve_jitter,
+                busy_wait=args.busy_wait,
+                realtime=args.realtime,
+                profiling=args.profiling,
+                client_kwargs={"use_workers": args.use_workers,
+                            "warmstart": args.warmstart,
+                            "warmstart_decimation": args.warmstart_decimation})
+    
+    report_json = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(report_json)
+    print(report_json)
@@ -0,0 +1,444 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.utilities.shared_data.rhc_data import RobotState, RhcStatus, RhcRefs
+from control_cluster_bridge.utilities.shared_data.jnt_imp_control import JntImpCntrlData
+
+from SharsorIPCpp.PySharsorIPC import Journal, LogType
+from SharsorIPCpp.PySharsorIPC import VLevel
+
+from typing import Callable, Dict
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+import numpy as np
+import torch
+
+# Micro-benchmarks of the access paths of the shared data encodings (get/set with 
+# and without remapping, full vs row synchs, numpy vs torch views and GPU mirrors,
+# if CUDA is available). Results are compared against a JSON baseline, which is 
+# written on the first run (or when explicitly updated), e.g.
+# python -m control_cluster_bridge.benchmarks.shared_data --baseline shared_data_baseline.json
+
+class SharedDataBenchmark:
+
+    def __init__(self,
+            n_robots: int = 64,
+            n_jnts: int = 12,
+            n_contacts: int = 4,
+            n_iters: int = 1000, # calls per repeat
+            n_repeats: int = 5,
+            namespace: str = None,
+            use_gpu: bool = None, # defaults to CUDA availability
+            verbose: bool = False):
+
+        self._n_robots = n_robots
+        self._n_jnts = n_jnts
+        self._n_contacts = n_contacts
+        self._n_iters = n_iters
+        self._n_repeats = n_repeats
+        self._verbose = verbose
+
+        self._use_gpu = torch.cuda.is_available() if use_gpu is None else use_gpu
+        if self._use_gpu and not torch.cuda.is_available():
+            Journal.log(self.__class__.__name__,
+                "__init__",
+                "CUDA not available: GPU cases will be skipped.",
+                LogType.WARN,
+                throw_when_excep = True)
+            self._use_gpu = False
+
+        self._namespace = namespace
+        if self._namespace is None:
+            self._namespace = f"SharedDataBench{os.getpid()}"
+
+        self._jnt_names = [f"jnt_{i}" for i in range(self._n_jnts)]
+        self._contact_names = [f"contact_{i}" for i in range(self._n_contacts)]
+        self._jnts_remapping = list(reversed(range(self._n_jnts)))
+        self._q_remapping = [1, 2, 3, 0]
+        self._robot_idxs = np.arange(0, self._n_robots, 2) # half of the robots (non contiguous)
+        
+        self._cases = {} # name -> callable
+        self._skipped = []
+        self._shared_data = []
+
+    def config(self):
+
+        return {"n_robots": self._n_robots,
+            "n_jnts": self._n_jnts,
+            "n_contacts": self._n_contacts,
+            "n_iters": self._n_iters,
+            "n_repeats": self._n_repeats,
+            "use_gpu": self._use_gpu}
+    
+    def _add(self,
+            name: str,
+            case: Callable):
+
+        self._cases[name] = case
+
+    def _robot_state(self,
+            suffix: str,
+            with_torch_view: bool,
+            with_gpu_mirror: bool = False,
+            remapped: bool = False):
+        
+        state = RobotState(namespace=self._namespace + suffix,
+                        is_server=True,
+                        n_robots=self._n_robots,
+                        n_jnts=self._n_jnts,
+                        n_contacts=self._n_contacts,
+                        jnt_names=self._jnt_names,
+                        contact_names=self._contact_names,
+                        q_remapping=self._q_remapping if remapped else None,
+                        with_gpu_mirror=with_gpu_mirror,
+                        with_torch_view=with_torch_view,
+                        force_reconnection=True,
+                        safe=False,
+                        verbose=self._verbose,
+                        vlevel=VLevel.V1)
+        state.run(jnts_remapping=self._jnts_remapping if remapped else None)
+        self._shared_data.append(state)
+        return state
+    
+    def _add_state_cases(self):
+
+        for backend in ["numpy", "torch"]:
+            with_torch_view = backend == "torch"
+            for remapped in [False, True]:
+                tag = f"{backend}/{'remapped' if remapped else 'plain'}"
+                state = self._robot_state(suffix=f"{backend}{int(remapped)}",
+                                    with_torch_view=with_torch_view,
+                                    remapped=remapped)
+                jnts_q = state.jnts_state.get(data_type="q").clone() if with_torch_view else \
+                    state.jnts_state.get(data_type="q").copy()
+                root_q = state.root_state.get(data_type="q").clone() if with_torch_view else \
+                    state.root_state.get(data_type="q").copy()
+                robot_idxs = torch.from_numpy(self._robot_idxs) if with_torch_view else self._robot_idxs
+                
+                # JntsState
+                self._add(f"JntsState/get_q/{tag}", 
+                    lambda s=state: s.jnts_state.get(data_type="q"))
+                self._add(f"JntsState/get_q_out/{tag}", 
+                    lambda s=state, o=jnts_q.clone() if with_torch_view else jnts_q.copy(): \
+                        s.jnts_state.get(data_type="q", out=o))
+                self._add(f"JntsState/set_q/{tag}", 
+                    lambda s=state, d=jnts_q: s.jnts_state.set(data=d, data_type="q"))
+                self._add(f"JntsState/get_q_rows/{tag}", 
+                    lambda s=state, i=robot_idxs: s.jnts_state.get(data_type="q", robot_idxs=i))
+                self._add(f"JntsState/set_q_rows/{tag}", 
+                    lambda s=state, d=jnts_q[robot_idxs, :], i=robot_idxs: \
+                        s.jnts_state.set(data=d, data_type="q", robot_idxs=i))
+                self._add(f"JntsState/get_q_row/{tag}", 
+                    lambda s=state: s.jnts_state.get(data_type="q", robot_idxs=0))
+                # RootState
+                self._add(f"RootState/get_q/{tag}", 
+                    lambda s=state: s.root_state.get(data_type="q"))
+                self._add(f"RootState/set_q/{tag}", 
+                    lambda s=state, d=root_q: s.root_state.set(data=d, data_type="q"))
+                self._add(f"RootState/get_twist/{tag}", 
+                    lambda s=state: s.root_state.get(data_type="twist"))
+                if remapped:
+                    continue # the following ones do not depend on remappings
+                # ContactWrenches
+                f_all = state.contact_wrenches.get(data_type="f")
+                f_all = f_all.clone() if with_torch_view else f_all.copy()
+                self._add(f"ContactWrenches/get_f/{backend}", 
+                    lambda s=state: s.contact_wrenches.get(data_type="f"))
+                self._add(f"ContactWrenches/set_f_per_contact/{backend}", 
+                    lambda s=state, d=f_all: [s.contact_wrenches.set(data=d[:, (3 * i):(3 * (i + 1))], 
+                                            data_type="f", contact_name=name) \
+                                        for i, name in enumerate(self._contact_names)])
+                self._add(f"ContactWrenches/set_f_all_contacts/{backend}", 
+                    lambda s=state, d=f_all: s.contact_wrenches.set_all_contacts(data=d, data_type="f"))
+                # FullRobState synchs
+                self._add(f"FullRobState/synch_to_shared_mem/{backend}", 
+                    lambda s=state: s.synch_to_shared_mem())
+                self._add(f"FullRobState/synch_from_shared_mem/{backend}", 
+                    lambda s=state: s.synch_from_shared_mem())
+                self._add(f"FullRobState/synch_from_shared_mem_rows/{backend}", 
+                    lambda s=state: s.synch_from_shared_mem(robot_idxs=self._robot_idxs))
+                self._add(f"FullRobState/synch_row_from_shared_mem/{backend}", 
+                    lambda s=state: s.synch_row_from_shared_mem(row_index=0))
+                self._add(f"FullRobState/synch_row_to_shared_mem/{backend}", 
+                    lambda s=state: s.synch_row_to_shared_mem(row_index=0))
+                self._add(f"JntsState/synch_all_read/{backend}", 
+                    lambda s=state: s.jnts_state.synch_all(read=True, retry=True))
+                self._add(f"JntsState/synch_row_read/{backend}", 
+                    lambda s=state: s.jnts_state.synch_retry(row_index=0, col_index=0,
+                                        n_rows=1, n_cols=s.jnts_state.n_cols, read=True))
+    
+    def _add_gpu_cases(self):
+
+        if not self._use_gpu:
+            self._skipped.append("GPU mirrors (CUDA not available)")
+            return
+        
+        def synchronized(fn):
+            # so that the timing includes the (possibly async) GPU work
+            def case():
+                fn()
+                torch.cuda.synchronize()
+            return case
+        
+        for remapped in [False, True]:
+            tag = "remapped" if remapped else "plain"
+            state = self._robot_state(suffix=f"gpu{int(remapped)}",
+                                with_torch_view=True,
+                                with_gpu_mirror=True,
+                                remapped=remapped)
+            self._add(f"JntsState/get_q_gpu/{tag}", 
+                synchronized(lambda s=state: s.jnts_state.get(data_type="q", gpu=True)))
+            self._add(f"RootState/get_q_gpu/{tag}", 
+                synchronized(lambda s=state: s.root_state.get(data_type="q", gpu=True)))
+            if remapped:
+                continue
+            self._add("FullRobState/synch_mirror_views_from_gpu", 
+                synchronized(lambda s=state: s.synch_mirror_views(from_gpu=True)))
+            self._add("FullRobState/synch_mirror_views_to_gpu", 
+                synchronized(lambda s=state: s.synch_mirror_views(from_gpu=False)))
+            self._add("FullRobState/synch_mirror_views_rows_to_gpu", 
+                synchronized(lambda s=state: s.synch_mirror_views(from_gpu=False, 
+                                                        robot_idxs=self._robot_idxs)))
+            self._add("FullRobState/synch_mirror_from_gpu", 
+                synchronized(lambda s=state: s.synch_mirror(from_gpu=True)))
+    
+    def _add_status_cases(self):
+
+        status = RhcStatus(is_server=True,
+                        cluster_size=self._n_robots,
+                        n_nodes=50,
+                        n_contacts=self._n_contacts,
+                        namespace=self._namespace + "Status",
+                        verbose=self._verbose,
+                        vlevel=VLevel.V1,
+                        force_reconnection=True,
+                        with_gpu_mirror=False,
+                        with_torch_view=False) # as on the controllers side
+        status.run()
+        self._shared_data.append(status)
+        self._add("RhcStatus/trigger_synch_all_write", 
+            lambda: status.trigger.synch_all(read=False, retry=True))
+        self._add("RhcStatus/trigger_synch_all_read", 
+            lambda: status.trigger.synch_all(read=True, retry=True))
+        self._add("RhcStatus/trigger_read_retry", 
+            lambda: status.trigger.read_retry(row_index=0, col_index=0))
+        self._add("RhcStatus/trigger_write_retry", 
+            lambda: status.trigger.write_retry(False, row_index=0, col_index=0))
+        self._add("RhcStatus/fails_synch_all_read", 
+            lambda: status.fails.synch_all(read=True, retry=True))
+        self._add("RhcStatus/rhc_cost_write_retry", 
+            lambda: status.rhc_cost.write_retry(0.0, row_index=0, col_index=0))
+        nodes_cost = np.zeros((1, status.n_nodes), dtype=np.float32)
+        self._add("RhcStatus/rhc_nodes_cost_write_retry", 
+            lambda: status.rhc_nodes_cost.write_retry(data=nodes_cost, row_index=0, col_index=0))
+        self._add("RhcStatus/heartbeat_write_retry", 
+            lambda: status.heartbeat.write_retry(1, row_index=0, col_index=0))
+    
+    def _add_imp_cases(self):
+        
+        imp_data = JntImpCntrlData(is_server=True,
+                            n_envs=self._n_robots,
+                            n_jnts=self._n_jnts,
+                            jnt_names=self._jnt_names,
+                            namespace=self._namespace + "Imp",
+                            verbose=self._verbose,
+                            vlevel=VLevel.V1,
+                            force_reconnection=True,
+                            safe=False,
+                            use_gpu=False)
+        imp_data.run()
+        self._shared_data.append(imp_data)
+        view = imp_data.imp_data_view
+        pos = view.get(data_type="pos").copy()
+        self._add("JntImpCntrlData/get_pos", 
+            lambda: view.get(data_type="pos"))
+        self._add("JntImpCntrlData/set_pos", 
+            lambda: view.set(data=pos, data_type="pos"))
+        self._add("JntImpCntrlData/synch_all_write", 
+            lambda: view.synch_all(read=False, retry=True))
+        self._add("JntImpCntrlData/synch_all_read", 
+            lambda: view.synch_all(read=True, retry=True))
+        self._add("JntImpCntrlData/synch_row_read", 
+            lambda: view.synch_retry(row_index=0, col_index=0, n_rows=1, n_cols=view.n_cols, read=True))
+
+    def _add_refs_cases(self):
+
+        refs = RhcRefs(namespace=self._namespace + "Refs",
+                    is_server=True,
+                    n_robots=self._n_robots,
+                    n_jnts=self._n_jnts,
+                    n_contacts=self._n_contacts,
+                    jnt_names=self._jnt_names,
+                    contact_names=self._contact_names,
+                    with_gpu_mirror=False,
+                    with_torch_view=False,
+                    force_reconnection=True,
+                    safe=False,
+                    verbose=self._verbose,
+                    vlevel=VLevel.V1)
+        refs.run()
+        self._shared_data.append(refs)
+        self._add("RhcRefs/rob_refs_synch_to_shared_mem", 
+            lambda: refs.rob_refs.synch_to_shared_mem())
+        self._add("RhcRefs/rob_refs_synch_row_from_shared_mem", 
+            lambda: refs.rob_refs.synch_row_from_shared_mem(row_index=0))
+        self._add("RhcRefs/phase_id_synch_all_read", 
+            lambda: refs.phase_id.synch_all(read=True, retry=True))
+        self._add("RhcRefs/contact_flags_synch_all_write", 
+            lambda: refs.contact_flags.synch_all(read=False, retry=True))
+
+    def _time(self,
+            case: Callable):
+        
+        # per-call time [ns] of each repeat
+        for _ in range(min(self._n_iters, 10)): # warmup
+            case()
+        samples = []
+        for _ in range(self._n_repeats):
+            start = time.perf_counter_ns()
+            for _ in range(self._n_iters):
+                case()
+            samples.append((time.perf_counter_ns() - start) / self._n_iters)
+        return samples
+    
+    def run(self,
+            name_filter: str = None): # only cases whose name contains this string
+        
+        try:
+            self._add_state_cases()
+            self._add_gpu_cases()
+            self._add_status_cases()
+            self._add_imp_cases()
+            self._add_refs_cases()
+
+            results = {}
+            for name, case in self._cases.items():
+                if name_filter is not None and name_filter not in name:
+                    continue
+                samples = self._time(case)
+                results[name] = {"min_ns": float(np.min(samples)), 
+                            "median_ns": float(np.median(samples))}
+        finally:
+            self.close()
+
+        return {"config": self.config(),
+            "host": {"platform": platform.platform(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "torch": torch.__version__},
+            "timestamp": time.time(),
+            "skipped": self._skipped,
+            "results": results}
+
+    def close(self):
+
+        for shared_data in self._shared_data:
+            shared_data.close()
+        self._shared_data = []
+
+def compare(results: Dict,
+        baseline: Dict,
+        tolerance: float = 0.2): # relative change of the min time considered significant
+    
+    # per-case ratio wrt the baseline (> 1 means slower)
+    if not results["config"] == baseline["config"]:
+        Journal.log("shared_data.py",
+            "compare",
+            f"Config {results['config']} differs from the baseline one {baseline['config']}.",
+            LogType.WARN,
+            throw_when_excep = True)
+    comparison = {"regressions": {}, "improvements": {}, "unchanged": {}, 
+            "new": [], "missing": []}
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            comparison["new"].append(name)
+            continue
+        ratio = result["min_ns"] / baseline["results"][name]["min_ns"]
+        if ratio > 1 + tolerance:
+            comparison["regressions"][name] = ratio
+        elif ratio < 1 - tolerance:
+            comparison["improvements"][name] = ratio
+        else:
+            comparison["unchanged"][name] = ratio
+    comparison["missing"] = [name for name in baseline["results"] if name not in results["results"]]
+    return comparison
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Shared data access paths micro-benchmarks")
+    parser.add_argument('--n_robots', type=int, default=64)
+    parser.add_argument('--n_jnts', type=int, default=12)
+    parser.add_argument('--n_contacts', type=int, default=4)
+    parser.add_argument('--n_iters', type=int, default=1000)
+    parser.add_argument('--n_repeats', type=int, default=5)
+    parser.add_argument('--filter', type=str, default=None, help='Only run cases containing this string')
+    parser.add_argument('--baseline', type=str, default="shared_data_baseline.json", 
+                    help='Baseline file (written if it does not exist)')
+    parser.add_argument('--update_baseline', action='store_true', help='Overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative change considered significant')
+    parser.add_argument('--output', type=str, default=None, help='Path of the JSON report')
+    parser.add_argument('--fail_on_regression', action='store_true', help='Exit with 1 if regressions are found')
+
+    args = parser.parse_args()
+
+    benchmark = SharedDataBenchmark(n_robots=args.n_robots,
+                            n_jnts=args.n_jnts,
+                            n_contacts=args.n_contacts,
+                            n_iters=args.n_iters,
+                            n_repeats=args.n_repeats)
+    results = benchmark.run(name_filter=args.filter)
+    
+    report = {"results": results, "comparison": None}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        report["comparison"] = compare(results=results, 
+                                baseline=baseline, 
+                                tolerance=args.tolerance)
+        for name, ratio in sorted(report["comparison"]["regressions"].items(), key=lambda item: -item[1]):
+            Journal.log("shared_data.py",
+                "__main__",
+                f"{name}: {ratio:.2f}x slower than baseline " + \
+                    f"({results['results'][name]['min_ns']:.0f} ns vs {baseline['results'][name]['min_ns']:.0f} ns)",
+                LogType.WARN,
+                throw_when_excep = True)
+    else:
+        with open(args.baseline, "w") as file:
+            file.write(json.dumps(results, indent=2))
+        Journal.log("shared_data.py",
+            "__main__",
+            f"Baseline written to {args.baseline}",
+            LogType.STAT,
+            throw_when_excep = True)
+    
+    report_json = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(report_json)
+    print(report_json)
+
+    if args.fail_on_regression and report["comparison"] is not None and \
+            len(report["comparison"]["regressions"]) > 0:
+        sys.exit(1)
@@ -40,7 +40,17 @@ class ControlClusterClient(ABC):
             isolated_cores_only: bool = False,
             core_ids_override_list: List[int] = None,
             verbose: bool = False,
-            debug: bool = False):
+            debug: bool = False,
+            use_workers: bool = False,
+            n_workers: int = None,
+            use_forkserver: bool = False,
+            preload_modules: List[str] = None,
+            topology_aware: bool = False,
+            load_balancing: bool = False,
+            balancing_period: float = 1.0,
+            supervise: bool = False,
+            max_respawns: int = 10,
+            hang_timeout: float = None):
 
         # ciao :D
         #        CR 
@@ -53,6 +63,41 @@ class ControlClusterClient(ABC):
         # in a isolated core, if they fit
         self.core_ids_override_list = core_ids_override_list
 
+        self.topology_aware = topology_aware # if True (and set_affinity), processes are placed 
+        # one per physical core, preferring the NUMA node holding the cluster shared memory
+        self._placement = None # cpu of each process (if topology aware)
+
+        self.load_balancing = load_balancing # if True (and set_affinity), processes are moved 
+        # at runtime between cores based on the controllers solve times (see LoadBalancer)
+        self.balancing_period = balancing_period # [s]
+        self._load_balancer = None
+        self._core_ids = []
+        self._process_cpus = [] # initial cpu of each process
+
+        self.supervise = supervise # if True, dead controller processes are respawned 
+        # into the same cluster slots (see ControllerSupervisor)
+        self.max_respawns = max_respawns # per process
+        self.hang_timeout = hang_timeout # [s] if not None, processes whose controllers stop 
+        # beating for longer than this are killed and respawned (requires supervise)
+        self._supervisor = None
+        self._ctx = None
+        self._worker_controllers = [] # controller idxs of each worker
+
+        self.use_workers = use_workers # if True, each process (worker) hosts multiple controllers,
+        # which share the same shared mem clients and are served from a single loop
+        self.n_workers = n_workers # defaults to the number of usable cores
+
+        self.use_forkserver = use_forkserver # if True (and not using fork), processes are forked 
+        # from a server process which imports the heavy modules only once
+        self.preload_modules = ["numpy", 
+                        "torch",
+                        "SharsorIPCpp.PySharsorIPC",
+                        "control_cluster_bridge.controllers.rhc"] # imported by the forkserver
+        if not self.__class__.__module__ == "__main__":
+            self.preload_modules.append(self.__class__.__module__) # usually imports the controller
+        if preload_modules is not None:
+            self.preload_modules = self.preload_modules + preload_modules
+
         from control_cluster_bridge.utilities.cpu_utils.core_utils import get_isolated_cores
         self.isolated_cores = get_isolated_cores()[1] # available isolated
         # cores 
@@ -84,6 +129,19 @@ class ControlClusterClient(ABC):
         if not self._terminated:
 
             self.terminate()
+    
+    def __getstate__(self):
+
+        # the client is pickled when starting processes with spawn or forkserver (bound
+        # method targets): runtime handles owned by the parent (shared mem clients, threads,
+        # processes) are not picklable and are not needed by the children
+        state = self.__dict__.copy()
+        state["_supervisor"] = None
+        state["cluster_stats"] = None
+        state["_load_balancer"] = None
+        state["_ctx"] = None
+        state["_processes"] = []
+        return state
         
     def _set_affinity(self, 
                 core_idxs: List[int], 
@@ -117,9 +175,15 @@ class ControlClusterClient(ABC):
 
     def _spawn_controller(self,
                     idx: int,
-                    available_cores: List[int]):
+                    available_cores: List[int],
+                    preferred_idxs: List[int] = None):
         
         # this runs in a child process for each controller
+        if preferred_idxs is not None:
+            from control_cluster_bridge.controllers.rhc import RHController
+            from control_cluster_bridge.controllers.worker_context import WorkerContext
+            RHController.set_worker_context(WorkerContext(preferred_idxs=preferred_idxs)) # e.g. slot 
+            # of a dead controller
         if self.set_affinity:
             # put rhc controller on a single specific core 
             self._set_affinity(core_idxs=[self._compute_process_affinity(idx, core_ids=available_cores)],
@@ -132,32 +196,96 @@ class ControlClusterClient(ABC):
         controller = self._generate_controller(idx=idx)
         controller.solve() # runs the solution loop
 
+    def _spawn_worker(self,
+                worker_idx: int,
+                controller_idxs: List[int],
+                available_cores: List[int],
+                preferred_idxs: List[int] = None):
+        
+        # this runs in a child process for each worker
+        if self.set_affinity:
+            # put the worker on a single specific core 
+            self._set_affinity(core_idxs=[self._compute_process_affinity(worker_idx, core_ids=available_cores)],
+                        controller_idx=controller_idxs[0])
+        if self.use_mp_fork:
+            self._set_affinity(core_idxs=available_cores,
+                        controller_idx=controller_idxs[0])
+        
+        from control_cluster_bridge.controllers.rhc import RHController
+        from control_cluster_bridge.controllers.worker_context import WorkerContext
+        context = WorkerContext(share_clients=True, # controllers of this worker share the shared mem clients
+                        preferred_idxs=preferred_idxs)
+        RHController.set_worker_context(context)
+        
+        controllers = []
+        for idx in controller_idxs:
+            controllers.append(self._generate_controller(idx=idx))
+        
+        while True:
+            try:
+                # the server triggers all controllers at once, so requests 
+                # can be served in order (pending triggers are not lost)
+                for controller in controllers:
+                    controller.process_request()
+            except KeyboardInterrupt:
+                for controller in controllers:
+                    controller._close()
+                context.close_shared_clients()
+                break
+
     def run(self):
-            
-        self._spawn_processes()
         
-        from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
         from perf_sleep.pyperfsleep import PerfSleep
 
-        self.cluster_stats = RhcProfiling(is_server=False, 
-                                    name=self._namespace,
-                                    verbose=self._verbose,
-                                    vlevel=VLevel.V2,
-                                    safe=True)
+        self._spawn_processes()
         
-        self.cluster_stats.run()
+        self._init_cluster_stats()
         self.cluster_stats.write_info(dyn_info_name="cluster_ready",
                                     val=self._is_cluster_ready)
+        
+        if self.load_balancing and self.set_affinity and not self.use_mp_fork:
+            from control_cluster_bridge.cluster_client.load_balancer import LoadBalancer
+            self._load_balancer = LoadBalancer(namespace=self._namespace,
+                                        processes=self._processes,
+                                        process_cpus=self._process_cpus,
+                                        cpus=self._core_ids,
+                                        period=self.balancing_period,
+                                        verbose=self._verbose)
+            self._load_balancer.start()
+        
+        if self.supervise:
+            from control_cluster_bridge.cluster_client.supervisor import ControllerSupervisor
+            self._supervisor = ControllerSupervisor(namespace=self._namespace,
+                                        processes=self._processes,
+                                        respawn=self._respawn_process,
+                                        cluster_stats=self.cluster_stats,
+                                        max_respawns=self.max_respawns,
+                                        hang_timeout=self.hang_timeout,
+                                        verbose=self._verbose)
 
         while True:
             try:
                 nsecs =  1000000000 # 1 sec
                 PerfSleep.thread_sleep(nsecs) # we just keep it alive
+                if self._supervisor is not None:
+                    self._supervisor.step() # respawns dead controllers
                 continue
             except KeyboardInterrupt:
                 self.terminate() # closes all processes
                 break
 
+    def _init_cluster_stats(self):
+
+        from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+
+        self.cluster_stats = RhcProfiling(is_server=False, 
+                                    name=self._namespace,
+                                    verbose=self._verbose,
+                                    vlevel=VLevel.V2,
+                                    safe=True)
+        
+        self.cluster_stats.run()
+
     def terminate(self):
         
         Journal.log(self.__class__.__name__,
@@ -165,6 +293,8 @@ class ControlClusterClient(ABC):
                         "terminating cluster...",
                         LogType.STAT,
                         throw_when_excep = True)
+        if self._load_balancer is not None:
+            self._load_balancer.stop()
         self._close_processes() # we terminate all the child processes
         self._close_shared_mem() # and close the used shared memory
         self._terminated = True
@@ -181,6 +311,8 @@ class ControlClusterClient(ABC):
                     LogType.STAT)
     
     def _close_shared_mem(self):
+        if self._supervisor is not None:
+            self._supervisor.close()
         if self.cluster_stats is not None:
             self.cluster_stats.close()
 
@@ -242,17 +374,54 @@ class ControlClusterClient(ABC):
 
         # assign process_index to a single core 
         # in the core ids list
+        if self._placement is not None:
+            return self._placement[process_index]
         num_cores = len(core_ids)
         return core_ids[process_index % num_cores]
+    
+    def _plan_placement(self,
+                    n_processes: int,
+                    core_ids: List[int]):
+        
+        from control_cluster_bridge.utilities.cpu_utils.core_utils import plan_core_placement, get_shm_numa_node
+        from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+        
+        # the cluster shared mem has to be mapped to retrieve the NUMA node holding its pages
+        # (temporary client, closed before spawning: the client is pickled with spawn/forkserver)
+        cluster_stats = RhcProfiling(is_server=False, 
+                                name=self._namespace,
+                                verbose=self._verbose,
+                                vlevel=VLevel.V2,
+                                safe=True)
+        cluster_stats.run()
+        numa_node = get_shm_numa_node(self._namespace) # None if not available
+        cluster_stats.close()
+        placement, report = plan_core_placement(n_processes=n_processes,
+                                        allowed_cpus=core_ids,
+                                        numa_node=numa_node)
+        if len(placement) == 0:
+            Journal.log(self.__class__.__name__,
+                    "_plan_placement",
+                    f"{report} Falling back to default placement.",
+                    LogType.WARN,
+                    throw_when_excep = True)
+            return
+        self._placement = placement
+        Journal.log(self.__class__.__name__,
+                "_plan_placement",
+                f"Placement plan: {report} Cpus: {self._placement}",
+                LogType.STAT,
+                throw_when_excep = True)
 
     def _spawn_processes(self):
         
-        ctx = None
         if self.use_mp_fork:
-            ctx = mp.get_context('fork')
+            self._ctx = mp.get_context('fork')
+        elif self.use_forkserver:
+            self._ctx = mp.get_context('forkserver')
+            self._ctx.set_forkserver_preload(self.preload_modules)
         else:
-            ctx = mp.get_context('spawn')
-            # ctx = mp.get_context('forkserver')
+            self._ctx = mp.get_context('spawn')
         
         Journal.log(self.__class__.__name__,
                         "_spawn_processes",
@@ -269,18 +438,18 @@ class ControlClusterClient(ABC):
             # ini case user wants to set core ids manually
             core_ids = self.core_ids_override_list
 
-        for i in range(0, self.cluster_size):
-            info = f"Spawning process for controller n.{i}."
-            Journal.log(self.__class__.__name__,
-                    "_spawn_processes",
-                    info,
-                    LogType.STAT,
-                    throw_when_excep = True)
-            process = ctx.Process(target=self._spawn_controller, 
-                            name=self.processes_basename + str(i),
-                            args=(i, core_ids))
-            self._processes.append(process)
-            self._processes[i].start()
+        n_processes = self._get_n_workers(core_ids) if self.use_workers else self.cluster_size
+        if self.set_affinity and self.topology_aware:
+            self._plan_placement(n_processes=n_processes, 
+                            core_ids=core_ids)
+        self._core_ids = core_ids
+        self._process_cpus = [self._compute_process_affinity(i, core_ids=core_ids) \
+                        for i in range(n_processes)] # same as the one set by each process
+
+        if self.use_workers:
+            self._worker_controllers = self._get_worker_controllers(n_processes)
+        for i in range(0, n_processes):
+            self._processes.append(self._start_process(process_idx=i))
             
         self._is_cluster_ready = True
 
@@ -290,6 +459,61 @@ class ControlClusterClient(ABC):
                     LogType.STAT,
                     throw_when_excep = True)
 
+    def _get_worker_controllers(self,
+                        n_workers: int):
+        
+        # contiguous blocks of controller idxs, one for each worker
+        base, extra = divmod(self.cluster_size, n_workers)
+        blocks = []
+        start = 0
+        for i in range(n_workers):
+            n = base + (1 if i < extra else 0)
+            blocks.append(list(range(start, start + n)))
+            start += n
+        return blocks
+    
+    def _get_n_workers(self,
+                    core_ids: List[int]):
+        
+        n_workers = self.n_workers if self.n_workers is not None else len(core_ids)
+        return max(1, min(n_workers, self.cluster_size))
+    
+    def _start_process(self,
+                    process_idx: int,
+                    preferred_idxs: List[int] = None):
+        
+        if self.use_workers:
+            controller_idxs = self._worker_controllers[process_idx]
+            info = f"Spawning worker n.{process_idx} for controllers {controller_idxs[0]}-{controller_idxs[-1]}."
+            process = self._ctx.Process(target=self._spawn_worker, 
+                            name=self.processes_basename + "Worker" + str(process_idx),
+                            args=(process_idx, controller_idxs, self._core_ids, preferred_idxs))
+        else:
+            info = f"Spawning process for controller n.{process_idx}."
+            process = self._ctx.Process(target=self._spawn_controller, 
+                            name=self.processes_basename + str(process_idx),
+                            args=(process_idx, self._core_ids, preferred_idxs))
+        Journal.log(self.__class__.__name__,
+                "_start_process",
+                info,
+                LogType.STAT,
+                throw_when_excep = True)
+        process.start()
+        return process
+    
+    def _respawn_process(self,
+                    process_idx: int,
+                    preferred_idxs: List[int]):
+        
+        self._processes[process_idx].join(timeout=0) # reap the dead process
+        process = self._start_process(process_idx=process_idx,
+                            preferred_idxs=preferred_idxs)
+        if self._load_balancer is not None:
+            self._load_balancer.on_respawn(process_idx=process_idx,
+                                    process=process,
+                                    cpu=self._process_cpus[process_idx])
+        return process
+
     @abstractmethod
     def _generate_controller(self,
                         idx: int):
@@ -0,0 +1,244 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import SolveDtHist
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import HIST_N_BINS, HIST_BIN_EDGES
+
+from SharsorIPCpp.PySharsorIPC import Journal, LogType
+from SharsorIPCpp.PySharsorIPC import VLevel
+
+from typing import List
+
+import os
+import time
+import threading
+
+import numpy as np
+
+class LoadBalancer:
+
+    # Runtime balancing of controller processes over cores: the mean solve times
+    # of each controller over the last period (from the always-on RhcProfiling data)
+    # are filtered with an EMA and, if the load of
+    # the most loaded core exceeds the one of the least loaded core by more than
+    # an hysteresis threshold, the slowest process of the former which can be
+    # moved without creating a new hot spot is re-pinned to the latter
+    # (at most one migration per period and one per process per cooldown).
+    # Note: solve times are published by controllers with a profiling level of at
+    # least "counters" (cumulative solve loop time) or, with the "full" level or in debug 
+    # mode, through the latency histograms.
+    # The balancer runs on its own thread, with its own RhcProfiling client (shared mem 
+    # mirrors are not thread safe); respawns have to be notified through on_respawn()
+
+    def __init__(self,
+            namespace: str,
+            processes: List,
+            process_cpus: List[int],
+            cpus: List[int],
+            period: float = 1.0, # [s]
+            ema_alpha: float = 0.2,
+            hysteresis: float = 0.3, # relative load imbalance triggering a migration
+            cooldown: float = 10.0, # [s] min time between migrations of the same process
+            verbose: bool = False):
+
+        self._cluster_stats = RhcProfiling(is_server=False, 
+                                    name=namespace,
+                                    verbose=verbose,
+                                    vlevel=VLevel.V2,
+                                    safe=True) # only used by the balancing thread
+        self._cluster_stats.run()
+        self._processes = processes
+        self._process_cpus = list(process_cpus) # current cpu of each process
+        self._cpus = list(set(cpus)) # cpus over which processes can be moved
+
+        self._period = period
+        self._ema_alpha = ema_alpha
+        self._hysteresis = hysteresis
+        self._cooldown = cooldown
+
+        self._verbose = verbose
+
+        self._ema = np.full((self._cluster_stats.cluster_size, ), fill_value=np.nan)
+        self._last_migration = [-np.inf] * len(self._processes)
+
+        self._migrations = [] # (time, process name, pid, from cpu, to cpu, from load, to load)
+
+        # cumulative data at the last period (solve times are computed from their increments)
+        self._last_n_solves = None
+        self._last_dt_sum = None
+        self._last_hist = None
+        hist_col = SolveDtHist.metrics.index("solve_loop_dt") * HIST_N_BINS
+        self._hist_cols = slice(hist_col, hist_col + HIST_N_BINS)
+        self._bin_centers = np.sqrt(HIST_BIN_EDGES[:-1] * HIST_BIN_EDGES[1:])
+        self._warned_no_data = False
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock() # processes and their cpus are also updated upon respawns
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._run,
+                                name="LoadBalancer",
+                                daemon=True)
+        self._thread.start()
+
+    def stop(self):
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._cluster_stats.close()
+
+    def on_respawn(self,
+            process_idx: int,
+            process,
+            cpu: int):
+
+        # a respawned process pins itself to its initial cpu, regardless of past migrations
+        with self._lock:
+            self._processes[process_idx] = process
+            self._process_cpus[process_idx] = cpu
+            self._last_migration[process_idx] = time.monotonic() # its load has to settle first
+
+    def get_migrations(self):
+
+        return list(self._migrations)
+
+    def _run(self):
+
+        while not self._stop_event.wait(self._period):
+            try:
+                with self._lock:
+                    self.step()
+            except Exception as e:
+                Journal.log(self.__class__.__name__,
+                    "_run",
+                    f"Balancing step failed: {e}",
+                    LogType.WARN,
+                    throw_when_excep = True)
+
+    def _read_solve_times(self):
+
+        # mean solve loop time of each controller since the last period, from the
+        # cumulative counters or, where these are not published, from the histograms
+        # (nan for controllers which did not solve, or whose counters were reset, e.g. upon respawn)
+        profiling = self._cluster_stats.get_cntrl_profiling()
+        n_solves = np.nan_to_num(profiling["n_solves"])
+        dt_sum = np.nan_to_num(profiling["solve_loop_dt_sum"])
+        self._cluster_stats.solve_dt_hist.synch_all(read=True, retry=True)
+        hist = self._cluster_stats.solve_dt_hist.get_numpy_mirror()[:, self._hist_cols].copy()
+        if self._last_n_solves is None:
+            self._last_n_solves, self._last_dt_sum, self._last_hist = n_solves, dt_sum, hist
+            return None # no increments yet
+
+        solve_dt = np.full(n_solves.shape, fill_value=np.nan)
+        new_solves = n_solves - self._last_n_solves
+        from_counters = new_solves > 0
+        solve_dt[from_counters] = (dt_sum - self._last_dt_sum)[from_counters] / new_solves[from_counters]
+
+        new_samples = hist - self._last_hist
+        n_new_samples = new_samples.sum(axis=1)
+        from_hist = ~from_counters & (n_new_samples > 0) & np.all(new_samples >= 0, axis=1)
+        solve_dt[from_hist] = (new_samples[from_hist] @ self._bin_centers) / n_new_samples[from_hist]
+
+        self._last_n_solves, self._last_dt_sum, self._last_hist = n_solves, dt_sum, hist
+        return solve_dt
+
+    def step(self):
+
+        solve_dt = self._read_solve_times()
+        if solve_dt is None:
+            return
+        if np.all(np.isnan(solve_dt)):
+            if not self._warned_no_data:
+                Journal.log(self.__class__.__name__,
+                    "step",
+                    "No solve times available (controllers need a profiling level of at least \"counters\").",
+                    LogType.WARN,
+                    throw_when_excep = True)
+                self._warned_no_data = True
+            return
+
+        # EMA of solve times (first sample initializes the filter)
+        available = ~np.isnan(solve_dt)
+        first = available & np.isnan(self._ema)
+        self._ema[first] = solve_dt[first]
+        update = available & ~first
+        self._ema[update] = self._ema_alpha * solve_dt[update] + \
+            (1 - self._ema_alpha) * self._ema[update]
+
+        # load of each process and of each cpu
+        self._cluster_stats.process_ids.synch_all(read=True, retry=True)
+        pids = self._cluster_stats.process_ids.get_numpy_mirror()[:, 0]
+        process_loads = []
+        for process in self._processes:
+            controllers = (pids == process.pid)
+            process_loads.append(np.nansum(self._ema[controllers]) if controllers.any() else 0.0)
+        cpu_loads = dict.fromkeys(self._cpus, 0.0)
+        for i, cpu in enumerate(self._process_cpus):
+            cpu_loads[cpu] = cpu_loads.get(cpu, 0.0) + process_loads[i]
+
+        max_cpu = max(cpu_loads, key=cpu_loads.get)
+        min_cpu = min(cpu_loads, key=cpu_loads.get)
+        max_load = cpu_loads[max_cpu]
+        min_load = cpu_loads[min_cpu]
+        if max_load <= 0 or (max_load - min_load) / max_load < self._hysteresis:
+            return # balanced enough
+
+        now = time.monotonic()
+        candidates = [i for i, cpu in enumerate(self._process_cpus) \
+                if cpu == max_cpu and self._processes[i].is_alive() and \
+                    (now - self._last_migration[i]) > self._cooldown]
+        candidates.sort(key=lambda i: process_loads[i], reverse=True) # slowest first
+        for i in candidates:
+            if min_load + process_loads[i] < max_load: # no new hot spot
+                self._migrate(process_idx=i,
+                        to_cpu=min_cpu,
+                        from_load=max_load,
+                        to_load=min_load)
+                break
+
+    def _migrate(self,
+            process_idx: int,
+            to_cpu: int,
+            from_load: float,
+            to_load: float):
+
+        process = self._processes[process_idx]
+        from_cpu = self._process_cpus[process_idx]
+        try:
+            os.sched_setaffinity(process.pid, [to_cpu])
+        except OSError as e:
+            Journal.log(self.__class__.__name__,
+                "_migrate",
+                f"Could not move {process.name} (pid {process.pid}) to cpu {to_cpu}: {e}",
+                LogType.WARN,
+                throw_when_excep = True)
+            return
+        self._process_cpus[process_idx] = to_cpu
+        self._last_migration[process_idx] = time.monotonic()
+        self._migrations.append((time.time(), process.name, process.pid,
+                            from_cpu, to_cpu, from_load, to_load))
+        Journal.log(self.__class__.__name__,
+            "_migrate",
+            f"Moved {process.name} (pid {process.pid}) from cpu {from_cpu} (load {from_load:.4f}) " + \
+                f"to cpu {to_cpu} (load {to_load:.4f}).",
+            LogType.STAT,
+            throw_when_excep = True)
@@ -0,0 +1,235 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.utilities.shared_data.rhc_data import RhcStatus
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+from control_cluster_bridge.utilities.shared_data.step_packet import StepPacket
+
+from SharsorIPCpp.PySharsorIPC import Journal, LogType
+from SharsorIPCpp.PySharsorIPC import VLevel
+
+from typing import List, Callable
+
+import time
+
+import numpy as np
+
+class ControllerSupervisor:
+
+    # Detects dead controller processes (by exit code), cleans up the cluster
+    # slots they were registered to and respawns them into the same slots.
+    # Respawns are reported to the server by incrementing the RhcStatus respawn
+    # counters of the slots; controllers are not ready (and hence not triggered
+    # by a server tolerating respawns) until their re-initialization completes.
+    # Optionally, processes whose controllers' heartbeats are all stale for longer
+    # than a hang timeout are considered hung: they are killed and then respawned
+
+    def __init__(self,
+            namespace: str,
+            processes: List,
+            respawn: Callable, # respawn(process_idx, preferred_idxs) -> new process
+            cluster_stats: RhcProfiling,
+            max_respawns: int = 10, # per process
+            hang_timeout: float = None, # [s]
+            verbose: bool = False):
+
+        self._namespace = namespace
+        self._processes = processes
+        self._respawn = respawn
+        self._cluster_stats = cluster_stats
+
+        self._max_respawns = max_respawns
+        self._hang_timeout = hang_timeout
+        self._n_respawns = [0] * len(self._processes)
+        self._given_up = [False] * len(self._processes) # processes which reached max_respawns
+
+        self._verbose = verbose
+
+        self._events = [] # (time, process name, exit code, slots)
+
+        self._rhc_status = RhcStatus(is_server=False,
+                                namespace=self._namespace,
+                                verbose=self._verbose,
+                                vlevel=VLevel.V2,
+                                with_torch_view=False,
+                                with_gpu_mirror=False)
+        self._rhc_status.run()
+
+        self._step_packet = None # registration flags are also on the step packet (if used by the server)
+        self._cluster_stats.synch_info()
+        step_packet = self._cluster_stats.get_info(info_name="step_packet")
+        if step_packet is not None and step_packet > 0.5:
+            self._step_packet = StepPacket(namespace=self._namespace,
+                                is_server=False,
+                                verbose=self._verbose,
+                                vlevel=VLevel.V2) # flags only
+            self._step_packet.run()
+
+        self._slots = [[] for _ in range(len(self._processes))] # last known slots of each process
+
+        self._last_beats = None
+        self._last_beat_time = None
+
+    def close(self):
+
+        self._rhc_status.close()
+        if self._step_packet is not None:
+            self._step_packet.close()
+
+    def get_events(self):
+
+        return list(self._events)
+
+    def step(self):
+
+        self._update_slots()
+        if self._hang_timeout is not None:
+            self._kill_hung()
+        for i in range(len(self._processes)):
+            process = self._processes[i]
+            if process.exitcode is None:
+                continue # alive (or not started)
+            if self._given_up[i]:
+                continue
+            if self._n_respawns[i] >= self._max_respawns:
+                self._give_up(process_idx=i)
+                continue
+            self._handle_dead(process_idx=i)
+
+    def _update_slots(self):
+
+        # slots of each live process (a process only publishes its pid when ready)
+        self._cluster_stats.process_ids.synch_all(read=True, retry=True)
+        pids = self._cluster_stats.process_ids.get_numpy_mirror()[:, 0]
+        for i, process in enumerate(self._processes):
+            if process.exitcode is None and process.pid is not None:
+                slots = np.flatnonzero(pids == process.pid).tolist()
+                if len(slots) > 0:
+                    self._slots[i] = slots
+
+    def _kill_hung(self):
+
+        self._rhc_status.heartbeat.synch_all(read=True, retry=True)
+        beats = self._rhc_status.heartbeat.get_numpy_mirror()[:, 0]
+        now = time.monotonic()
+        if self._last_beats is None:
+            self._last_beats = beats.copy()
+            self._last_beat_time = np.full((beats.shape[0], ), fill_value=now)
+        changed = beats != self._last_beats
+        self._last_beats[changed] = beats[changed]
+        self._last_beat_time[changed] = now
+        stale = (now - self._last_beat_time) > self._hang_timeout
+        for i, process in enumerate(self._processes):
+            slots = self._slots[i]
+            if process.exitcode is not None or len(slots) == 0:
+                continue
+            if np.all(stale[slots]):
+                Journal.log(self.__class__.__name__,
+                    "_kill_hung",
+                    f"Process {process.name} (pid {process.pid}) did not beat for more than " + \
+                        f"{self._hang_timeout} s. Killing it.",
+                    LogType.WARN,
+                    throw_when_excep = True)
+                process.kill()
+                process.join() # its exit code is now available
+                self._last_beat_time[slots] = now # the respawned process gets a full timeout
+
+    def _handle_dead(self,
+            process_idx: int):
+
+        process = self._processes[process_idx]
+        slots = self._slots[process_idx]
+
+        Journal.log(self.__class__.__name__,
+            "_handle_dead",
+            f"Process {process.name} (pid {process.pid}) died with exit code {process.exitcode}. " + \
+                f"Cleaning up slots {slots} and respawning.",
+            LogType.WARN,
+            throw_when_excep = True)
+
+        self._clean_slots(slots=slots)
+
+        self._n_respawns[process_idx] += 1
+        self._events.append((time.time(), process.name, process.exitcode, list(slots)))
+        self._processes[process_idx] = self._respawn(process_idx, slots)
+
+    def _give_up(self,
+            process_idx: int):
+
+        # slots are still cleaned (once), so that the server stops triggering them
+        process = self._processes[process_idx]
+        slots = self._slots[process_idx]
+
+        Journal.log(self.__class__.__name__,
+            "_give_up",
+            f"Process {process.name} (pid {process.pid}) died with exit code {process.exitcode} " + \
+                f"after {self._n_respawns[process_idx]} respawns. Cleaning up slots {slots} " + \
+                "without respawning it.",
+            LogType.WARN,
+            throw_when_excep = True)
+
+        self._clean_slots(slots=slots, report_respawn=False)
+
+        self._given_up[process_idx] = True
+        self._events.append((time.time(), process.name, process.exitcode, list(slots)))
+
+    def _clean_slots(self,
+            slots: List[int],
+            report_respawn: bool = True):
+
+        if len(slots) == 0:
+            return # the process died before registering or publishing its pid
+
+        # same semaphores used by controllers upon (un)registration
+        self._rhc_status.registration.data_sem_acquire()
+        self._rhc_status.controllers_counter.data_sem_acquire()
+
+        self._rhc_status.registration.synch_all(retry=True, read=True)
+        registrations = self._rhc_status.registration.get_numpy_mirror()
+        n_registered = int(registrations[slots, 0].sum())
+        registrations[slots, 0] = False
+        self._rhc_status.registration.synch_all(retry=True, read=False)
+        if self._step_packet is not None:
+            for slot in slots:
+                self._step_packet.write_flag(name="registered", value=False, row_index=slot)
+
+        self._rhc_status.controllers_counter.synch_all(retry=True, read=True)
+        controllers_counter = self._rhc_status.controllers_counter.get_numpy_mirror()
+        controllers_counter -= n_registered
+        self._rhc_status.controllers_counter.synch_all(retry=True, read=False)
+
+        self._rhc_status.controllers_counter.data_sem_release()
+        self._rhc_status.registration.data_sem_release()
+
+        for slot in slots:
+            self._rhc_status.ready.write_retry(False, row_index=slot, col_index=0)
+            self._rhc_status.activation_state.write_retry(False, row_index=slot, col_index=0)
+            if self._step_packet is not None:
+                self._step_packet.write_flag(name="active", value=False, row_index=slot)
+            self._rhc_status.trigger.write_retry(False, row_index=slot, col_index=0)
+            if self._step_packet is not None:
+                self._step_packet.clear_trigger(row_index=slot) # not pending anymore
+            self._cluster_stats.process_ids.write_retry(-1, row_index=slot, col_index=0)
+            self._rhc_status.heartbeat.write_retry(0, row_index=slot, col_index=0)
+
+        if not report_respawn:
+            return
+        # respawns are reported to the server
+        self._rhc_status.respawns.synch_all(retry=True, read=True)
+        respawns = self._rhc_status.respawns.get_numpy_mirror()
+        respawns[slots, 0] += 1
+        self._rhc_status.respawns.synch_all(retry=True, read=False)
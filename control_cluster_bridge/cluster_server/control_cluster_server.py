@@ -22,8 +22,16 @@ from control_cluster_bridge.utilities.shared_data.rhc_data import RobotState
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcCmds
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcStatus
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcRefs
+from control_cluster_bridge.utilities.shared_data.rhc_data import RhcSolRecord
+from control_cluster_bridge.utilities.shared_data.rhc_data import RhcSolHistory
 from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import InitPhasesDt
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import StepPhasesDt, StepPhasesHist
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import hist_bin_idxs
+from control_cluster_bridge.utilities.shared_data.step_packet import StepPacket
+from control_cluster_bridge.utilities.shared_data.gpu_staging import PinnedStaging
 from control_cluster_bridge.utilities.remote_triggering import RemoteTriggererSrvr
+from control_cluster_bridge.utilities.homing import RobotHomer
 
 from SharsorIPCpp.PySharsorIPC import VLevel, Journal, LogType
 
@@ -48,7 +56,19 @@ class ControlClusterServer(ABC):
             verbose = False, 
             vlevel: VLevel = VLevel.V1,
             debug = False, 
-            force_reconnection: bool = False):
+            force_reconnection: bool = False,
+            pipelined: bool = False,
+            straggler_deadline: int = None,
+            straggler_policy: str = "hold",
+            srdf_path: str = None,
+            sparse_trigger: bool = False,
+            packed_sol: bool = False,
+            step_packet: bool = False,
+            pinned_staging: bool = False,
+            seqlock: bool = False,
+            tolerate_respawns: bool = False,
+            heartbeat_timeout: float = None,
+            sol_history_depth: int = 0):
         
         self._verbose = verbose
         self._vlevel = vlevel
@@ -56,6 +76,75 @@ class ControlClusterServer(ABC):
         self._closed = False
         self._debug = debug
 
+        self._pipelined = pipelined # if True, trigger_solution() first collects the solution 
+        # of the request still being processed and then triggers the cluster with the latest state 
+        # (cluster solutions are overlapped with sim. steps, at the price of a one-step delay on cmds)
+
+        self._straggler_deadline = straggler_deadline # if not None, wait_for_solution() returns 
+        # after this deadline (same unit as the remote triggerer ack timeout) with whatever controllers
+        # have completed, instead of raising an exception
+        self._straggler_policy = straggler_policy # what to do with the cmds of late controllers
+        self._srdf_path = srdf_path # only used for the "homing" straggler policy
+        self._straggler_policies = ["hold", # keep the last collected cmd
+                            "homing", # homing config. with null vel. and effort
+                            "fail"] # keep the last collected cmd and mark controller as failed
+        if self._straggler_policy not in self._straggler_policies:
+            exception = f"Unknown straggler policy {self._straggler_policy}. " + \
+                f"Available: {', '.join(self._straggler_policies)}"
+            Journal.log(self.__class__.__name__,
+                "__init__",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        if self._straggler_policy == "homing" and self._srdf_path is None:
+            exception = "An srdf_path is needed when using the homing straggler policy!"
+            Journal.log(self.__class__.__name__,
+                "__init__",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        self._held_cmds = [] # last collected cmds (used for late controllers)
+        self._homing = None
+
+        self._sparse_trigger = sparse_trigger # if True, only active controllers are flagged for 
+        # solution and only their cmds rows are read back (and copied to GPU)
+
+        self._packed_sol = packed_sol # if True, controllers publish cmds and solution status 
+        # with a single write on a packed record, which is bulk-read here (note: RhcCmds and 
+        # RhcStatus solution data is then only updated in this server's mirrors)
+
+        self._use_step_packet = step_packet # if True, state and trigger flags are published 
+        # to controllers with a single write on a fused step packet, which also carries registration
+        # and activation flags. The two modes are mutually exclusive: RobotState (filled with nans)
+        # and RhcStatus trigger views on shared mem are then not updated, while registration and
+        # activation views are kept in sync by their writers. The packet is framed by its own 
+        # sequence numbers, so the seqlock (if enabled) is then only used for cmds
+
+        self._pinned_staging = pinned_staging # if True (and using GPU), CPU mirrors of states and cmds
+        # are pinned and CPU <-> GPU copies are non-blocking on a dedicated CUDA stream. Without GPU,
+        # states and cmds are staged through a mock CPU device instead: data is unchanged, but the
+        # staging copies (plain fallback) are run each step (e.g. to exercise them on CPU-only CI)
+        self._state_staging = None
+        self._cmds_staging = None
+
+        self._seqlock = seqlock # if True, states and cmds rows are published with per-row 
+        # sequence counters, so that readers can detect (and retry) torn reads without semaphores
+
+        self._tolerate_respawns = tolerate_respawns # if True, only ready controllers are triggered and
+        # waited for and controllers dying while solving do not cause an exception (to be used
+        # together with a supervised cluster client, which respawns dead controllers)
+        self._respawns = None
+
+        self._heartbeat_timeout = heartbeat_timeout # [s] if not None, registered controllers whose 
+        # heartbeat did not change within this timeout are considered stale: they are neither 
+        # triggered nor waited for (see get_stale_controllers())
+        self._last_beats = None
+        self._last_beat_time = None
+
+        self._sol_history_depth = sol_history_depth # if > 0, controllers publish the trajectories
+        # of their last sol_history_depth solutions on shared ring buffers (see get_sol_history())
+        self._sol_history = None
+
         self.jnt_names = jnt_names
         self.n_dofs = len(self.jnt_names)
         self.cluster_size = cluster_size
@@ -74,6 +163,8 @@ class ControlClusterServer(ABC):
         self._rhc_cmds = None
         self._rhc_refs = None
         self._rhc_status = None
+        self._sol_record = None
+        self._step_packet = None
         self._cluster_stats = None 
         self._remote_triggerer = None
         self._remote_triggerer_ack_timeout = 60000 # [ns]
@@ -86,8 +177,19 @@ class ControlClusterServer(ABC):
         # no need for this flags to be on GPU (if necessary copies are made on demand)
         self._now_active = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
         self._registered = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        # masks and n. of expected acks of the request in flight (in pipelined mode, pre_trigger() 
+        # for the next step overwrites the current ones before the request is collected)
+        self._triggered_active = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._triggered_registered = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._n_triggered_acks = 0
         self._prev_active_controllers = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
         self._failed = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._late = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._excluded = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu") # still 
+        # busy with a previous request when the last one was triggered
+        self._ready = torch.full(fill_value=True, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._just_respawned = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
+        self._stale = torch.full(fill_value=False, size=(self.cluster_size, 1), dtype=torch.bool, device="cpu")
 
         # other data
         self._n_contact_sensors = n_contact_sensors
@@ -104,6 +206,17 @@ class ControlClusterServer(ABC):
 
         self._print_frequency = 100 # number of "steps" at which sporadic logs are printed
 
+        # step phases profiling (always on): durations of the phases of each step are
+        # accumulated in histograms, which are published on shared mem every 
+        # self._print_frequency steps (see get_step_phases_dt() and get_step_phases_hist())
+        self._phase_idxs = {phase: i for i, phase in enumerate(StepPhasesDt.phases)}
+        self._phases_dt = np.full((len(StepPhasesDt.phases), ), fill_value=np.nan) # current step
+        self._last_phases_dt = self._phases_dt.copy() # last completed step
+        self._next_pre_trigger_dt = None # pipelined mode: pre-trigger of the next step, recorded
+        # while the previous request is still in flight
+        self._phases_hist = np.zeros((len(StepPhasesDt.phases), StepPhasesHist.n_bins), dtype=np.int64)
+        self._step_start = np.nan
+
     def __del__(self):     
         self.close()
 
@@ -151,7 +264,10 @@ class ControlClusterServer(ABC):
                                 force_reconnection=self._force_reconnection,
                                 verbose=True,
                                 vlevel=self._vlevel,
-                                safe=False)
+                                safe=False,
+                                with_seqlock=self._seqlock,
+                                fill_value=np.nan if self._use_step_packet else 0) # not
+                                # updated on shared mem when using the step packet
         self._rhc_cmds = RhcCmds(namespace=self._namespace,
                                 is_server=True,
                                 n_robots=self.cluster_size,
@@ -164,7 +280,8 @@ class ControlClusterServer(ABC):
                                 force_reconnection=self._force_reconnection,
                                 verbose=True,
                                 vlevel=self._vlevel,
-                                safe=False)
+                                safe=False,
+                                with_seqlock=self._seqlock)
         self._rhc_refs = RhcRefs(namespace=self._namespace,
                             is_server=True,
                             n_robots=self.cluster_size,
@@ -193,6 +310,10 @@ class ControlClusterServer(ABC):
         cluster_info_dict["cluster_size"] = self.cluster_size
         cluster_info_dict["cluster_dt"] = self._cluster_dt
         cluster_info_dict["low_level_control_dt"] = self._low_level_control_dt
+        cluster_info_dict["packed_sol"] = self._packed_sol # advertised to controllers
+        cluster_info_dict["step_packet"] = self._use_step_packet
+        cluster_info_dict["seqlock"] = self._seqlock
+        cluster_info_dict["sol_history_depth"] = self._sol_history_depth
         self._cluster_stats = RhcProfiling(cluster_size=self.cluster_size,
                                     param_dict=cluster_info_dict,
                                     is_server=True, 
@@ -211,11 +332,81 @@ class ControlClusterServer(ABC):
         self._rhc_refs.run()
         self._rhc_status.run()
         self._cluster_stats.run()          
+        if self._packed_sol:
+            self._sol_record = RhcSolRecord(namespace=self._namespace,
+                                is_server=True,
+                                cluster_size=self.cluster_size,
+                                n_jnts=self.n_dofs,
+                                n_contacts=self._n_contact_sensors,
+                                n_nodes=self._rhc_status.n_nodes,
+                                verbose=self._verbose,
+                                vlevel=self._vlevel,
+                                force_reconnection=self._force_reconnection,
+                                with_torch_view=True)
+            self._sol_record.run()
+        if self._sol_history_depth > 0:
+            self._sol_history = RhcSolHistory(namespace=self._namespace,
+                                is_server=True,
+                                cluster_size=self.cluster_size,
+                                depth=self._sol_history_depth,
+                                n_jnts=self.n_dofs,
+                                n_contacts=self._n_contact_sensors,
+                                n_nodes=self._rhc_status.n_nodes,
+                                verbose=self._verbose,
+                                vlevel=self._vlevel,
+                                force_reconnection=self._force_reconnection)
+            self._sol_history.run()
+        if self._use_step_packet:
+            self._step_packet = StepPacket(namespace=self._namespace,
+                                is_server=True,
+                                n_robots=self.cluster_size,
+                                n_jnts=self.n_dofs,
+                                n_contacts=self._n_contact_sensors,
+                                verbose=self._verbose,
+                                vlevel=self._vlevel,
+                                force_reconnection=self._force_reconnection,
+                                with_torch_view=True)
+            self._step_packet.run()
+        if self._pinned_staging:
+            staging_device = "cuda" if self._using_gpu else "cpu"
+            self._state_staging = PinnedStaging(views=[self._robot_states.root_state,
+                                            self._robot_states.jnts_state,
+                                            self._robot_states.contact_wrenches],
+                                        device=staging_device,
+                                        verbose=self._verbose,
+                                        vlevel=self._vlevel)
+            self._cmds_staging = PinnedStaging(views=[self._rhc_cmds.root_state,
+                                            self._rhc_cmds.jnts_state,
+                                            self._rhc_cmds.contact_wrenches],
+                                        device=staging_device,
+                                        verbose=self._verbose,
+                                        vlevel=self._vlevel)
+
+        if self._straggler_deadline is not None:
+            self._init_straggler_handling()
+
+    def _init_straggler_handling(self):
+
+        self._held_cmds = [(self._rhc_cmds.root_state, 
+                        self._rhc_cmds.root_state.get_torch_mirror(gpu=False).clone()),
+                    (self._rhc_cmds.jnts_state, 
+                        self._rhc_cmds.jnts_state.get_torch_mirror(gpu=False).clone()),
+                    (self._rhc_cmds.contact_wrenches, 
+                        self._rhc_cmds.contact_wrenches.get_torch_mirror(gpu=False).clone())]
+        if self._straggler_policy == "homing":
+            homer = RobotHomer(srdf_path=self._srdf_path, 
+                            jnt_names_prb=list(self.jnt_names)) # homing in the env-side jnt order
+            self._homing = torch.from_numpy(homer.get_homing()).reshape(1, self.n_dofs)
     
     def close(self):
         # close all shared memory
         if not self._closed:
             self._closed = True
+            # staging first (unpins the CPU mirrors of the views)
+            if self._state_staging is not None:
+                self._state_staging.close()
+            if self._cmds_staging is not None:
+                self._cmds_staging.close()
             if self._robot_states is not None:
                 self._robot_states.close()
             if self._rhc_cmds is not None:
@@ -224,11 +415,71 @@ class ControlClusterServer(ABC):
                 self._rhc_refs.close()
             if self._rhc_status is not None:
                 self._rhc_status.close()
+            if self._sol_record is not None:
+                self._sol_record.close()
+            if self._step_packet is not None:
+                self._step_packet.close()
+            if self._sol_history is not None:
+                self._sol_history.close()
             if self._cluster_stats is not None:
                 self._cluster_stats.close()
             if self._remote_triggerer is not None:
                 self._remote_triggerer.close()
 
+    def wait_for_ready_controllers(self,
+                    n_controllers: int = None,
+                    timeout: float = None,
+                    poll_dt: float = 0.05):
+        
+        # startup barrier: blocks until at least n_controllers (defaults to the 
+        # cluster size) have completed their initialization or until timeout [s]
+        self._check_running()
+        n_expected = self.cluster_size if n_controllers is None else n_controllers
+        start = time.perf_counter()
+        while True:
+            self._rhc_status.ready.synch_all(read=True, retry=True)
+            n_ready = self._rhc_status.ready.get_torch_mirror(gpu=False).sum().item()
+            if n_ready >= n_expected:
+                break
+            if timeout is not None and (time.perf_counter() - start) > timeout:
+                Journal.log(self.__class__.__name__,
+                    "wait_for_ready_controllers",
+                    f"Only {n_ready}/{n_expected} controllers ready after {timeout} s.",
+                    LogType.WARN,
+                    throw_when_excep = True)
+                return False
+            time.sleep(poll_dt)
+        
+        init_dt = self.get_init_phases_dt()
+        phases_info = ", ".join([f"{phase}: {np.nanmean(dt):.3f}/{np.nanmax(dt):.3f}" \
+                            for phase, dt in init_dt.items()])
+        Journal.log(self.__class__.__name__,
+            "wait_for_ready_controllers",
+            f"{n_ready} controllers ready after {time.perf_counter() - start:.2f} s. " + \
+                f"Init phases mean/max [s] -> {phases_info}",
+            LogType.STAT,
+            throw_when_excep = True)
+        return True
+
+    def get_step_phases_dt(self):
+
+        # duration [s] of each phase of the last completed step (nan if not executed)
+        return {phase: self._last_phases_dt[i].item() for i, phase in enumerate(StepPhasesDt.phases)}
+    
+    def get_step_phases_hist(self):
+
+        # cumulative histograms (counts) of the durations of each step phase, 
+        # together with the edges [s] of their bins
+        hists = {phase: self._phases_hist[i, :].copy() for i, phase in enumerate(StepPhasesDt.phases)}
+        return hists, StepPhasesHist.bin_edges.copy()
+
+    def get_init_phases_dt(self):
+        
+        # duration [s] of each init phase for each controller (nan if not ready)
+        self._cluster_stats.init_phases_dt.synch_all(read=True, retry=True)
+        init_dt = self._cluster_stats.init_phases_dt.get_numpy_mirror()
+        return {phase: init_dt[:, i].copy() for i, phase in enumerate(InitPhasesDt.phases)}
+    
     def n_controllers(self):
         return self._n_controllers_connected
     
@@ -259,20 +510,50 @@ class ControlClusterServer(ABC):
         # to perform operations in between depending on the controllers status) 
         if self._debug:
             self._check_running()
-        self._rhc_status.registration.synch_all(read=True,
-                                        retry=True)
-        self._rhc_status.activation_state.synch_all(read=True, 
-                                        retry=True)
+        start = time.perf_counter()
+        if self._use_step_packet:
+            # both flags are retrieved with a single read
+            registered, active = self._step_packet.read_flags()
+            registered = registered > 0.5
+            active = active > 0.5
+        else:
+            self._rhc_status.registration.synch_all(read=True,
+                                            retry=True)
+            self._rhc_status.activation_state.synch_all(read=True, 
+                                            retry=True)
+            registered = self._rhc_status.registration.get_torch_mirror(gpu=False)
+            active = self._rhc_status.activation_state.get_torch_mirror(gpu=False)
         # all active controllers will be triggered
-        self._registered[:, :] = self._rhc_status.registration.get_torch_mirror(gpu=False)
+        self._registered[:, :] = registered
         self._prev_active_controllers[:, :] = self._now_active
-        self._now_active[:, :] = self._rhc_status.activation_state.get_torch_mirror(gpu=False) & \
-                            self._rhc_status.registration.get_torch_mirror(gpu=False) # controllers have to be registered
+        self._now_active[:, :] = active & registered # controllers have to be registered
                             # to be considered active
+        if self._tolerate_respawns:
+            # respawned controllers are only triggered after their initialization is complete
+            self._update_ready()
+            self._now_active[:, :] = self._now_active & self._ready
+        if self._heartbeat_timeout is not None:
+            # stale controllers would only make us wait for the whole ack timeout
+            self._update_liveness()
+            self._now_active[:, :] = self._now_active & ~self._stale
+        if self._pipelined and self.triggered():
+            # the phases of the request in flight are still being accounted: the
+            # duration is restored after its collection (see trigger_solution())
+            self._next_pre_trigger_dt = time.perf_counter() - start
+        else:
+            self._phase_end("pre_trigger", start)
         self._pre_trigger_counter +=1
     
     def trigger_solution(self):
         # performs checks and triggers cluster solution
+        if self._pipelined and self.triggered():
+            # we collect the solution of the previous request (which was computed while 
+            # the sim. was stepping) before publishing the new state. Shared states and cmds
+            # are single-buffered, so at most one request can be in flight at a time
+            self.wait_for_solution()
+        if self._next_pre_trigger_dt is not None:
+            self._phases_dt[self._phase_idxs["pre_trigger"]] = self._next_pre_trigger_dt
+            self._next_pre_trigger_dt = None
         if self._debug:
             # we profile the whole solution pipeline
             self._check_running()
@@ -280,6 +561,7 @@ class ControlClusterServer(ABC):
             self._pre_trigger_logs() # debug info + checks
             self._require_pretrigger() # we force sequentiality between pretriggering and
             # solution triggering
+        self._step_start = time.perf_counter()
         self._set_rhc_state() # set the state employed by the controllers in the cluster       
         self._trigger_solution() # triggers solution of all controllers in the cluster 
         # which are ACTIVE using the latest available state
@@ -288,12 +570,33 @@ class ControlClusterServer(ABC):
         self._trigger_counter +=1
     
     def _trigger_solution(self):
-        # trigger all
+        start = time.perf_counter()
+        if self._straggler_deadline is not None:
+            self._update_excluded() # uses the masks of the previous request
+        self._triggered_active[:, :] = self._now_active & ~self._excluded
+        self._triggered_registered[:, :] = self._registered
+        self._n_triggered_acks = self._n_expected_acks()
         trigger = self._rhc_status.trigger.get_torch_mirror()
-        trigger[:, :] = True
-        self._rhc_status.trigger.synch_all(read=False, retry=True)
+        if self._sparse_trigger:
+            # only active controllers will solve; the others will 
+            # just ack the request (the triggerer wakes up all listening controllers)
+            trigger[:, :] = self._now_active
+        else:
+            # trigger all
+            trigger[:, :] = True
+        # excluded controllers keep their flag set, so that they can still be 
+        # detected as pending until they complete the previous request
+        trigger[:, :] = trigger | self._excluded
+        if self._use_step_packet:
+            # state and trigger flags published with a single write
+            self._step_packet.publish(robot_state=self._robot_states,
+                                trigger=trigger,
+                                seq=self._trigger_counter)
+        else:
+            self._rhc_status.trigger.synch_all(read=False, retry=True)
         self._remote_triggerer.trigger() # signal to listening controllers to process
         # request
+        self._phase_end("trigger", start)
 
     def wait_for_solution(self):
         if self._debug:
@@ -301,8 +604,10 @@ class ControlClusterServer(ABC):
             self._require_trigger() # we force sequentiality between triggering and
             # solution retrieval
         self._wait_for_solution() # we wait for controllers to finish processing the trigger request
-        self._get_rhc_sol() # not super efficient, but safe: in theory we should read solution only from 
-        # controllers which where triggered (i.e. ACTIVE ones)
+        self._get_rhc_sol(from_trigger=True) # reads all cmds (safe) or, if using sparse triggering, only 
+        # the ones of controllers which where triggered (i.e. ACTIVE ones)
+        self._phase_end("step", self._step_start)
+        self._update_step_phases()
         if self._debug:
             self._solution_time = time.perf_counter() - self._start_time # we profile the whole solution pipeline
             # and update some shared debug info
@@ -316,20 +621,160 @@ class ControlClusterServer(ABC):
         self._was_running = self._is_running
         self._solution_counter += 1
     
+    def poll_solution(self):
+        # non-blocking check on the last trigger request: controllers reset their
+        # trigger flag only after having written their cmds, so once all registered 
+        # controllers have cleared it the solution can be collected without waiting
+        if not self.triggered():
+            return False
+        return not self._read_pending().any().item()
+
+    def collect_ready(self):
+        # collects the solution only if it's ready, without blocking (returns True 
+        # if a solution was collected)
+        if self.poll_solution():
+            self.wait_for_solution() # acks are either already there or about to arrive
+            return True
+        return False
+
     def _wait_for_solution(self):
 
-        if not self._remote_triggerer.wait_ack_from(self.cluster_size, 
-                                self._remote_triggerer_ack_timeout):
-            Journal.log(self.__class__.__name__,
-                "_wait_for_solution",
-                f"Didn't receive any or all acks from controllers (expected {self.cluster_size})!",
-                LogType.EXCEP,
-                throw_when_excep = True)
+        start = time.perf_counter()
+        if self._straggler_deadline is None:
+            if not self._wait_acks(timeout=self._remote_triggerer_ack_timeout):
+                Journal.log(self.__class__.__name__,
+                    "_wait_for_solution",
+                    f"Didn't receive any or all acks from controllers (expected {self._n_triggered_acks})!",
+                    LogType.EXCEP,
+                    throw_when_excep = True)
+        else:
+            self._wait_with_deadline()
+        start = self._phase_end("ack_wait", start)
         
         # update flags (written by controllers upon solution request)
         self._rhc_status.fails.synch_all(read=True,
                                     retry=True)
         self._failed[:,:] = self._rhc_status.fails.get_torch_mirror(gpu=False)
+        self._phase_end("fails_synch", start)
+        if self._straggler_policy == "fail":
+            self._failed[:, :] = self._failed | self._late
+
+    def _wait_with_deadline(self):
+        
+        if self._wait_acks(timeout=self._straggler_deadline):
+            self._late[:, :] = self._excluded
+        else:
+            # controllers clear their trigger flag after having written their cmds,
+            # so stragglers are the registered ones which still have it set
+            self._late[:, :] = self._read_pending() | self._excluded
+            self._sporadic_log(calling_methd="wait_for_solution",
+                msg = f"{self._late.sum().item()} controllers did not complete within the deadline.",
+                logtype=LogType.WARN)
+    
+    def _update_excluded(self):
+
+        # stragglers which are still processing an older request are left out of the next one: 
+        # re-setting their trigger flag would let them clear it upon completing the old request,
+        # i.e. the new request would be silently skipped. Excluded controllers are considered
+        # late for the new request and are triggered again once they have cleared their flag.
+        if self._late.any():
+            self._excluded[:, :] = self._late & self._read_pending()
+        else:
+            self._excluded[:, :] = False
+    
+    def _n_expected_acks(self):
+
+        # every listening controller acks every trigger; if respawns are
+        # tolerated, only ready controllers are listening
+        if self._tolerate_respawns:
+            listening = self._ready
+        else:
+            listening = torch.ones_like(self._ready)
+        if self._heartbeat_timeout is not None:
+            listening = listening & ~self._stale
+        return int(listening.sum().item())
+        
+    def _wait_acks(self,
+            timeout,
+            n_expected: int = None): # defaults to the acks expected for the last triggered request
+
+        if n_expected is None:
+            n_expected = self._n_triggered_acks
+        if self._remote_triggerer.wait_ack_from(n_expected, timeout):
+            return True
+        if self._tolerate_respawns:
+            # some controllers may have died while processing the request
+            self._update_ready()
+            n_ready = int(self._ready.sum().item())
+            if n_ready < n_expected:
+                Journal.log(self.__class__.__name__,
+                    "_wait_acks",
+                    f"{n_expected - n_ready} controllers died while processing the request " + \
+                        f"(expected {n_expected} acks). Proceeding without them.",
+                    LogType.WARN,
+                    throw_when_excep = True)
+                return True
+        return False
+    
+    def _update_ready(self):
+
+        # reads ready flags and respawn counters of all controllers
+        self._rhc_status.ready.synch_all(read=True, retry=True)
+        self._ready[:, :] = self._rhc_status.ready.get_torch_mirror(gpu=False)
+        self._rhc_status.respawns.synch_all(read=True, retry=True)
+        respawns = self._rhc_status.respawns.get_torch_mirror(gpu=False)
+        if self._respawns is None:
+            self._respawns = respawns.clone()
+        self._just_respawned[:, :] = respawns > self._respawns
+        if self._just_respawned.any():
+            respawned = torch.nonzero(self._just_respawned.squeeze(dim=1)).squeeze(dim=1).tolist()
+            Journal.log(self.__class__.__name__,
+                "_update_ready",
+                f"Controllers {respawned} were respawned.",
+                LogType.WARN,
+                throw_when_excep = True)
+        self._respawns[:, :] = respawns
+
+    def _update_liveness(self):
+
+        # heartbeats are counters: the time of their last change is tracked here, 
+        # so that no clock has to be shared with the controllers
+        self._rhc_status.heartbeat.synch_all(read=True, retry=True)
+        beats = self._rhc_status.heartbeat.get_numpy_mirror()[:, 0]
+        now = time.monotonic()
+        if self._last_beats is None:
+            self._last_beats = beats.copy()
+            self._last_beat_time = np.full((self.cluster_size, ), fill_value=now)
+        changed = beats != self._last_beats
+        self._last_beats[changed] = beats[changed]
+        self._last_beat_time[changed] = now
+        stale = torch.from_numpy((now - self._last_beat_time) > self._heartbeat_timeout)
+        self._stale[:, :] = stale.unsqueeze(dim=1) & self._registered
+
+    def _read_pending(self):
+
+        # controllers registered when the last request was triggered which still have to complete it
+        if self._use_step_packet:
+            return (self._step_packet.read_triggers() > 0.5) & self._triggered_registered
+        self._rhc_status.trigger.synch_all(read=True, retry=True)
+        return self._rhc_status.trigger.get_torch_mirror(gpu=False) & self._triggered_registered
+    
+    def _handle_stragglers(self):
+        
+        # applies the straggler policy on the (CPU) cmds of late controllers
+        # and updates the held cmds with the latest ones
+        late = self._late.squeeze(dim=1)
+        if late.any():
+            for view, held in self._held_cmds:
+                view.get_torch_mirror(gpu=False)[late, :] = held[late, :]
+            if self._straggler_policy == "homing":
+                n_late = late.sum().item()
+                null_action = torch.zeros((n_late, self.n_dofs), dtype=self._homing.dtype)
+                self._rhc_cmds.jnts_state.set(data=self._homing.expand(n_late, -1), data_type="q", robot_idxs=late)
+                self._rhc_cmds.jnts_state.set(data=null_action, data_type="v", robot_idxs=late)
+                self._rhc_cmds.jnts_state.set(data=null_action, data_type="eff", robot_idxs=late)
+        for view, held in self._held_cmds:
+            held[:, :] = view.get_torch_mirror(gpu=False)
 
     def reset_controllers(self,
                     idxs: torch.Tensor = None):
@@ -345,12 +790,14 @@ class ControlClusterServer(ABC):
             resets[:, :] = True
             self._rhc_status.resets.synch_all(read=False, retry=True)
         # send signal to listening controllers to process request
+        if self._tolerate_respawns:
+            self._update_ready()
+        n_expected = self._n_expected_acks()
         self._remote_triggerer.trigger() 
-        if not self._remote_triggerer.wait_ack_from(self.cluster_size, 
-                            self._remote_triggerer_ack_timeout):
+        if not self._wait_acks(timeout=self._remote_triggerer_ack_timeout, n_expected=n_expected):
             Journal.log(self.__class__.__name__,
                 "reset_controllers",
-                f"Didn't receive any or all acks from controllers (expected {self.cluster_size})!",
+                f"Didn't receive any or all acks from controllers (expected {n_expected})!",
                 LogType.EXCEP,
                 throw_when_excep = True)
         
@@ -366,6 +813,9 @@ class ControlClusterServer(ABC):
             activations = self._rhc_status.activation_state.get_torch_mirror()
             activations[idxs, :] = True
             self._rhc_status.activation_state.synch_all(read=False, retry=True)
+            if self._use_step_packet:
+                for idx in torch.arange(self.cluster_size)[idxs].tolist():
+                    self._step_packet.write_flag(name="active", value=True, row_index=idx)
       
     def get_actions(self):
 
@@ -383,6 +833,56 @@ class ControlClusterServer(ABC):
 
         return self._rhc_status
     
+    def set_internal_streaming(self,
+            decimation: int = 10,
+            fields: List[str] = None,
+            robot_idxs: torch.Tensor = None):
+
+        # RhcInternal streaming settings of controllers created with stream_internal 
+        # (decimation 0 disables streaming; if fields is None, controllers use their defaults).
+        # Controllers pick up new settings periodically, not immediately
+        streaming = self._rhc_status.internal_streaming.get_torch_mirror()
+        all_fields = RhcStatus.InternalStreamingView.fields
+        if fields is not None:
+            for field in fields:
+                if field not in all_fields:
+                    Journal.log(self.__class__.__name__,
+                        "set_internal_streaming",
+                        f"Unknown field {field}. Available fields: {all_fields}",
+                        LogType.EXCEP,
+                        throw_when_excep = True)
+            flags = torch.tensor([[int(field in fields) for field in all_fields]], 
+                            dtype=streaming.dtype)
+        else:
+            flags = torch.full((1, len(all_fields)), fill_value=-1, dtype=streaming.dtype)
+        if robot_idxs is None:
+            robot_idxs = torch.arange(self.cluster_size)
+        else:
+            robot_idxs = robot_idxs.cpu()
+        streaming[robot_idxs, 0] = decimation
+        streaming[robot_idxs, 1:] = flags
+        self._rhc_status.internal_streaming.synch_all(read=False, retry=True)
+
+    def get_sol_history(self,
+            k: int = 1,
+            robot_idxs: torch.Tensor = None):
+
+        # last k solution trajectories of the given controllers, as a single
+        # (n_robots x k x n_cols) array (use RhcSolHistory.get() to extract q, v, a, f)
+        if self._sol_history is None:
+            Journal.log(self.__class__.__name__,
+                "get_sol_history",
+                "Solution history is not enabled (sol_history_depth is 0)!",
+                LogType.EXCEP,
+                throw_when_excep = True)
+        if robot_idxs is not None:
+            robot_idxs = robot_idxs.cpu().numpy()
+        return self._sol_history.read_last(k=k, robot_idxs=robot_idxs)
+    
+    def get_sol_history_view(self):
+
+        return self._sol_history
+    
     def get_stats(self):
 
         return self._cluster_stats
@@ -468,6 +968,59 @@ class ControlClusterServer(ABC):
             # no controller active
             return None
     
+    def get_stale_controllers(self,
+                    gpu=False):
+
+        # registered controllers whose heartbeat was found stale at 
+        # the last pre-trigger (only available if heartbeat_timeout is set)
+        stale = torch.nonzero(self._stale.squeeze(dim=1)).squeeze(dim=1)
+        if not stale.shape[0] == 0:
+            if gpu:
+                return stale.cuda()
+            else:
+                return stale
+        else:
+            # no stale controller
+            return None
+    
+    def get_straggler_mask(self,
+                    gpu=False):
+        
+        # mask of controllers which did not complete within the deadline
+        # during the last wait_for_solution() (always False if no deadline is used)
+        if gpu:
+            return self._late.cuda()
+        else:
+            return self._late
+        
+    def get_straggler_controllers(self,
+                    gpu=False):
+        
+        late = torch.nonzero(self._late.squeeze(dim=1)).squeeze(dim=1)
+        if not late.shape[0] == 0:
+            if gpu:
+                return late.cuda() # n_envs x 8 bits of CPU -> GPU (RX)
+            else:
+                return late
+        else:
+            # no straggler
+            return None
+    
+    def get_respawned_controllers(self,
+                    gpu=False):
+
+        # controllers whose respawn was detected at the last pre-trigger
+        # (only available if respawns are tolerated)
+        respawned = torch.nonzero(self._just_respawned.squeeze(dim=1)).squeeze(dim=1)
+        if not respawned.shape[0] == 0:
+            if gpu:
+                return respawned.cuda()
+            else:
+                return respawned
+        else:
+            # no controller respawned
+            return None
+    
     def get_registered_controllers(self,
                     gpu=False):
 
@@ -500,20 +1053,91 @@ class ControlClusterServer(ABC):
             # n_envs x 3232 bit -> with 160 env -> 0.51712MB
             # if the controllers runs at for example 0.03s
             # -> 17.24 MB/s of TX from GPU
-            self._robot_states.synch_mirror(from_gpu=True)
-        else:
-            # only write to shared mem (gpu mirror is not used)
+            start = time.perf_counter()
+            if self._state_staging is not None:
+                self._state_staging.to_cpu()
+                self._state_staging.fence() # the state has to be on CPU before being published
+            else:
+                self._robot_states.synch_mirror_views(from_gpu=True)
+            self._phase_end("state_to_cpu", start)
+        elif self._state_staging is not None:
+            # mock device: the latest state is already on the CPU mirrors, so it's staged
+            # there and back (same copies as with a GPU)
+            start = time.perf_counter()
+            self._state_staging.to_gpu()
+            self._state_staging.to_cpu()
+            self._state_staging.fence()
+            self._phase_end("state_to_cpu", start)
+        if not self._use_step_packet: # otherwise written with the step packet
+            start = time.perf_counter()
             self._robot_states.synch_to_shared_mem()
+            self._phase_end("state_write", start)
 
-    def _get_rhc_sol(self):
+    def _get_rhc_sol(self,
+                from_trigger: bool = False):
 
+        robot_idxs = None
+        if self._sparse_trigger and from_trigger:
+            # only cmds of triggered controllers are read (the others are 
+            # kept to their last value)
+            # (mask saved upon triggering, since in pipelined mode the current one already refers to the next step)
+            robot_idxs = torch.nonzero(self._triggered_active.squeeze(dim=1)).squeeze(dim=1)
+        start = time.perf_counter()
+        if self._cmds_staging is not None:
+            self._cmds_staging.fence() # previous copy to GPU has to be completed
+            # before the CPU mirrors are overwritten
+        if self._packed_sol:
+            self._sol_record.read(robot_idxs=robot_idxs) # single bulk read of cmds and status
+            self._sol_record.unpack(rhc_cmds=self._rhc_cmds,
+                            rhc_status=self._rhc_status,
+                            robot_idxs=robot_idxs)
+        else:
+            self._rhc_cmds.synch_from_shared_mem(robot_idxs=robot_idxs) # read cmds from shared mem
+        if from_trigger and self._straggler_deadline is not None:
+            self._handle_stragglers() # cmds of late controllers are overwritten
+        if from_trigger:
+            start = self._phase_end("sol_read", start)
         if self._using_gpu:
-            self._rhc_cmds.synch_mirror(from_gpu=False) # read from shared mem and then copy to GPU
+            if self._cmds_staging is not None:
+                self._cmds_staging.to_gpu(robot_idxs=robot_idxs) # non-blocking copy to GPU
+            else:
+                self._rhc_cmds.synch_mirror_views(from_gpu=False,
+                                    robot_idxs=robot_idxs) # copy to GPU
             # in a similar way to the rhc_state, this requires a copy, this time, from CPU to GPU (RX) of
             # n_envs x 3232 bit / update_dt
-        else:
-            # only read cmds from shared mem
-            self._rhc_cmds.synch_from_shared_mem()
+            if from_trigger:
+                self._phase_end("sol_to_gpu", start)
+        elif self._cmds_staging is not None:
+            self._cmds_staging.to_gpu(robot_idxs=robot_idxs) # to the mock device
+            if from_trigger:
+                self._phase_end("sol_to_gpu", start)
+
+    def _phase_end(self,
+            phase: str,
+            start: float):
+
+        # records the duration of a phase of the current step and returns 
+        # the end time (so that it can be used as start of the next phase)
+        now = time.perf_counter()
+        self._phases_dt[self._phase_idxs[phase]] = now - start
+        return now
+
+    def _update_step_phases(self):
+        
+        # accumulates the phases of the completed step and periodically publishes them
+        done = np.flatnonzero(~np.isnan(self._phases_dt))
+        self._phases_hist[done, hist_bin_idxs(self._phases_dt[done])] += 1
+        self._last_phases_dt[:] = self._phases_dt
+        self._phases_dt[:] = np.nan
+        if (self._solution_counter + 1) % self._print_frequency == 0:
+            self._publish_step_phases()
+
+    def _publish_step_phases(self):
+
+        self._cluster_stats.step_phases_dt.get_numpy_mirror()[0, :] = self._last_phases_dt
+        self._cluster_stats.step_phases_dt.synch_all(read=False, retry=True)
+        self._cluster_stats.step_phases_hist.get_numpy_mirror()[:, :] = self._phases_hist
+        self._cluster_stats.step_phases_hist.synch_all(read=False, retry=True)
 
     def _require_pretrigger(self):
         if not self.pretriggered():
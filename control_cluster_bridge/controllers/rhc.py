@@ -18,13 +18,20 @@
 from abc import ABC, abstractmethod
 
 import time 
+import os
 
 from control_cluster_bridge.utilities.shared_data.rhc_data import RobotState
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcCmds
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcStatus
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcInternal
+from control_cluster_bridge.utilities.shared_data.rhc_data import RhcSolRecord
+from control_cluster_bridge.utilities.shared_data.rhc_data import RhcSolHistory
 from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import SolveDtHist
+from control_cluster_bridge.utilities.shared_data.step_packet import StepPacket
 from control_cluster_bridge.utilities.remote_triggering import RemoteTriggererClnt
+from control_cluster_bridge.controllers.warmstart import WarmStartCache
+from control_cluster_bridge.controllers.worker_context import WorkerContext
 
 from control_cluster_bridge.utilities.homing import RobotHomer
 from control_cluster_bridge.utilities.cpu_utils.core_utils import get_memory_usage
@@ -32,7 +39,7 @@ from control_cluster_bridge.utilities.cpu_utils.core_utils import get_memory_usa
 from SharsorIPCpp.PySharsorIPC import VLevel
 from SharsorIPCpp.PySharsorIPC import Journal, LogType
 
-from typing import List, TypeVar, Union
+from typing import List, Dict, TypeVar, Union
 
 import numpy as np
 
@@ -40,6 +47,9 @@ from perf_sleep.pyperfsleep import PerfSleep
 
 class RHController(ABC):
 
+    _worker_context = None # context of the process creating controllers (see set_worker_context()):
+    # controllers created without one get their own
+
     def __init__(self, 
             srdf_path: str,
             n_nodes: int,
@@ -47,7 +57,12 @@ class RHController(ABC):
             namespace: str, # shared mem namespace
             dtype = np.float32, 
             verbose = False, 
-            debug = False):
+            debug = False,
+            warmstart: bool = False,
+            warmstart_decimation: int = 10, # good solutions are cached once every this many solves
+            stream_internal: bool = False,
+            profiling: str = "off",
+            profiling_flush_period: int = 100):
         
         self.namespace = namespace
         self._dtype = dtype
@@ -75,6 +90,40 @@ class RHController(ABC):
         self._profiling_data_dict["problem_update_dt"] = np.nan
         self._profiling_data_dict["phases_shift_dt"] = np.nan
         self._profiling_data_dict["task_ref_update"] = np.nan
+        # profiling data keys of the metrics for which latency histograms are kept
+        self._hist_metrics = {"solve_loop_dt": "full_solve_dt",
+                        "rti_sol_time": "rti_solve_dt",
+                        "prb_update_dt": "problem_update_dt",
+                        "phase_shift_dt": "phases_shift_dt",
+                        "task_ref_update_dt": "task_ref_update"}
+        self._hist_counts = None
+        self._hist_max = None
+
+        # profiling levels (independent of debug mode): data is accumulated 
+        # locally and flushed to RhcProfiling.cntrl_profiling with a single 
+        # write every profiling_flush_period solves
+        self._profiling_levels = ["off", 
+                        "counters", # n. of solves and fails and cumulative solve loop time
+                        "timers", # + duration of each phase of the last solve loop
+                        "full"] # + per-metric profiling data and latency histograms (at each solve,
+                        # as in debug mode, but without debug logs and internal data)
+        if profiling not in self._profiling_levels:
+            exception = f"Profiling level {profiling} not supported. " + \
+                f"Available: {self._profiling_levels}"
+            Journal.log(self.__class__.__name__,
+                "__init__",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        self._profiling_level = self._profiling_levels.index(profiling)
+        self._prof_timers = self._profiling_level >= self._profiling_levels.index("timers")
+        self._prof_full = self._profiling_level == self._profiling_levels.index("full") and \
+            not self._debug # in debug mode, profiling data is already written at each solve
+        self._profiling_flush_period = profiling_flush_period
+        self._prof_stamps = [0, 0, 0, 0] # [ns] start, state read, solved, cmds written
+        self._prof_n_solves = 0
+        self._prof_dt_sum = 0 # [ns]
+        self._prof_data = None
         
         self.n_dofs = None
         self.n_contacts = None
@@ -86,8 +135,16 @@ class RHController(ABC):
         self.cluster_stats = None
         self.robot_cmds = None
         self.rhc_refs = None
+        self._sol_record = None # packed solution record (only used if enabled by the server)
+        self._step_packet = None # fused state + trigger (only used if enabled by the server)
+        self._sol_history = None # ring buffer of recent solutions (only used if enabled by the server)
         self._remote_triggerer = None
         self._remote_triggerer_timeout = 120000 # [ns]
+        self._heartbeat_period = 1000 # [ns] the heartbeat is bumped at least this often while waiting
+        self._context = RHController._worker_context if RHController._worker_context is not None \
+            else WorkerContext()
+        self._owns_clients = self._context.shared_clients is None # shared clients are closed 
+        # by the owner of the context, not by the single controllers
         
         # jnt names
         self._env_side_jnt_names = []
@@ -112,6 +169,25 @@ class RHController(ABC):
 
         self._homer = None # robot homing manager
 
+        self._warmstart_cache = None # if enabled, last good solutions are cached and used
+        # to restart the solver after resets (see _set_initial_guess())
+        if warmstart:
+            self._warmstart_cache = WarmStartCache()
+        self._pending_warmstart = False
+        self._warned_no_warmstart = False
+        self._warmstart_decimation = max(1, warmstart_decimation)
+        self._n_good_sols = 0
+        self._uncached_descriptor = None # descriptor of the latest good solution, if not
+        # cached yet (the solution itself is only held by the solver until it's copied)
+
+        self._stream_internal = stream_internal # if True, internal data is published on RhcInternal
+        # also when not in debug mode, decimated and restricted to the fields selected at runtime
+        # through RhcStatus.internal_streaming (defaults are used for settings which are not set)
+        self._stream_decimation = 10 # [solves]
+        self._stream_fields = dict.fromkeys(RhcStatus.InternalStreamingView.fields, True)
+        self._stream_check_period = 100 # [solves] settings are read at this rate
+        self._n_solves = 0
+
         self._init()
 
     def __del__(self):
@@ -120,20 +196,41 @@ class RHController(ABC):
 
     def _close(self):
         self._unregister_from_cluster()
-        if self.robot_cmds is not None:
-            self.robot_cmds.close()
-        if self.robot_state is not None:
-            self.robot_state.close()
-        if self.rhc_status is not None:
-            self.rhc_status.close()
+        if self._owns_clients:
+            if self.robot_cmds is not None:
+                self.robot_cmds.close()
+            if self.robot_state is not None:
+                self.robot_state.close()
+            if self.rhc_status is not None:
+                self.rhc_status.close()
+            if self.cluster_stats is not None:
+                self.cluster_stats.close()
+            if self._sol_record is not None:
+                self._sol_record.close()
+            if self._step_packet is not None:
+                self._step_packet.close()
+            if self._sol_history is not None:
+                self._sol_history.close()
         if self.rhc_internal is not None:
             self.rhc_internal.close()
-        if self.cluster_stats is not None:
-            self.cluster_stats.close()
         if self._remote_triggerer is not None:
             self._remote_triggerer.close()
         self._closed = True
 
+    @classmethod
+    def set_worker_context(cls,
+                context: WorkerContext):
+        # to be called in a process before creating its controllers, which will all
+        # use the given context (shared mem clients, preferred slots and heartbeats); 
+        # all controllers in the process are assumed to be of the same type
+        RHController._worker_context = context
+    
+    def _get_client(self,
+            name: str,
+            factory):
+        
+        return self._context.get_client(name, factory)
+
     def init_rhc_task_cmds(self):
         
         self.rhc_refs = self._init_rhc_task_cmds()
@@ -141,41 +238,58 @@ class RHController(ABC):
     def _init_states(self):
         
         quat_remap = self._get_quat_remap()
-        self.robot_state = RobotState(namespace=self.namespace,
-                                is_server=False,
-                                q_remapping=quat_remap, # remapping from environment to controller
-                                with_gpu_mirror=False,
-                                with_torch_view=False, 
-                                safe=False,
-                                verbose=self._verbose,
-                                vlevel=VLevel.V2) 
-        self.robot_state.run()
-        self.robot_cmds = RhcCmds(namespace=self.namespace,
-                                is_server=False,
-                                q_remapping=quat_remap, # remapping from environment to controller
-                                with_gpu_mirror=False,
-                                with_torch_view=False, 
-                                safe=False,
-                                verbose=self._verbose,
-                                vlevel=VLevel.V2) 
-        self.robot_cmds.run()
+        seqlock = self.cluster_stats.get_info(info_name="seqlock") # has to match the server
+        with_seqlock = seqlock is not None and seqlock > 0.5
+        self.robot_state = self._get_client("robot_state",
+                                lambda: RobotState(namespace=self.namespace,
+                                        is_server=False,
+                                        q_remapping=quat_remap, # remapping from environment to controller
+                                        with_gpu_mirror=False,
+                                        with_torch_view=False, 
+                                        safe=False,
+                                        verbose=self._verbose,
+                                        vlevel=VLevel.V2,
+                                        with_seqlock=with_seqlock))
+        self.robot_cmds = self._get_client("robot_cmds",
+                                lambda: RhcCmds(namespace=self.namespace,
+                                        is_server=False,
+                                        q_remapping=quat_remap, # remapping from environment to controller
+                                        with_gpu_mirror=False,
+                                        with_torch_view=False, 
+                                        safe=False,
+                                        verbose=self._verbose,
+                                        vlevel=VLevel.V2,
+                                        with_seqlock=with_seqlock))
     
     def _rhc(self):
+        if self._profiling_level > 0:
+            self._prof_stamps[0] = time.perf_counter_ns()
         if self._debug:
             self._rhc_db()
         else:
             self._rhc_min()
+        if self._profiling_level > 0:
+            self._profile_solve()
     
     def _rhc_db(self):
         # rhc with debug data
         if self._debug:
             self._start_time = time.perf_counter()
 
-        self.robot_state.synch_from_shared_mem() # updates robot state with
-        # latest data on shared mem
+        self._read_state() # updates robot state with latest data on shared mem 
+        # (only the row of this controller is read)
+        if self._prof_timers:
+            self._prof_stamps[1] = time.perf_counter_ns()
         if not self.failed():
             # we can solve only if not in failure state
+            if self._pending_warmstart:
+                self._warmstart()
             self._failed = not self._solve() # solve actual TO
+            if not self._failed:
+                self._on_good_solution()
+                self._write_sol_history()
+            else:
+                self._uncached_descriptor = None # the solver's solution is not a good one anymore
             if (self._failed): 
                 # perform failure procedure
                 self._on_failure()                       
@@ -195,13 +309,20 @@ class RHController(ABC):
                             " Use the reset() method to continue solving!",
                         LogType.WARN)
             
+        if self._prof_timers:
+            self._prof_stamps[2] = time.perf_counter_ns()
         self._write_cmds_from_sol() # we update update the views of the cmds
         # from the latest solution
+        if self._prof_timers:
+            self._prof_stamps[3] = time.perf_counter_ns()
     
         if self._debug:
             # if in debug, rhc internal state is streamed over 
-            # shared mem.
-            self._update_rhc_internal()
+            # shared mem (decimated, if streaming is enabled)
+            if self._stream_internal:
+                self._stream_rhc_internal()
+            else:
+                self._update_rhc_internal()
             self._profiling_data_dict["full_solve_dt"] = time.perf_counter() - self._start_time
             self._update_profiling_data() # updates all profiling data
             if self._verbose:
@@ -211,17 +332,24 @@ class RHController(ABC):
                     LogType.INFO,
                     throw_when_excep = True) 
             
-        self.rhc_status.trigger.write_retry(False, 
-                                row_index=self.controller_index,
-                                col_index=0) # allow next solution trigger 
+        self._clear_trigger() # allow next solution trigger 
 
     def _rhc_min(self):
 
-        self.robot_state.synch_from_shared_mem() # updates robot state with
-        # latest data on shared mem
+        self._read_state() # updates robot state with latest data on shared mem 
+        # (only the row of this controller is read)
+        if self._prof_timers:
+            self._prof_stamps[1] = time.perf_counter_ns()
         if not self.failed():
             # we can solve only if not in failure state
+            if self._pending_warmstart:
+                self._warmstart()
             self._failed = not self._solve() # solve actual TO
+            if not self._failed:
+                self._on_good_solution()
+                self._write_sol_history()
+            else:
+                self._uncached_descriptor = None # the solver's solution is not a good one anymore
             if (self._failed):  
                 # perform failure procedure
                 self._on_failure()                       
@@ -241,11 +369,15 @@ class RHController(ABC):
                             " Use the reset() method to continue solving!",
                         LogType.WARN)
                     
+        if self._prof_timers:
+            self._prof_stamps[2] = time.perf_counter_ns()
         self._write_cmds_from_sol() # we update the views of the cmds
         # from the latest solution even if failed
-        self.rhc_status.trigger.write_retry(False, 
-                                row_index=self.controller_index,
-                                col_index=0) # allow next solution trigger
+        if self._prof_timers:
+            self._prof_stamps[3] = time.perf_counter_ns()
+        if self._stream_internal:
+            self._stream_rhc_internal()
+        self._clear_trigger() # allow next solution trigger
             
     def solve(self):
         
@@ -253,34 +385,59 @@ class RHController(ABC):
         # using cond. variables (efficient)
         while True:
             try: 
-                # we are always listening for a trigger signal 
-                if not self._remote_triggerer.wait(self._remote_triggerer_timeout):
-                    Journal.log(self.__class__.__name__,
-                        "solve",
-                        "Didn't receive any remote trigger req within timeout!",
-                        LogType.EXCEP,
-                        throw_when_excep = True)
-                self._received_trigger = True
-                # signal received -> we process incoming requests
-                # perform reset, if required
-                if self.rhc_status.resets.read_retry(row_index=self.controller_index,
-                                                col_index=0)[0]:
-                    self.reset() # rhc is reset
-                # check if a trigger request was received
-                if self.rhc_status.trigger.read_retry(row_index=self.controller_index,
-                            col_index=0)[0]:
-                    self._rhc() # run solution
-                self._remote_triggerer.ack() # send ack signal to server
-                self._received_trigger = False
+                self.process_request()
             except (KeyboardInterrupt):
                 self._close()
                 break
+    
+    def process_request(self):
+
+        # waits for a single remote request and serves it (can be
+        # used to serve multiple controllers from the same loop)
+        if not self._wait_for_request():
+            Journal.log(self.__class__.__name__,
+                "process_request",
+                "Didn't receive any remote trigger req within timeout!",
+                LogType.EXCEP,
+                throw_when_excep = True)
+        self._received_trigger = True
+        # signal received -> we process incoming requests
+        # perform reset, if required
+        if self.rhc_status.resets.read_retry(row_index=self.controller_index,
+                                        col_index=0)[0]:
+            self.reset() # rhc is reset
+        # check if a trigger request was received
+        if self._read_trigger():
+            self._rhc() # run solution
+        self._remote_triggerer.ack() # send ack signal to server
+        self._received_trigger = False
                 
+    def _wait_for_request(self):
+
+        # waits for a remote request in short slices, so that the heartbeat 
+        # keeps being bumped while idle (this allows to tell idle controllers
+        # from dead or hung ones)
+        waited = 0
+        while waited < self._remote_triggerer_timeout:
+            self._beat()
+            if self._remote_triggerer.wait(self._heartbeat_period):
+                return True
+            waited += self._heartbeat_period
+        return False
+    
+    def _beat(self):
+
+        # bumps the heartbeats of all the ready controllers of this process
+        self._context.beat(self.rhc_status.heartbeat)
+        
     def reset(self):
         
         if not self._closed:
+            self._flush_solution() # the solver's latest good solution is lost upon reset
             self._reset()
             self._failed = False # allow triggering
+            self._pending_warmstart = self._warmstart_cache is not None # applied on 
+            # the next solve, i.e. with the latest state
             self.set_cmds_to_homing()
             self._n_resets += 1
             self.rhc_status.fails.write_retry(False, 
@@ -321,8 +478,14 @@ class RHController(ABC):
         self.robot_cmds.jnts_state.set(data=null_action, data_type="v", robot_idxs=self.controller_index_np)
         self.robot_cmds.jnts_state.set(data=null_action, data_type="eff", robot_idxs=self.controller_index_np)
 
-        self.robot_cmds.jnts_state.synch_retry(row_index=self.controller_index, col_index=0, n_rows=1, n_cols=self.robot_cmds.jnts_state.n_cols,
-                                read=False) # only write data corresponding to this controller
+        if self._sol_record is not None:
+            # the server reads cmds from the packed record
+            self._sol_record.get("jnts_state")[self.controller_index, :] = \
+                self.robot_cmds.jnts_state.get_numpy_mirror()[self.controller_index, :]
+            self._sol_record.write_row(row_index=self.controller_index)
+        else:
+            self.robot_cmds.synch_row_to_shared_mem(row_index=self.controller_index,
+                                    views=["jnts_state"]) # only write data corresponding to this controller
     
     def failed(self):
         return self._failed
@@ -332,6 +495,12 @@ class RHController(ABC):
     
     def _assign_cntrl_index(self, reg_state: np.ndarray):
         state = reg_state.flatten() # ensure 1D tensor
+        preferred_idx = self._context.pop_preferred_idx()
+        while preferred_idx is not None:
+            # preferred slots are consumed in order
+            if not state[preferred_idx]:
+                return preferred_idx
+            preferred_idx = self._context.pop_preferred_idx()
         free_spots = np.nonzero(~state.flatten())[0]
         return free_spots[0].item()  # just return the first free spot
     
@@ -398,9 +567,16 @@ class RHController(ABC):
             # on the whole memory views
             self.rhc_status.registration.data_sem_acquire()
             self.rhc_status.controllers_counter.data_sem_acquire()
+            self.rhc_status.ready.write_retry(False, 
+                                    row_index=self.controller_index,
+                                    col_index=0)
+            self._context.remove_controller(self.controller_index)
             self.rhc_status.registration.write_retry(False, 
                                     row_index=self.controller_index,
                                     col_index=0)
+            if self._step_packet is not None:
+                self._step_packet.write_flag(name="registered", value=False, 
+                                    row_index=self.controller_index)
             self._deactivate()
             # decrementing controllers counter
             self.rhc_status.controllers_counter.synch_all(retry = True,
@@ -467,32 +643,41 @@ class RHController(ABC):
                     LogType.STAT,
                     throw_when_excep = True)
         
-        self.rhc_status = RhcStatus(is_server=False,
-                                    namespace=self.namespace, 
-                                    verbose=self._verbose, 
-                                    vlevel=VLevel.V2,
-                                    with_torch_view=False, 
-                                    with_gpu_mirror=False)
-        self.rhc_status.run() # rhc status (reg. flags, failure, tot cost, tot cnstrl viol, etc...)
+        init_stamps = [time.perf_counter()] # end time of each init phase (see InitPhasesDt)
+        self.rhc_status = self._get_client("rhc_status",
+                                lambda: RhcStatus(is_server=False,
+                                            namespace=self.namespace, 
+                                            verbose=self._verbose, 
+                                            vlevel=VLevel.V2,
+                                            with_torch_view=False, 
+                                            with_gpu_mirror=False)) # rhc status (reg. flags, failure, 
+        # tot cost, tot cnstrl viol, etc...)
+        init_stamps.append(time.perf_counter())
         self._register_to_cluster() # registers the controller to the cluster
+        init_stamps.append(time.perf_counter())
+        self.cluster_stats = self._get_client("cluster_stats",
+                                lambda: RhcProfiling(is_server=False, 
+                                            name=self.namespace,
+                                            verbose=self._verbose,
+                                            vlevel=VLevel.V2,
+                                            safe=True)) # profiling data (also holds the cluster info,
+        # which is needed to initialize the states)
+        self.cluster_stats.synch_info()
         self._init_states() # initializes shared mem. states
         self._remote_triggerer = RemoteTriggererClnt(namespace=self.namespace,
                                         verbose=self._verbose,
                                         vlevel=VLevel.V2) # remote triggering
         self._remote_triggerer.run()
-        self.cluster_stats = RhcProfiling(is_server=False, 
-                                    name=self.namespace,
-                                    verbose=self._verbose,
-                                    vlevel=VLevel.V2,
-                                    safe=True) # profiling data
-        self.cluster_stats.run()
-        self.cluster_stats.synch_info()
+        self._init_sol_record()
+        self._init_step_packet()
+        self._init_sol_history()
+        init_stamps.append(time.perf_counter())
         self._init_problem() # we call the child's initialization method for the actual problem
         self._create_jnt_maps()
         self.init_rhc_task_cmds() # initializes rhc interface to external commands (defined by child class)
         self._consinstency_checks() # sanity checks
 
-        if self._debug:
+        if self._debug or self._stream_internal:
             # internal solution is published on shared mem
             # we assume the user has made available the cost
             # and constraint data at this point (e.g. through
@@ -503,14 +688,15 @@ class RHController(ABC):
                         enable_q= True, 
                         enable_v=True, 
                         enable_a=True, 
-                        enable_a_dot=False, 
+                        enable_a_dot=self._stream_internal, # can be selected at runtime
                         enable_f=True,
-                        enable_f_dot=False, 
-                        enable_eff=False, 
+                        enable_f_dot=self._stream_internal, 
+                        enable_eff=self._stream_internal, 
                         cost_names=cost_data[0], 
                         cost_dims=cost_data[1],
                         constr_names=constr_data[0],
                         constr_dims=constr_data[1],
+                        pack_terms=self._stream_internal # costs and constr. written with a single call
                         )
             self.rhc_internal = RhcInternal(config=config, 
                                     namespace=self.namespace,
@@ -524,6 +710,7 @@ class RHController(ABC):
                                     force_reconnection=True,
                                     safe=True)
             self.rhc_internal.run()
+        init_stamps.append(time.perf_counter())
 
         if self._homer is None:
             self._init_robot_homer() # call this in case it wasn't called by child
@@ -531,6 +718,9 @@ class RHController(ABC):
 
         self._robot_mass = self._get_robot_mass() # uses child class implemented method
         self._contact_var_scale = self._get_robot_mass() * 9.81 / self.rhc_status.n_contacts
+        init_stamps.append(time.perf_counter())
+
+        self._set_ready(init_stamps=init_stamps) # signal the server we are ready to solve
 
         Journal.log(f"{self.__class__.__name__}",
                     "_init",
@@ -538,11 +728,33 @@ class RHController(ABC):
                     LogType.STAT,
                     throw_when_excep = True)
 
+    def _set_ready(self,
+            init_stamps: List[float]):
+        
+        # publishes the duration of each init phase and the total one
+        init_dt = self.cluster_stats.init_phases_dt.get_numpy_mirror()
+        init_dt[self.controller_index, :-1] = np.diff(np.array(init_stamps))
+        init_dt[self.controller_index, -1] = init_stamps[-1] - init_stamps[0]
+        self.cluster_stats.init_phases_dt.synch_retry(row_index=self.controller_index, col_index=0, 
+                                        n_rows=1, n_cols=self.cluster_stats.init_phases_dt.n_cols,
+                                        read=False)
+        self.cluster_stats.process_ids.write_retry(os.getpid(), 
+                                row_index=self.controller_index,
+                                col_index=0) # used to map controllers to processes
+        self.rhc_status.ready.write_retry(True, 
+                                row_index=self.controller_index,
+                                col_index=0)
+        self._context.add_controller(self.controller_index)
+        self._beat()
+        
     def _deactivate(self):
         # signal controller deactivation over shared mem
         self.rhc_status.activation_state.write_retry(False, 
                                 row_index=self.controller_index,
                                 col_index=0)
+        if self._step_packet is not None:
+            self._step_packet.write_flag(name="active", value=False, 
+                                row_index=self.controller_index)
         # also set cmds to homing for safety
         self.set_cmds_to_homing()
 
@@ -557,6 +769,134 @@ class RHController(ABC):
                                                     row_index=self.controller_index,
                                                     col_index=0)
 
+    def _init_sol_record(self):
+        
+        # the packed solution record is an opt-in of the server
+        packed_sol = self.cluster_stats.get_info(info_name="packed_sol")
+        if packed_sol is not None and packed_sol > 0.5:
+            self._sol_record = self._get_client("sol_record",
+                                    lambda: RhcSolRecord(namespace=self.namespace,
+                                                is_server=False,
+                                                n_jnts=self.robot_cmds.n_jnts(),
+                                                n_contacts=self.robot_cmds.n_contacts(),
+                                                n_nodes=self.rhc_status.n_nodes,
+                                                verbose=self._verbose,
+                                                vlevel=VLevel.V2,
+                                                with_torch_view=False))
+
+    def _init_step_packet(self):
+
+        # the fused step packet is an opt-in of the server
+        step_packet = self.cluster_stats.get_info(info_name="step_packet")
+        if step_packet is not None and step_packet > 0.5:
+            self._step_packet = self._get_client("step_packet",
+                                    lambda: StepPacket(namespace=self.namespace,
+                                                is_server=False,
+                                                n_jnts=self.robot_state.n_jnts(),
+                                                n_contacts=self.robot_state.n_contacts(),
+                                                verbose=self._verbose,
+                                                vlevel=VLevel.V2,
+                                                with_torch_view=False))
+            # the server reads registration flags from the packet (we registered before connecting to it)
+            self._step_packet.write_flag(name="registered", value=True, 
+                                row_index=self.controller_index)
+
+    def _init_sol_history(self):
+
+        # the solution history is an opt-in of the server
+        depth = self.cluster_stats.get_info(info_name="sol_history_depth")
+        if depth is not None and depth > 0.5:
+            self._sol_history = self._get_client("sol_history",
+                                    lambda: RhcSolHistory(namespace=self.namespace,
+                                                is_server=False,
+                                                n_jnts=self.robot_cmds.n_jnts(),
+                                                n_contacts=self.robot_cmds.n_contacts(),
+                                                n_nodes=self.rhc_status.n_nodes,
+                                                verbose=self._verbose,
+                                                vlevel=VLevel.V2))
+
+    def _write_sol_history(self):
+
+        if self._sol_history is not None:
+            self._sol_history.write(row_index=self.controller_index,
+                            sol={"q": self._get_q_from_sol(),
+                                "v": self._get_v_from_sol(),
+                                "a": self._get_a_from_sol(),
+                                "f": self._get_f_from_sol()})
+
+    def _read_trigger(self):
+
+        if self._step_packet is not None:
+            # trigger flag and state of this controller are read together (a 
+            # request which cannot be read consistently is left pending)
+            return self._step_packet.read_row(row_index=self.controller_index) and \
+                self._step_packet.triggered(row_index=self.controller_index)
+        return self.rhc_status.trigger.read_retry(row_index=self.controller_index,
+                            col_index=0)[0]
+    
+    def _read_state(self):
+
+        if self._step_packet is not None:
+            # already read with the trigger flag
+            self._step_packet.unpack_row(robot_state=self.robot_state,
+                            row_index=self.controller_index)
+        else:
+            self.robot_state.synch_row_from_shared_mem(row_index=self.controller_index)
+    
+    def _clear_trigger(self):
+
+        if self._step_packet is not None:
+            self._step_packet.clear_trigger(row_index=self.controller_index)
+        else:
+            self.rhc_status.trigger.write_retry(False, 
+                                row_index=self.controller_index,
+                                col_index=0)
+
+    def _state_descriptor(self):
+
+        # coarse descriptor of the latest state (root orientation + jnts positions)
+        root_q = self.robot_state.root_state.get(data_type="q", robot_idxs=self.controller_index)
+        jnts_q = self.robot_state.jnts_state.get(data_type="q", robot_idxs=self.controller_index)
+        return np.concatenate((np.ravel(root_q), np.ravel(jnts_q)))
+
+    def _on_good_solution(self):
+
+        # only a reference to the latest good solution is kept (through the solver), which is
+        # copied to the cache once every warmstart_decimation solves and before resets
+        if self._warmstart_cache is None:
+            return
+        self._n_good_sols += 1
+        self._uncached_descriptor = self._state_descriptor()
+        if self._n_good_sols % self._warmstart_decimation == 0:
+            self._flush_solution()
+
+    def _flush_solution(self):
+
+        if self._warmstart_cache is None or self._uncached_descriptor is None:
+            return
+        self._warmstart_cache.store(descriptor=self._uncached_descriptor,
+                            sol={"q": self._get_q_from_sol(),
+                                "v": self._get_v_from_sol(),
+                                "a": self._get_a_from_sol(),
+                                "f": self._get_f_from_sol()})
+        self._uncached_descriptor = None
+    
+    def _warmstart(self):
+
+        self._pending_warmstart = False
+        sol = self._warmstart_cache.lookup(descriptor=self._state_descriptor())
+        if sol is None:
+            return # nothing cached (yet) -> solving from scratch
+        # the cached solution is at least one control step old
+        WarmStartCache.shift(sol, n_nodes=1)
+        if not self._set_initial_guess(sol) and not self._warned_no_warmstart:
+            Journal.log(f"{self.__class__.__name__}{self.controller_index}",
+                "_warmstart",
+                "Warm start is enabled, but _set_initial_guess() is not implemented.",
+                LogType.WARN,
+                throw_when_excep = True)
+            self._warned_no_warmstart = True
+
     def _init_robot_homer(self):
         self._homer = RobotHomer(srdf_path=self.srdf_path, 
                             jnt_names_prb=self._controller_side_jnt_names)
@@ -580,30 +920,86 @@ class RHController(ABC):
         self.cluster_stats.task_ref_update_dt.write_retry(self._profiling_data_dict["task_ref_update"], 
                                                             row_index=self.controller_index,
                                                             col_index=0)
+        self._update_latency_hists()
+
+    def _profile_solve(self):
+        
+        # accumulates the profiling data of the last solve loop (cheap) and 
+        # periodically flushes it to shared mem
+        loop_dt = time.perf_counter_ns() - self._prof_stamps[0]
+        self._prof_n_solves += 1
+        self._prof_dt_sum += loop_dt
+        if self._prof_full:
+            self._profiling_data_dict["full_solve_dt"] = loop_dt * 1e-9
+            self._update_profiling_data()
+        if self._prof_n_solves % self._profiling_flush_period == 0:
+            self._flush_profiling(loop_dt=loop_dt)
+
+    def _flush_profiling(self,
+            loop_dt: int):
+        
+        if self._prof_data is None:
+            self._prof_data = np.full((1, self.cluster_stats.cntrl_profiling.n_cols), 
+                                fill_value=np.nan)
+        self._prof_data[0, 0] = self._prof_n_solves
+        self._prof_data[0, 1] = self._n_fails
+        self._prof_data[0, 2] = self._prof_dt_sum * 1e-9
+        if self._prof_timers:
+            self._prof_data[0, 3] = (self._prof_stamps[1] - self._prof_stamps[0]) * 1e-9
+            self._prof_data[0, 4] = (self._prof_stamps[2] - self._prof_stamps[1]) * 1e-9
+            self._prof_data[0, 5] = (self._prof_stamps[3] - self._prof_stamps[2]) * 1e-9
+            self._prof_data[0, 6] = loop_dt * 1e-9
+        self.cluster_stats.cntrl_profiling.write_retry(self._prof_data, 
+                                            row_index=self.controller_index,
+                                            col_index=0) # single write of the whole row
+
+    def _update_latency_hists(self):
+
+        # O(1) update of the latency histograms: only the bin of each new sample 
+        # (and the max, if exceeded) is written to shared memory
+        if self._hist_counts is None:
+            # we continue from the counts on shared mem (e.g. upon respawn)
+            self.cluster_stats.solve_dt_hist.synch_retry(row_index=self.controller_index, col_index=0,
+                                        n_rows=1, n_cols=self.cluster_stats.solve_dt_hist.n_cols,
+                                        read=True)
+            self.cluster_stats.solve_dt_max.synch_retry(row_index=self.controller_index, col_index=0,
+                                        n_rows=1, n_cols=self.cluster_stats.solve_dt_max.n_cols,
+                                        read=True)
+            self._hist_counts = self.cluster_stats.solve_dt_hist.get_numpy_mirror()[self.controller_index, :].copy()
+            self._hist_max = self.cluster_stats.solve_dt_max.get_numpy_mirror()[self.controller_index, :].copy()
+        for i, metric in enumerate(SolveDtHist.metrics):
+            dt = self._profiling_data_dict[self._hist_metrics[metric]]
+            if np.isnan(dt):
+                continue # not profiled
+            col = SolveDtHist.col_idx(metric, dt)
+            self._hist_counts[col] += 1
+            self.cluster_stats.solve_dt_hist.write_retry(self._hist_counts[col].item(), 
+                                                row_index=self.controller_index,
+                                                col_index=col)
+            if not dt <= self._hist_max[i]: # also if max is still nan
+                self._hist_max[i] = dt
+                self.cluster_stats.solve_dt_max.write_retry(dt, 
+                                                row_index=self.controller_index,
+                                                col_index=i)
     
     def _write_cmds_from_sol(self):
 
         # gets data from the solution and updates the view on the shared data
 
+        if self._sol_record is not None:
+            self._write_sol_record()
+            return
+
         self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_q_from_sol(), data_type="q", robot_idxs=self.controller_index_np)
         self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_v_from_sol(), data_type="v", robot_idxs=self.controller_index_np)
         self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_eff_from_sol(), data_type="eff", robot_idxs=self.controller_index_np)
         
         f_contact = self._get_f_from_sol()
-        contact_names = self.robot_state.contact_names()
-        for i in range(len(contact_names)):
-            contact = contact_names[i]
-            contact_idx = i*3
-            self.robot_cmds.contact_wrenches.set(data=f_contact[contact_idx:(contact_idx+3), 0].T, 
-                                            data_type="f", 
-                                            robot_idxs=self.controller_index_np,
-                                            contact_name=contact)
+        self._set_contact_cmds(f_contact)
             
-        # write to shared mem
-        self.robot_cmds.jnts_state.synch_retry(row_index=self.controller_index, col_index=0, n_rows=1, n_cols=self.robot_cmds.jnts_state.n_cols,
-                                read=False) # jnt state
-        self.robot_cmds.contact_wrenches.synch_retry(row_index=self.controller_index, col_index=0, n_rows=1, n_cols=self.robot_cmds.root_state.n_cols,
-                                read=False) # contact state
+        # write to shared mem (jnt and contact state of this controller)
+        self.robot_cmds.synch_row_to_shared_mem(row_index=self.controller_index,
+                                views=["jnts_state", "contact_wrenches"])
         
         # we also fill other data (cost, constr. violation, etc..)
         self.rhc_status.rhc_cost.write_retry(self._get_rhc_cost(), 
@@ -624,12 +1020,60 @@ class RHController(ABC):
         
         
         if f_contact is not None:
-            for i in range(self.rhc_status.n_contacts):
-                contact_idx = i*3
-                z_idx = contact_idx+2
-                self.rhc_status.rhc_step_var.write_retry(data=f_contact[z_idx:(z_idx+1), :]/(self._contact_var_scale), 
-                                                    row_index=self.controller_index, 
-                                                    col_index=i*self.rhc_status.n_nodes)
+            # z forces of all contacts, written with a single synch
+            self.rhc_status.rhc_step_var.write_many(data=self._get_step_var(f_contact), 
+                                        robot_idx=self.controller_index)
+
+    def _set_contact_cmds(self,
+            f_contact: np.ndarray):
+
+        # contact forces at the first node, for all contacts at once
+        # (f_contact rows are ordered as x, y, z of each contact)
+        if f_contact is None:
+            return
+        n_contacts = self.robot_cmds.contact_wrenches.n_contacts
+        self.robot_cmds.contact_wrenches.set_all_contacts(data=f_contact[0:(3 * n_contacts), 0], 
+                                            data_type="f", 
+                                            robot_idxs=self.controller_index_np)
+
+    def _get_step_var(self,
+            f_contact: np.ndarray):
+        
+        # normalized z forces of each contact over the nodes (n_contacts x n_nodes)
+        return f_contact[2:(3 * self.rhc_status.n_contacts):3, :] / self._contact_var_scale
+    
+    def _write_sol_record(self):
+
+        # same data as _write_cmds_from_sol, but packed in this controller's
+        # row of the solution record and published with a single write
+        
+        idx = self.controller_index
+
+        self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_q_from_sol(), data_type="q", robot_idxs=self.controller_index_np)
+        self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_v_from_sol(), data_type="v", robot_idxs=self.controller_index_np)
+        self.robot_cmds.jnts_state.set(data=self._get_cmd_jnt_eff_from_sol(), data_type="eff", robot_idxs=self.controller_index_np)
+        
+        f_contact = self._get_f_from_sol()
+        self._set_contact_cmds(f_contact)
+        
+        # local views (already remapped to the env-side ordering) are copied to the record
+        self._sol_record.get("jnts_state")[idx, :] = self.robot_cmds.jnts_state.get_numpy_mirror()[idx, :]
+        self._sol_record.get("contact_wrenches")[idx, :] = self.robot_cmds.contact_wrenches.get_numpy_mirror()[idx, :]
+
+        self._sol_record.get("rhc_cost")[idx, 0] = self._get_rhc_cost()
+        self._sol_record.get("rhc_constr_viol")[idx, 0] = self._get_rhc_constr_viol()
+        self._sol_record.get("rhc_n_iter")[idx, 0] = self._get_rhc_niter_to_sol()
+        nodes_cost = np.atleast_2d(self._get_rhc_nodes_cost())
+        self._sol_record.get("rhc_nodes_cost")[idx, 0:nodes_cost.shape[1]] = nodes_cost[0, :]
+        nodes_constr_viol = np.atleast_2d(self._get_rhc_nodes_constr_viol())
+        self._sol_record.get("rhc_nodes_constr_viol")[idx, 0:nodes_constr_viol.shape[1]] = nodes_constr_viol[0, :]
+        
+        if f_contact is not None:
+            step_var = self._get_step_var(f_contact)
+            self._sol_record.get("rhc_step_var")[idx, :].reshape(self.rhc_status.n_contacts, 
+                                -1)[:, :step_var.shape[1]] = step_var
+
+        self._sol_record.write_row(row_index=idx) # single write to shared mem
 
     def _assign_controller_side_jnt_names(self, 
                         jnt_names: List[str]):
@@ -669,41 +1113,75 @@ class RHController(ABC):
         # we use rhc constr. viol to detect failures
         
         idx = self._get_fail_idx()
-        self.rhc_status.rhc_fail_idx.write_retry(idx, 
-                                        row_index=self.controller_index,
-                                        col_index=0) # write idx  on shared mem
+        if self._sol_record is not None:
+            # published together with the rest of the solution
+            self._sol_record.get("rhc_fail_idx")[self.controller_index, 0] = idx
+        else:
+            self.rhc_status.rhc_fail_idx.write_retry(idx, 
+                                            row_index=self.controller_index,
+                                            col_index=0) # write idx  on shared mem
             
         return idx >= self._fail_idx_thresh
     
-    def _update_rhc_internal(self):
+    def _stream_rhc_internal(self):
+
+        self._n_solves += 1
+        if (self._n_solves - 1) % self._stream_check_period == 0:
+            self._read_streaming_settings()
+        if self._stream_decimation > 0 and \
+            self._n_solves % self._stream_decimation == 0:
+            self._update_rhc_internal(fields=self._stream_fields)
+    
+    def _read_streaming_settings(self):
+
+        # decimation and field selection set by the server (or GUI); 
+        # negative values mean not set
+        streaming = self.rhc_status.internal_streaming
+        streaming.synch_retry(row_index=self.controller_index, col_index=0,
+                        n_rows=1, n_cols=streaming.n_cols,
+                        read=True)
+        settings = streaming.get_numpy_mirror()[self.controller_index, :]
+        if settings[0] >= 0:
+            self._stream_decimation = int(settings[0])
+        for i, field in enumerate(RhcStatus.InternalStreamingView.fields):
+            if settings[i + 1] >= 0:
+                self._stream_fields[field] = bool(settings[i + 1])
+    
+    def _update_rhc_internal(self,
+                    fields: Dict[str, bool] = None):
         # data which is not enabled in the config is not actually 
         # written so overhead is minimal for non-enabled data
-        self.rhc_internal.write_q(data= self._get_q_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_v(data= self._get_v_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_a(data= self._get_a_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_a_dot(data= self._get_a_dot_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_f(data= self._get_f_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_f_dot(data= self._get_f_dot_from_sol(),
-                            retry=True)
-        self.rhc_internal.write_eff(data= self._get_eff_from_sol(),
-                            retry=True)
-        for cost_idx in range(self.rhc_internal.config.n_costs):
-            # iterate over all costs and update all values
-            cost_name = self.rhc_internal.config.cost_names[cost_idx]
-            self.rhc_internal.write_cost(data= self._get_cost_from_sol(cost_name = cost_name),
-                                cost_name = cost_name,
+        # (if provided, fields further restricts what is written)
+        if fields is None or fields["q"]:
+            self.rhc_internal.write_q(data= self._get_q_from_sol(),
+                                retry=True)
+        if fields is None or fields["v"]:
+            self.rhc_internal.write_v(data= self._get_v_from_sol(),
+                                retry=True)
+        if fields is None or fields["a"]:
+            self.rhc_internal.write_a(data= self._get_a_from_sol(),
                                 retry=True)
-        for constr_idx in range(self.rhc_internal.config.n_constr):
-            # iterate over all constraints and update all values
-            constr_name = self.rhc_internal.config.constr_names[constr_idx]
-            self.rhc_internal.write_constr(data= self._get_constr_from_sol(constr_name=constr_name),
-                                constr_name = constr_name,
+        if fields is None or fields["a_dot"]:
+            self.rhc_internal.write_a_dot(data= self._get_a_dot_from_sol(),
                                 retry=True)
+        if fields is None or fields["f"]:
+            self.rhc_internal.write_f(data= self._get_f_from_sol(),
+                                retry=True)
+        if fields is None or fields["f_dot"]:
+            self.rhc_internal.write_f_dot(data= self._get_f_dot_from_sol(),
+                                retry=True)
+        if fields is None or fields["eff"]:
+            self.rhc_internal.write_eff(data= self._get_eff_from_sol(),
+                                retry=True)
+        if (fields is None or fields["costs"]) and self.rhc_internal.config.n_costs > 0:
+            # all costs at once (single write if packed)
+            self.rhc_internal.write_costs(data=[self._get_cost_from_sol(cost_name = cost_name) \
+                                for cost_name in self.rhc_internal.config.cost_names],
+                            retry=True)
+        if (fields is None or fields["constr"]) and self.rhc_internal.config.n_constr > 0:
+            self.rhc_internal.write_constraints(data=[self._get_constr_from_sol(constr_name=constr_name) \
+                                for constr_name in self.rhc_internal.config.constr_names],
+                            retry=True)
     
     def _get_contacts(self): 
         contact_names = self._get_contact_names()
@@ -748,6 +1226,12 @@ class RHController(ABC):
         # to be overridden by child class
         return None
     
+    def _set_initial_guess(self,
+            sol: Dict[str, np.ndarray]) -> bool:
+        # to be overridden by child class: sets the given trajectories ("q", "v", "a", "f",
+        # same layout as the _get_*_from_sol() ones) as the initial guess of the solver
+        return False
+    
     @abstractmethod
     def _reset(self):   
         pass
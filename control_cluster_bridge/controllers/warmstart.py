@@ -0,0 +1,107 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from typing import Dict
+
+import numpy as np
+
+class WarmStartCache:
+
+    # bounded store of good solutions (trajectories over the horizon nodes),
+    # keyed by a coarse (quantized) descriptor of the state they were computed from.
+    # Lookups return the cached solution whose descriptor is closest to the
+    # given one, so that solvers can be restarted from it (e.g. after a reset)
+
+    def __init__(self,
+            max_size: int = 32,
+            resolution: float = 0.1, # quantization step of descriptors
+            max_distance: float = np.inf): # lookups farther than this return nothing
+
+        self._max_size = max_size
+        self._resolution = resolution
+        self._max_distance = max_distance
+
+        self._keys = [] # oldest first
+        self._descriptors = {}
+        self._entries = {}
+
+    def __len__(self):
+
+        return len(self._keys)
+
+    def clear(self):
+
+        self._keys = []
+        self._descriptors = {}
+        self._entries = {}
+
+    def _quantize(self,
+            descriptor: np.ndarray):
+
+        return np.round(np.asarray(descriptor, dtype=np.float64).flatten() / self._resolution)
+
+    def store(self,
+            descriptor: np.ndarray,
+            sol: Dict[str, np.ndarray]):
+
+        # the most recent solution for a given (quantized) descriptor replaces older ones
+        quantized = self._quantize(descriptor)
+        key = tuple(quantized.astype(np.int64).tolist())
+        if key in self._entries:
+            self._keys.remove(key)
+        elif len(self._keys) >= self._max_size:
+            oldest = self._keys.pop(0)
+            del self._entries[oldest]
+            del self._descriptors[oldest]
+        self._keys.append(key)
+        self._descriptors[key] = quantized
+        self._entries[key] = {name: np.array(data, copy=True) for name, data in sol.items() \
+                            if data is not None}
+
+    def lookup(self,
+            descriptor: np.ndarray):
+
+        # closest cached solution (a copy) or None
+        if len(self._keys) == 0:
+            return None
+        quantized = self._quantize(descriptor)
+        closest_key = None
+        closest_distance = np.inf
+        for key in reversed(self._keys): # most recent first on ties
+            cached = self._descriptors[key]
+            if not cached.shape == quantized.shape:
+                continue
+            distance = np.linalg.norm(cached - quantized) * self._resolution
+            if distance < closest_distance:
+                closest_key = key
+                closest_distance = distance
+        if closest_key is None or closest_distance > self._max_distance:
+            return None
+        return {name: data.copy() for name, data in self._entries[closest_key].items()}
+
+    @staticmethod
+    def shift(sol: Dict[str, np.ndarray],
+            n_nodes: int = 1):
+
+        # shifts trajectories (nodes along the last axis) backwards in time by
+        # n_nodes, repeating the last node (in place)
+        for data in sol.values():
+            if data.ndim == 0 or data.shape[-1] <= n_nodes:
+                continue
+            data[..., :-n_nodes] = data[..., n_nodes:].copy()
+            data[..., -n_nodes:] = data[..., -1:]
+        return sol
@@ -0,0 +1,96 @@
+# Copyright (C) 2023  Andrea Patrizi (AndrePatri, andreapatrizi1b6e6@gmail.com)
+#
+# This file is part of CoClusterBridge and distributed under the General Public License version 2 license.
+#
+# CoClusterBridge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# CoClusterBridge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
+#
+from control_cluster_bridge.utilities.shared_data.state_encoding import contiguous_row_ranges
+
+from typing import List
+
+class WorkerContext:
+
+    # state owned by a process hosting one or more controllers (e.g. a cluster
+    # client worker): shared mem clients reused by all its controllers, cluster slots
+    # to be preferred upon registration and slots of its ready controllers.
+    # Controllers of the same process are served from the same loop, so they are all
+    # alive as long as any of them is waiting: their heartbeats are bumped together,
+    # with one write per block of contiguous slots
+
+    def __init__(self,
+            share_clients: bool = False, # if True, the first controller creates the shared
+            # mem clients and the following ones reuse them
+            preferred_idxs: List[int] = None, # consumed in order (e.g. slots of a dead process)
+            heartbeat_modulo: int = 2**30):
+
+        self.shared_clients = {} if share_clients else None
+        self.preferred_idxs = [] if preferred_idxs is None else list(preferred_idxs)
+
+        self._cntrl_idxs = [] # slots of the ready controllers of this process
+        self._beat_ranges = []
+        self._n_beats = 0
+        self._heartbeat_modulo = heartbeat_modulo
+
+    def get_client(self,
+            name: str,
+            factory):
+
+        # creates and runs a shared mem client or, if clients are shared,
+        # retrieves the one already created in this process
+        if self.shared_clients is None:
+            client = factory()
+            client.run()
+            return client
+        if name not in self.shared_clients:
+            client = factory()
+            client.run()
+            self.shared_clients[name] = client
+        return self.shared_clients[name]
+
+    def close_shared_clients(self):
+
+        if self.shared_clients is not None:
+            for client in self.shared_clients.values():
+                client.close()
+            self.shared_clients = {}
+
+    def pop_preferred_idx(self):
+
+        return self.preferred_idxs.pop(0) if len(self.preferred_idxs) > 0 else None
+
+    def add_controller(self,
+            idx: int):
+
+        if idx not in self._cntrl_idxs:
+            self._cntrl_idxs.append(idx)
+            self._beat_ranges = contiguous_row_ranges(sorted(self._cntrl_idxs))
+
+    def remove_controller(self,
+            idx: int):
+
+        if idx in self._cntrl_idxs:
+            self._cntrl_idxs.remove(idx)
+            self._beat_ranges = contiguous_row_ranges(sorted(self._cntrl_idxs))
+
+    def beat(self,
+            heartbeat):
+
+        # bumps the heartbeats of all the ready controllers of this process
+        self._n_beats = (self._n_beats + 1) % self._heartbeat_modulo
+        beats = heartbeat.get_numpy_mirror()
+        for row, n_rows in self._beat_ranges:
+            beats[row:(row + n_rows), 0] = self._n_beats
+            heartbeat.synch_retry(row_index=row, col_index=0,
+                            n_rows=n_rows, n_cols=1,
+                            read=False)
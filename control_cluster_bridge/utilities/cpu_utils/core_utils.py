@@ -36,3 +36,108 @@ def get_memory_usage():
     memory_info = process.memory_info()
     memory_usage_gb = memory_info.rss / (1024**3)  # Convert bytes to gigabytes
     return memory_usage_gb
+
+def parse_cpu_list(cpu_list: str):
+    # parses kernel cpu lists (e.g. "0-3,8,10-11")
+    cpus = []
+    for cpu_str in cpu_list.strip().split(','):
+        if cpu_str == '':
+            continue
+        if '-' in cpu_str:
+            start, end = map(int, cpu_str.split('-'))
+            cpus.extend(range(start, end + 1))
+        else:
+            cpus.append(int(cpu_str))
+    return cpus
+
+def _read_sysfs(path: str):
+    try:
+        with open(path, 'r') as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def get_cpu_topology():
+    # returns {cpu: (package id, core id, numa node)} read from sysfs 
+    # (if not available, each cpu is considered a separate core on node 0)
+    cpus = parse_cpu_list(_read_sysfs('/sys/devices/system/cpu/online') or '')
+    if len(cpus) == 0:
+        cpus = list(range(psutil.cpu_count()))
+
+    cpu_to_node = {}
+    node_dir = '/sys/devices/system/node'
+    if os.path.isdir(node_dir):
+        for entry in os.listdir(node_dir):
+            match = re.fullmatch(r'node(\d+)', entry)
+            if match:
+                node_cpus = _read_sysfs(os.path.join(node_dir, entry, 'cpulist'))
+                for cpu in parse_cpu_list(node_cpus or ''):
+                    cpu_to_node[cpu] = int(match.group(1))
+
+    topology = {}
+    for cpu in cpus:
+        topology_dir = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        package_id = _read_sysfs(os.path.join(topology_dir, 'physical_package_id'))
+        core_id = _read_sysfs(os.path.join(topology_dir, 'core_id'))
+        topology[cpu] = (int(package_id) if package_id is not None else 0,
+                    int(core_id) if core_id is not None else cpu,
+                    cpu_to_node.get(cpu, 0))
+    return topology
+
+def get_shm_numa_node(pattern: str):
+    # NUMA node holding most of the pages of the shared memory mapped by this 
+    # process whose path contains pattern (None if not found/available)
+    pages_per_node = {}
+    try:
+        with open('/proc/self/numa_maps', 'r') as file:
+            for line in file:
+                if '/dev/shm/' not in line or pattern not in line:
+                    continue
+                for node, pages in re.findall(r'\bN(\d+)=(\d+)', line):
+                    pages_per_node[int(node)] = pages_per_node.get(int(node), 0) + int(pages)
+    except OSError:
+        return None
+    if len(pages_per_node) == 0:
+        return None
+    return max(pages_per_node, key=pages_per_node.get)
+
+def plan_core_placement(n_processes: int,
+                    allowed_cpus,
+                    numa_node: int = None):
+    
+    # assigns a cpu to each process preferring, in order: separate physical cores 
+    # on the given NUMA node, separate physical cores on other nodes, SMT siblings 
+    # on the given node and then SMT siblings on other nodes. Returns the list of cpus 
+    # (one per process) and a short report of the plan
+    topology = get_cpu_topology()
+    allowed_cpus = [cpu for cpu in allowed_cpus if cpu in topology]
+    if len(allowed_cpus) == 0:
+        return [], "No allowed cpu found in the cpu topology."
+    if numa_node is None:
+        # node with the most allowed cpus
+        nodes = [topology[cpu][2] for cpu in allowed_cpus]
+        numa_node = max(set(nodes), key=nodes.count)
+    
+    # cpus grouped by physical core (first one is the primary thread)
+    cores = {}
+    for cpu in sorted(allowed_cpus):
+        package_id, core_id, _ = topology[cpu]
+        cores.setdefault((package_id, core_id), []).append(cpu)
+    
+    local_primary, remote_primary, local_siblings, remote_siblings = [], [], [], []
+    for core_cpus in cores.values():
+        is_local = topology[core_cpus[0]][2] == numa_node
+        (local_primary if is_local else remote_primary).append(core_cpus[0])
+        (local_siblings if is_local else remote_siblings).extend(core_cpus[1:])
+    order = local_primary + remote_primary + local_siblings + remote_siblings
+    
+    plan = [order[i % len(order)] for i in range(n_processes)]
+
+    used_cores = set([topology[cpu][:2] for cpu in plan])
+    n_remote = sum([1 for cpu in plan if topology[cpu][2] != numa_node])
+    n_shared = sum([1 for cpu in plan if plan.count(cpu) > 1])
+    report = f"{n_processes} processes on {len(set(plan))} cpus " + \
+        f"({len(used_cores)} physical cores, {len(cores)} available), " + \
+        f"NUMA node {numa_node}: {n_processes - n_remote} local, {n_remote} remote, " + \
+        f"{n_shared} processes sharing a cpu."
+    return plan, report
@@ -36,6 +36,8 @@ from SharsorIPCpp.PySharsorIPC import VLevel
 from SharsorIPCpp.PySharsorIPC import Journal
 
 from control_cluster_bridge.utilities.shared_data.rhc_data import RhcStatus
+from control_cluster_bridge.utilities.shared_data.cluster_profiling import RhcProfiling
+from control_cluster_bridge.utilities.shared_data.step_packet import StepPacket
 
 from control_cluster_bridge.utilities.debugger_gui.gui_exts import SharedDataWindowChild
 from control_cluster_bridge.utilities.debugger_gui.plot_utils import WidgetUtils
@@ -124,10 +126,13 @@ class RtClusterDebugger(QMainWindow):
                 plot_update_dt: float = 0.5, 
                 window_length: float = 10.0, # [s]
                 window_buffer_factor: int = 2,
+                stream_internal: bool = False, # whether controllers stream internal data (packed costs and constr.)
                 verbose: bool = False):
 
         self.app = QApplication(sys.argv)
 
+        self.stream_internal = stream_internal
+
         super().__init__()
         
         self.namespace = namespace
@@ -156,6 +161,7 @@ class RtClusterDebugger(QMainWindow):
         self.launch_controllers = None
         self.launch_keyboard_cmds = None
         self.env_index = None
+        self.step_packet = None
 
         # base shared data (more can be added before calling the run())
         self.shared_data_tabs_name = [] # init to empty list
@@ -209,7 +215,8 @@ class RtClusterDebugger(QMainWindow):
                                 namespace=self.namespace,
                                 parent=None, 
                                 verbose=self.verbose,
-                                is_cost=True)
+                                is_cost=True,
+                                pack_terms=self.stream_internal)
         
         rhc_internal_constr = RHCInternal(name = "RhcInternalConstr",
                                 update_data_dt=self.data_update_dt, 
@@ -220,7 +227,8 @@ class RtClusterDebugger(QMainWindow):
                                 parent=None, 
                                 verbose=self.verbose,
                                 is_cost=False,
-                                is_constraint=True)
+                                is_constraint=True,
+                                pack_terms=self.stream_internal)
         
         rhc_internal_data = RHCInternal(name = "RhcInternalData",
                                 update_data_dt=self.data_update_dt, 
@@ -231,7 +239,8 @@ class RtClusterDebugger(QMainWindow):
                                 parent=None, 
                                 verbose=self.verbose,
                                 is_cost=False,
-                                is_constraint=False)
+                                is_constraint=False,
+                                pack_terms=self.stream_internal)
         
         rhc_status = RHCStatus(update_data_dt=self.data_update_dt, 
                             update_plot_dt=self.plot_update_dt,
@@ -270,6 +279,9 @@ class RtClusterDebugger(QMainWindow):
 
         if self.env_index is not None:
             self.env_index.close()
+
+        if self.step_packet is not None:
+            self.step_packet.close()
         
         # terminate shared data windows
         for i in range(len(self.shared_data_tabs_name)):
@@ -468,6 +480,23 @@ class RtClusterDebugger(QMainWindow):
         self.rhc_status.run()
         self.cluster_size = self.rhc_status.cluster_size
 
+        # activation flags are also on the step packet (if used by the server)
+        cluster_stats = RhcProfiling(is_server=False,
+                                name=self.namespace, 
+                                verbose=True, 
+                                vlevel=VLevel.V2,
+                                safe=True)
+        cluster_stats.run()
+        cluster_stats.synch_info()
+        step_packet = cluster_stats.get_info(info_name="step_packet")
+        cluster_stats.close()
+        if step_packet is not None and step_packet > 0.5:
+            self.step_packet = StepPacket(namespace=self.namespace,
+                                    is_server=False,
+                                    verbose=True,
+                                    vlevel=VLevel.V2) # flags only
+            self.step_packet.run()
+
         self.env_index = SharedTWrapper(namespace = self.namespace,
                 basename = "EnvSelector",
                 is_server = True, 
@@ -634,6 +663,10 @@ class RtClusterDebugger(QMainWindow):
 
         self.rhc_status.activation_state.synch_all(read=False, retry=True)
 
+        if self.step_packet is not None:
+
+            self.step_packet.write_flag(name="active", value=controller_active, row_index=self.cluster_index)
+
     def _toggle_keyboard_cmds(self):
 
         self._keyboard_cmds_triggered = not self._keyboard_cmds_triggered
@@ -1,4 +1,4 @@
-from PyQt5.QtWidgets import QWidget
+from PyQt5.QtWidgets import QWidget, QFrame, QVBoxLayout
 
 from control_cluster_bridge.utilities.debugger_gui.gui_exts import SharedDataWindow
 from control_cluster_bridge.utilities.debugger_gui.plot_utils import RtPlotWindow
@@ -451,12 +451,19 @@ class RHCInternal(SharedDataWindow):
         verbose = False,
         is_cost: bool = True,
         is_constraint: bool = False,
+        pack_terms: bool = False, # has to be True if controllers stream internal data
+        # (stream_internal), which packs costs and constraints
         add_settings_tab = True,
         settings_title = "SETTINGS (RHCInternal)"
         ):
                 
         self.is_cost = is_cost
         self.is_constraint = is_constraint
+        self.pack_terms = pack_terms
+
+        self._rhc_status = None # used to write streaming settings (data tab only)
+        self._streaming_fields = RhcStatus.InternalStreamingView.fields
+        self._streaming_decimation = 10
 
         self.cluster_size = -1
         self.names = []
@@ -494,10 +501,17 @@ class RHCInternal(SharedDataWindow):
                             vlevel=VLevel.V1)
 
         self.rhc_status_info.run()
-        self.rhc_status_info.close()
 
         self.cluster_size = self.rhc_status_info.trigger.n_rows
 
+        if self.is_cost or self.is_constraint:
+
+            self.rhc_status_info.close()
+        
+        else:
+
+            self._rhc_status = self.rhc_status_info # kept for the streaming field selector
+
         enable_costs = False
         enable_constr = False
 
@@ -522,7 +536,8 @@ class RHCInternal(SharedDataWindow):
                         enable_f_dot=False, 
                         enable_eff=False,
                         enable_costs=enable_costs, 
-                        enable_constr=enable_constr)
+                        enable_constr=enable_constr,
+                        pack_terms=self.pack_terms)
 
         # view of rhc internal data
         for i in range(0, self.cluster_size):
@@ -755,6 +770,35 @@ class RHCInternal(SharedDataWindow):
         self._current_index = self.window_size - 1
 
         settings_frames.append(node_index_slider)
+
+        if self._rhc_status is not None:
+
+            # runtime selection of the data streamed by the current controller
+            decimation_slider = widget_utils.generate_complex_slider(
+                        parent=None, 
+                        parent_layout=None,
+                        min_shown=f"{0}", 
+                        min= 0, 
+                        max_shown=f"{100}", 
+                        max=100, 
+                        init_val_shown=f"{self._streaming_decimation}", 
+                        init=self._streaming_decimation, 
+                        title="streaming decimation (0 disables)", 
+                        callback=self._update_streaming_decimation)
+            
+            settings_frames.append(decimation_slider)
+
+            fields_frame = QFrame()
+            fields_layout = QVBoxLayout(fields_frame)
+            fields_layout.setContentsMargins(0, 0, 0, 0)
+            self._fields_selector = widget_utils.create_scrollable_list_button(parent=fields_frame, 
+                                        parent_layout=fields_layout,
+                                        list_names=self._streaming_fields, 
+                                        callback=self._toggle_streaming_field, 
+                                        title="streamed fields")
+            self._fields_selector.base_frame = fields_frame
+
+            settings_frames.append(self._fields_selector)
         
         self.grid.addToSettings(settings_frames)
 
@@ -771,9 +815,53 @@ class RHCInternal(SharedDataWindow):
         for i in range(0, len(self.rt_plotters)): 
             self.rt_plotters[i].rt_plot_widget.switch_to_data(idx = self._current_index)
 
+    def _update_streaming_decimation(self,
+                    decimation: int):
+
+        self._streaming_decimation = decimation
+
+        self.grid.settings_widget_list[1].current_val.setText(f'{decimation}')
+
+        self._write_streaming_settings()
+
+    def _toggle_streaming_field(self,
+                    field: str):
+
+        self._write_streaming_settings()
+
+    def _write_streaming_settings(self):
+
+        # written for the controller currently shown (picked up by 
+        # controllers periodically, see RHController._read_streaming_settings())
+        streaming = self._rhc_status.internal_streaming
+
+        settings = streaming.get_numpy_mirror()[self.cluster_idx, :]
+
+        settings[0] = self._streaming_decimation
+
+        for i in range(len(self._streaming_fields)):
+
+            settings[i + 1] = int(self._fields_selector.buttons[i].isChecked())
+
+        streaming.synch_retry(row_index=self.cluster_idx, col_index=0,
+                        n_rows=1, n_cols=streaming.n_cols,
+                        read=False)
+
+    def terminate(self):
+
+        if self._rhc_status is not None:
+
+            self._rhc_status.close()
+
+            self._rhc_status = None
+
+        super().terminate()
+
     def update(self,
             index: int):
 
+        self.cluster_idx = index
+
         self.shared_data_clients[index].synch()
 
         if not self._terminated:
@@ -16,51 +16,133 @@
 # along with CoClusterBridge.  If not, see <http://www.gnu.org/licenses/>.
 # 
 import torch
-from typing import List
 
-def incremental_rotate(q_initial: torch.Tensor, 
-                    d_angle: float, 
-                    axis: List) -> torch.Tensor:
+_ROT_COEFFS = {} # (device, dtype) -> coefficients mapping quaternion products to rot. matrices
+
+def _rot_mat_coeffs(device,
+        dtype) -> torch.Tensor:
     """
-    Incrementally rotate a quaternion `q_initial` by `d_angle` radians about `axis`.
-    Parameters:
-    - q_initial (torch.Tensor): Initial quaternion.
-    - d_angle (float): Angle by which to rotate, in radians.
-    - axis (torch.Tensor): Axis about which to rotate.
-    Returns:
-    - torch.Tensor: Resulting quaternion after rotation.
+    Constant (17 x 9) matrix mapping the 16 products q_a * q_b of a quaternion 
+    [w, x, y, z] (plus a trailing 1) to the 9 entries (row-major) of its rotation
+    matrix, so that a whole batch of rotation matrices is computed with a single matmul.
     """
-    d_angle_tensor = torch.tensor(d_angle)
-    # Compute the quaternion representation of the incremental rotation
-    q_incremental = torch.tensor([torch.cos(d_angle_tensor / 2),
-                            axis[0] * torch.sin(d_angle_tensor / 2),
-                            axis[1] * torch.sin(d_angle_tensor / 2),
-                            axis[2] * torch.sin(d_angle_tensor / 2)])
-    
-    # Normalize the quaternion
-    q_incremental /= torch.linalg.norm(q_incremental)
-    
-    # Compute the final orientation of the base by multiplying the quaternions
-    q_result = quaternion_multiply(q_incremental, q_initial)
-    
-    return q_result
+    key = (str(device), dtype)
+    if key not in _ROT_COEFFS:
+        w, x, y, z = 0, 1, 2, 3
+        terms = [[(1, 16), (-2, y, y), (-2, z, z)], # R_00
+            [(2, x, y), (-2, z, w)], # R_01
+            [(2, x, z), (2, y, w)], # R_02
+            [(2, x, y), (2, z, w)], # R_10
+            [(1, 16), (-2, x, x), (-2, z, z)], # R_11
+            [(2, y, z), (-2, x, w)], # R_12
+            [(2, x, z), (-2, y, w)], # R_20
+            [(2, y, z), (2, x, w)], # R_21
+            [(1, 16), (-2, x, x), (-2, y, y)]] # R_22
+        coeffs = torch.zeros((17, 9), dtype=dtype, device=device)
+        for entry, entry_terms in enumerate(terms):
+            for term in entry_terms:
+                if len(term) == 2: # constant
+                    coeffs[term[1], entry] += term[0]
+                else:
+                    coeffs[term[1] * 4 + term[2], entry] += term[0]
+        _ROT_COEFFS[key] = coeffs
+    return _ROT_COEFFS[key]
+
+def quat_to_rot_mat(q_b: torch.Tensor,
+        R_out: torch.Tensor = None) -> torch.Tensor:
+    """
+    Computes the rotation matrices (N x 3 x 3) of a batch of quaternions (N x 4, [w, x, y, z]).
+    If provided, R_out will hold the result. Use FrameTransformer to avoid
+    the allocation of intermediate products.
+    """
+    n = q_b.shape[0]
+    products = torch.ones((n, 17), dtype=q_b.dtype, device=q_b.device)
+    torch.mul(q_b.unsqueeze(2), q_b.unsqueeze(1), out=products[:, :16].view(n, 4, 4))
+    R = torch.mm(products, _rot_mat_coeffs(q_b.device, q_b.dtype)).view(n, 3, 3)
+    if R_out is not None:
+        R_out.copy_(R)
+        return R_out
+    return R
+
+def _yaw_rot_mat(R: torch.Tensor,
+        R_out: torch.Tensor):
+    """
+    Rotation matrix of the "horizontal" frame (z aligned as world, x aligned as the 
+    projection of the x-axis of the base frame) from the base rotation matrices R.
+    """
+    x_proj = R[:, 0:2, 0] # projection of the base x-axis on the world xy plane
+    R_out.zero_()
+    torch.nn.functional.normalize(x_proj, dim=1, out=R_out[:, 0:2, 0])
+    R_out[:, 0, 1] = -R_out[:, 1, 0]
+    R_out[:, 1, 1] = R_out[:, 0, 0]
+    R_out[:, 2, 2] = 1
+    return R_out
+
+def _rotate_twist(t: torch.Tensor,
+        R: torch.Tensor,
+        t_out: torch.Tensor,
+        transpose: bool = False,
+        workspace: torch.Tensor = None):
+    """
+    Rotates the linear and angular parts of a batch of twists (N x 6) by R 
+    (or by its transpose) with a single batched matmul. t_out will hold the result.
+    """
+    n = t.shape[0]
+    R_t = R if transpose else R.transpose(1, 2) # row vectors: (R v)^T = v^T R^T
+    if workspace is None:
+        t_out.view(n, 2, 3).copy_(torch.bmm(t.reshape(n, 2, 3), R_t))
+    else:
+        torch.bmm(t.reshape(n, 2, 3), R_t, out=workspace)
+        t_out.view(n, 2, 3).copy_(workspace)
 
 def quaternion_multiply(q1: torch.Tensor, 
-                q2: torch.Tensor):
+                q2: torch.Tensor,
+                out: torch.Tensor = None):
     
     """
-    Multiply two quaternions q1 and q2.
-    Assumes quaternions are represented as 1D tensors: [w, x, y, z].
+    Multiply two quaternions q1 and q2 (Hamilton product).
+    Quaternions are represented as [w, x, y, z] along the last dimension:
+    both single quaternions (4) and batches (N x 4) are supported (and broadcast).
+    If provided, out will hold the result.
     """
-    w1, x1, y1, z1 = q1
-    w2, x2, y2, z2 = q2
+    w1, x1, y1, z1 = q1.unbind(-1)
+    w2, x2, y2, z2 = q2.unbind(-1)
     
     w = w1*w2 - x1*x2 - y1*y2 - z1*z2
     x = w1*x2 + x1*w2 + y1*z2 - z1*y2
     y = w1*y2 + y1*w2 + z1*x2 - x1*z2
     z = w1*z2 + z1*w2 + x1*y2 - y1*x2
     
-    return torch.tensor([w, x, y, z])
+    if out is not None:
+        return torch.stack((w, x, y, z), dim=-1, out=out)
+    return torch.stack((w, x, y, z), dim=-1)
+
+def incremental_rotate(q_initial: torch.Tensor, 
+                    d_angle, 
+                    axis) -> torch.Tensor:
+    """
+    Incrementally rotate a quaternion `q_initial` by `d_angle` radians about `axis`.
+    Parameters:
+    - q_initial (torch.Tensor): Initial quaternion (4) or batch of quaternions (N x 4).
+    - d_angle (float or torch.Tensor): Angle(s) by which to rotate, in radians (scalar or N).
+    - axis (List or torch.Tensor): Axis (3) or axes (N x 3) about which to rotate.
+    Returns:
+    - torch.Tensor: Resulting quaternion(s) after rotation.
+    """
+    d_angle = torch.as_tensor(d_angle, dtype=q_initial.dtype, device=q_initial.device)
+    axis = torch.as_tensor(axis, dtype=q_initial.dtype, device=q_initial.device)
+    half_angle = (d_angle / 2).unsqueeze(-1)
+    
+    # Compute the quaternion representation of the incremental rotation
+    q_xyz = axis * torch.sin(half_angle)
+    q_incremental = torch.cat((torch.cos(half_angle).expand(q_xyz.shape[:-1] + (1,)), q_xyz), 
+                        dim=-1)
+    
+    # Normalize the quaternion
+    q_incremental = q_incremental / torch.linalg.norm(q_incremental, dim=-1, keepdim=True)
+    
+    # Compute the final orientation of the base by multiplying the quaternions
+    return quaternion_multiply(q_incremental, q_initial)
 
 def w2hor_frame(t_w: torch.Tensor,
         q_b: torch.Tensor,
@@ -72,26 +154,9 @@ def w2hor_frame(t_w: torch.Tensor,
     references in a "game"-like fashion.
     t_out will hold the result
     """
-
-    # q_b = q_b / q_b.norm(dim=1, keepdim=True)
-    q_w, q_i, q_j, q_k = q_b[:, 0], q_b[:, 1], q_b[:, 2], q_b[:, 3]
-    
-    R_11 = 1 - 2 * (q_j ** 2 + q_k ** 2)
-    R_21 = 2 * (q_i * q_j + q_k * q_w)
-    
-    norm = torch.sqrt(R_11 ** 2 + R_21 ** 2)
-    x_proj_x = R_11 / norm
-    x_proj_y = R_21 / norm
-    
-    y_proj_x = -x_proj_y
-    y_proj_y = x_proj_x
-        
-    t_out[:, 0] = t_w[:, 0] * x_proj_x + t_w[:, 1] * x_proj_y
-    t_out[:, 1] = t_w[:, 0] * y_proj_x + t_w[:, 1] * y_proj_y
-    t_out[:, 2] = t_w[:, 2]  # z-component remains the same
-    t_out[:, 3] = t_w[:, 3] * x_proj_x + t_w[:, 4] * x_proj_y
-    t_out[:, 4] = t_w[:, 3] * y_proj_x + t_w[:, 4] * y_proj_y
-    t_out[:, 5] = t_w[:, 5]  # z-component remains the same
+    R_h = _yaw_rot_mat(quat_to_rot_mat(q_b), torch.empty((q_b.shape[0], 3, 3), 
+                                        dtype=q_b.dtype, device=q_b.device))
+    _rotate_twist(t_w, R_h, t_out, transpose=True)
 
 def hor2w_frame(t_h: torch.Tensor,
         q_b: torch.Tensor,
@@ -100,30 +165,9 @@ def hor2w_frame(t_h: torch.Tensor,
     Transforms a velocity vector expressed in "horizontal" frame to WORLD
     t_out will hold the result
     """
-
-    # Extract quaternion components
-    q_w, q_i, q_j, q_k = q_b[:, 0], q_b[:, 1], q_b[:, 2], q_b[:, 3]
-    
-    # Compute rotation matrix elements
-    R_11 = 1 - 2 * (q_j ** 2 + q_k ** 2)
-    R_21 = 2 * (q_i * q_j + q_k * q_w)
-    
-    # Normalize to get projection components
-    norm = torch.sqrt(R_11 ** 2 + R_21 ** 2)
-    x_proj_x = R_11 / norm
-    x_proj_y = R_21 / norm
-    
-    # Orthogonal vector components
-    y_proj_x = -x_proj_y
-    y_proj_y = x_proj_x
-    
-    # Transform velocity vector components from horizontal to world frame
-    t_out[:, 0] = t_h[:, 0] * x_proj_x + t_h[:, 1] * y_proj_x
-    t_out[:, 1] = t_h[:, 0] * x_proj_y + t_h[:, 1] * y_proj_y
-    t_out[:, 2] = t_h[:, 2]  # z-component remains the same
-    t_out[:, 3] = t_h[:, 3] * x_proj_x + t_h[:, 4] * y_proj_x
-    t_out[:, 4] = t_h[:, 3] * x_proj_y + t_h[:, 4] * y_proj_y
-    t_out[:, 5] = t_h[:, 5]  # z-component remains the same
+    R_h = _yaw_rot_mat(quat_to_rot_mat(q_b), torch.empty((q_b.shape[0], 3, 3), 
+                                        dtype=q_b.dtype, device=q_b.device))
+    _rotate_twist(t_h, R_h, t_out)
 
 def base2world_frame(t_b: torch.Tensor, 
         q_b: torch.Tensor, 
@@ -133,28 +177,7 @@ def base2world_frame(t_b: torch.Tensor,
     the WORLD frame using the given quaternion that describes the orientation
     of the base with respect to the world frame. The result is written in t_out.
     """
-    # q_b = q_b / q_b.norm(dim=1, keepdim=True)
-    q_w, q_i, q_j, q_k = q_b[:, 0], q_b[:, 1], q_b[:, 2], q_b[:, 3]
-    
-    R_00 = 1 - 2 * (q_j ** 2 + q_k ** 2)
-    R_01 = 2 * (q_i * q_j - q_k * q_w)
-    R_02 = 2 * (q_i * q_k + q_j * q_w)
-    
-    R_10 = 2 * (q_i * q_j + q_k * q_w)
-    R_11 = 1 - 2 * (q_i ** 2 + q_k ** 2)
-    R_12 = 2 * (q_j * q_k - q_i * q_w)
-    
-    R_20 = 2 * (q_i * q_k - q_j * q_w)
-    R_21 = 2 * (q_j * q_k + q_i * q_w)
-    R_22 = 1 - 2 * (q_i ** 2 + q_j ** 2)
-    
-    # Transform the velocity to the world frame
-    t_out[:, 0] = t_b[:, 0] * R_00 + t_b[:, 1] * R_01 + t_b[:, 2] * R_02
-    t_out[:, 1] = t_b[:, 0] * R_10 + t_b[:, 1] * R_11 + t_b[:, 2] * R_12
-    t_out[:, 2] = t_b[:, 0] * R_20 + t_b[:, 1] * R_21 + t_b[:, 2] * R_22
-    t_out[:, 3] = t_b[:, 3] * R_00 + t_b[:, 4] * R_01 + t_b[:, 5] * R_02
-    t_out[:, 4] = t_b[:, 3] * R_10 + t_b[:, 4] * R_11 + t_b[:, 5] * R_12
-    t_out[:, 5] = t_b[:, 3] * R_20 + t_b[:, 4] * R_21 + t_b[:, 5] * R_22
+    _rotate_twist(t_b, quat_to_rot_mat(q_b), t_out)
 
 def world2base_frame(t_w: torch.Tensor, q_b: torch.Tensor, t_out: torch.Tensor):
     """
@@ -162,28 +185,8 @@ def world2base_frame(t_w: torch.Tensor, q_b: torch.Tensor, t_out: torch.Tensor):
     the base frame using the given quaternion that describes the orientation
     of the base with respect to the world frame. The result is written in t_out.
     """
-    # q_b = q_b / q_b.norm(dim=1, keepdim=True)
-    q_w, q_i, q_j, q_k = q_b[:, 0], q_b[:, 1], q_b[:, 2], q_b[:, 3]
-    
-    R_00 = 1 - 2 * (q_j ** 2 + q_k ** 2)
-    R_01 = 2 * (q_i * q_j - q_k * q_w)
-    R_02 = 2 * (q_i * q_k + q_j * q_w)
-    
-    R_10 = 2 * (q_i * q_j + q_k * q_w)
-    R_11 = 1 - 2 * (q_i ** 2 + q_k ** 2)
-    R_12 = 2 * (q_j * q_k - q_i * q_w)
-    
-    R_20 = 2 * (q_i * q_k - q_j * q_w)
-    R_21 = 2 * (q_j * q_k + q_i * q_w)
-    R_22 = 1 - 2 * (q_i ** 2 + q_j ** 2)
-    
-    # Transform the velocity to the base frame using the transpose of the rotation matrix
-    t_out[:, 0] = t_w[:, 0] * R_00 + t_w[:, 1] * R_10 + t_w[:, 2] * R_20
-    t_out[:, 1] = t_w[:, 0] * R_01 + t_w[:, 1] * R_11 + t_w[:, 2] * R_21
-    t_out[:, 2] = t_w[:, 0] * R_02 + t_w[:, 1] * R_12 + t_w[:, 2] * R_22
-    t_out[:, 3] = t_w[:, 3] * R_00 + t_w[:, 4] * R_10 + t_w[:, 5] * R_20
-    t_out[:, 4] = t_w[:, 3] * R_01 + t_w[:, 4] * R_11 + t_w[:, 5] * R_21
-    t_out[:, 5] = t_w[:, 3] * R_02 + t_w[:, 4] * R_12 + t_w[:, 5] * R_22
+    # transpose of the rotation matrix
+    _rotate_twist(t_w, quat_to_rot_mat(q_b), t_out, transpose=True)
 
 def xversor(q_b: torch.Tensor,
         vx_out: torch.Tensor):
@@ -200,6 +203,85 @@ def xversor(q_b: torch.Tensor,
     vx_out[:, 1] = 2 * (q_i * q_j + q_k * q_w)
     vx_out[:, 2] = 2 * (q_i * q_k - q_j * q_w)
 
+class FrameTransformer:
+    """
+    Batched frame transforms with preallocated workspaces: the rotation matrices of
+    the base are computed once per batch (update()) and then reused by all the
+    conversions (twists, linear/angular parts, x versor) without allocations.
+    If use_compile is True (and torch.compile is available), update() is compiled.
+    """
+
+    def __init__(self,
+            n_envs: int,
+            device = "cpu",
+            dtype = torch.float32,
+            use_compile: bool = False):
+        
+        self.n_envs = n_envs
+
+        self._coeffs = _rot_mat_coeffs(device, dtype)
+        self._products = torch.ones((n_envs, 17), dtype=dtype, device=device) # last col. is constant
+        self._qq = self._products[:, :16].view(n_envs, 4, 4)
+        self._R_flat = torch.zeros((n_envs, 9), dtype=dtype, device=device)
+        self.R = self._R_flat.view(n_envs, 3, 3) # base -> world
+        self.R_h = torch.zeros((n_envs, 3, 3), dtype=dtype, device=device) # horizontal -> world
+        self._t_ws = torch.zeros((n_envs, 2, 3), dtype=dtype, device=device)
+        self._v_ws = torch.zeros((n_envs, 3, 1), dtype=dtype, device=device)
+
+        if use_compile and hasattr(torch, "compile"):
+            self.update = torch.compile(self.update)
+    
+    def update(self,
+            q_b: torch.Tensor):
+        """
+        Computes the rotation matrices of the base (and of the horizontal frame)
+        for a batch of quaternions (n_envs x 4, [w, x, y, z]).
+        """
+        torch.mul(q_b.unsqueeze(2), q_b.unsqueeze(1), out=self._qq)
+        torch.mm(self._products, self._coeffs, out=self._R_flat)
+        _yaw_rot_mat(self.R, self.R_h)
+
+    def base2world(self,
+            t_b: torch.Tensor,
+            t_out: torch.Tensor):
+        
+        _rotate_twist(t_b, self.R, t_out, workspace=self._t_ws)
+    
+    def world2base(self,
+            t_w: torch.Tensor,
+            t_out: torch.Tensor):
+        
+        _rotate_twist(t_w, self.R, t_out, transpose=True, workspace=self._t_ws)
+    
+    def w2hor(self,
+            t_w: torch.Tensor,
+            t_out: torch.Tensor):
+        
+        _rotate_twist(t_w, self.R_h, t_out, transpose=True, workspace=self._t_ws)
+    
+    def hor2w(self,
+            t_h: torch.Tensor,
+            t_out: torch.Tensor):
+        
+        _rotate_twist(t_h, self.R_h, t_out, workspace=self._t_ws)
+    
+    def rotate(self,
+            v: torch.Tensor,
+            v_out: torch.Tensor,
+            to_world: bool = True):
+        """
+        Rotates a batch of 3D vectors (n_envs x 3, e.g. only linear or 
+        angular velocities) from base to world (or from world to base).
+        """
+        R = self.R if to_world else self.R.transpose(1, 2)
+        torch.bmm(R, v.unsqueeze(2), out=self._v_ws)
+        v_out.copy_(self._v_ws.squeeze(2))
+    
+    def xversor(self,
+            vx_out: torch.Tensor):
+        
+        vx_out.copy_(self.R[:, :, 0])
+
 if __name__ == "__main__":  
 
     n_envs = 15000
@@ -238,5 +320,29 @@ if __name__ == "__main__":
     w2hor_frame(t_w, q_b_norm, t_h_recovered)
     assert torch.allclose(t_b, t_h_recovered, atol=1e-6), "Test failed: t_h_recovered does not match t_b"
     print("horizontal backward frame test passed:  matches ")
+
+    # batched transformer (rotation matrices computed once and reused)
+    transformer = FrameTransformer(n_envs=n_envs)
+    transformer.update(q_b_norm)
+    t_out = torch.zeros_like(t_b)
+    for transform, reference in [(transformer.base2world, base2world_frame),
+                        (transformer.world2base, world2base_frame),
+                        (transformer.w2hor, w2hor_frame),
+                        (transformer.hor2w, hor2w_frame)]:
+        transform(t_b, t_out)
+        reference(t_b, q_b_norm, t_w)
+        assert torch.allclose(t_out, t_w, atol=1e-5), f"Test failed: {transform.__name__} does not match {reference.__name__}"
+    vx = torch.zeros((n_envs, 3))
+    vx_ref = torch.zeros((n_envs, 3))
+    transformer.xversor(vx)
+    xversor(q_b_norm, vx_ref)
+    assert torch.allclose(vx, vx_ref, atol=1e-5), "Test failed: x versors do not match"
+    print("batched transformer test passed: matches per-call transforms")
+
+    # batched quaternion ops
+    q_single = incremental_rotate(q_b_norm[0, :], 0.3, [0, 0, 1])
+    q_batch = incremental_rotate(q_b_norm, torch.full((n_envs, ), 0.3), [0, 0, 1])
+    assert torch.allclose(q_single, q_batch[0, :], atol=1e-6), "Test failed: batched incremental_rotate"
+    print("batched quaternion test passed: matches single quaternion ops")
     
     # testing some known rotations
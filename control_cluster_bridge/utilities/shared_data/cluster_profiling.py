@@ -12,6 +12,40 @@ import numpy as np
 
 # Control cluster profiling data
 
+# latency histograms: fixed log-spaced bins between 1 us and 1 s 
+# (durations out of this range are counted in the first/last bin)
+HIST_N_BINS = 48
+HIST_MIN_DT = 1e-6 # [s]
+HIST_MAX_DT = 1.0 # [s]
+HIST_BIN_EDGES = np.logspace(np.log10(HIST_MIN_DT), np.log10(HIST_MAX_DT), HIST_N_BINS + 1)
+
+def hist_bin_idxs(dt: np.ndarray):
+
+    # histogram bin of each duration
+    return np.clip(np.searchsorted(HIST_BIN_EDGES, dt, side="right") - 1, 0, HIST_N_BINS - 1)
+
+def hist_bin_idx(dt: float):
+
+    # O(1) version of hist_bin_idxs for a single duration
+    if not dt > HIST_MIN_DT:
+        return 0
+    idx = int(HIST_N_BINS * np.log10(dt / HIST_MIN_DT) / np.log10(HIST_MAX_DT / HIST_MIN_DT))
+    return min(idx, HIST_N_BINS - 1)
+
+def hist_percentiles(counts: np.ndarray,
+        q: List[float]):
+
+    # percentiles (in [0, 100]) estimated from histogram counts (summed over 
+    # the leading dimensions) as the upper edge of the bin where they fall
+    # (nan if there are no samples)
+    counts = counts.reshape(-1, HIST_N_BINS).sum(axis=0)
+    n_samples = counts.sum()
+    if n_samples == 0:
+        return [np.nan] * len(q)
+    cumulative = np.cumsum(counts)
+    return [HIST_BIN_EDGES[np.searchsorted(cumulative, n_samples * quantile / 100.0) + 1].item() \
+            for quantile in q]
+
 class ClusterCumulativeData(SharedTWrapper):
                  
     def __init__(self,
@@ -161,6 +195,234 @@ class TaskRefUpdateDt(SharedTWrapper):
             safe = safe,
             force_reconnection=force_reconnection)
         
+class InitPhasesDt(SharedTWrapper):
+
+    # duration of each initialization phase of the controllers [s]
+    phases = ["rhc_status", # status client
+        "registration", # registration to the cluster (under semaphore)
+        "shared_mem", # profiling, states and triggering clients
+        "problem", # problem, jnt maps, task cmds, consistency checks
+        "homing", # homing (srdf parsing) and initial cmds
+        "total"]
+                 
+    def __init__(self,
+        cluster_size: int, 
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "InitPhasesDt" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = len(InitPhasesDt.phases), 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Float,
+            fill_value=np.nan,
+            safe = safe,
+            force_reconnection=force_reconnection)
+        
+class ProcessIds(SharedTWrapper):
+
+    # pid of the process hosting each controller (written upon init)
+                 
+    def __init__(self,
+        cluster_size: int, 
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "ProcessIds" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = 1, 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Int,
+            fill_value=-1,
+            safe = safe,
+            force_reconnection=force_reconnection)
+        
+class CntrlProfiling(SharedTWrapper):
+
+    # cheap profiling of each controller, independent of debug mode (written
+    # in a single batch every few solves, depending on the profiling level)
+    fields = ["n_solves", # "counters" level
+        "n_fails",
+        "solve_loop_dt_sum", # [s] cumulative
+        "read_state_dt", # "timers" level [s] (last solve)
+        "solve_dt", # solution, including failure handling
+        "write_cmds_dt",
+        "solve_loop_dt"]
+                 
+    def __init__(self,
+        cluster_size: int, 
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "CntrlProfiling" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = len(CntrlProfiling.fields), 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Float,
+            fill_value=np.nan,
+            safe = safe,
+            force_reconnection=force_reconnection)
+        
+class StepPhasesDt(SharedTWrapper):
+
+    # duration of each phase of the last cluster step, as seen by the server [s]
+    # (nan if the phase was not executed in the step)
+    phases = ["pre_trigger", # registration/activation (and ready/liveness) flags reads
+        "state_to_cpu", # GPU -> CPU copy of the state
+        "state_write", # state write to shared mem
+        "trigger", # trigger flags write and signaling (includes the state write with the step packet)
+        "ack_wait", # wait for the acks of the controllers
+        "fails_synch", # fail flags read
+        "sol_read", # cmds read from shared mem
+        "sol_to_gpu", # CPU -> GPU copy of the cmds (only issued if non-blocking)
+        "step"] # from the state publication to the cmds readback
+                 
+    def __init__(self,
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "StepPhasesDt" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = 1, 
+            n_cols = len(StepPhasesDt.phases), 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Float,
+            fill_value=np.nan,
+            safe = safe,
+            force_reconnection=force_reconnection)
+        
+class StepPhasesHist(SharedTWrapper):
+
+    # cumulative histograms of the durations of the step phases (one row per 
+    # phase, in the order of StepPhasesDt.phases)
+    n_bins = HIST_N_BINS
+    bin_edges = HIST_BIN_EDGES # [s]
+                 
+    def __init__(self,
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "StepPhasesHist" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = len(StepPhasesDt.phases), 
+            n_cols = StepPhasesHist.n_bins, 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Int,
+            fill_value=0,
+            safe = safe,
+            force_reconnection=force_reconnection)
+
+class SolveDtHist(SharedTWrapper):
+
+    # cumulative histograms of the profiled durations of each controller (one row
+    # per controller, with the HIST_N_BINS bins of each metric stacked along the columns)
+    metrics = ["solve_loop_dt",
+        "rti_sol_time",
+        "prb_update_dt",
+        "phase_shift_dt",
+        "task_ref_update_dt"]
+                 
+    def __init__(self,
+        cluster_size: int, 
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "SolveDtHist" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = len(SolveDtHist.metrics) * HIST_N_BINS, 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Int,
+            fill_value=0,
+            safe = safe,
+            force_reconnection=force_reconnection)
+
+    @staticmethod
+    def col_idx(metric: str, 
+            dt: float):
+
+        # column of the bin where dt falls for the given metric
+        return SolveDtHist.metrics.index(metric) * HIST_N_BINS + hist_bin_idx(dt)
+
+class SolveDtMax(SharedTWrapper):
+
+    # max profiled duration of each metric (in the order of SolveDtHist.metrics) for
+    # each controller (histograms only bound it to a bin)
+                 
+    def __init__(self,
+        cluster_size: int, 
+        namespace = "",
+        is_server = False, 
+        verbose: bool = False, 
+        vlevel: VLevel = VLevel.V0,
+        safe: bool = True,
+        force_reconnection: bool = False):
+
+        basename = "SolveDtMax" 
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = len(SolveDtHist.metrics), 
+            verbose = verbose, 
+            vlevel = vlevel,
+            dtype=sharsor_dtype.Float,
+            fill_value=np.nan,
+            safe = safe,
+            force_reconnection=force_reconnection)
+        
 class ClusterRuntimeInfoNames:
 
     def __init__(self):
@@ -273,6 +535,60 @@ class RhcProfiling(SharedDataBase):
                             safe=False,
                             force_reconnection=force_reconnection)
         
+        self.init_phases_dt = InitPhasesDt(cluster_size= cluster_size, 
+                            namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.process_ids = ProcessIds(cluster_size= cluster_size, 
+                            namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.solve_dt_hist = SolveDtHist(cluster_size= cluster_size, 
+                            namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.solve_dt_max = SolveDtMax(cluster_size= cluster_size, 
+                            namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.cntrl_profiling = CntrlProfiling(cluster_size= cluster_size, 
+                            namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.step_phases_dt = StepPhasesDt(namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
+        self.step_phases_hist = StepPhasesHist(namespace = self.namespace,
+                            is_server = is_server, 
+                            verbose = verbose, 
+                            vlevel = vlevel,
+                            safe=False,
+                            force_reconnection=force_reconnection)
+        
         # names
         if self.is_server:
 
@@ -308,6 +624,13 @@ class RhcProfiling(SharedDataBase):
             self.prb_update_dt.get_shared_mem(),
             self.phase_shift_dt.get_shared_mem(),
             self.task_ref_update_dt.get_shared_mem(),
+            self.init_phases_dt.get_shared_mem(),
+            self.process_ids.get_shared_mem(),
+            self.solve_dt_hist.get_shared_mem(),
+            self.solve_dt_max.get_shared_mem(),
+            self.cntrl_profiling.get_shared_mem(),
+            self.step_phases_dt.get_shared_mem(),
+            self.step_phases_hist.get_shared_mem(),
             self.shared_datanames.get_shared_mem()]
     
     def run(self):
@@ -325,6 +648,20 @@ class RhcProfiling(SharedDataBase):
         self.phase_shift_dt.run()
 
         self.task_ref_update_dt.run()
+
+        self.init_phases_dt.run()
+
+        self.process_ids.run()
+
+        self.solve_dt_hist.run()
+
+        self.solve_dt_max.run()
+
+        self.cntrl_profiling.run()
+
+        self.step_phases_dt.run()
+
+        self.step_phases_hist.run()
             
         if self.is_server:
             names_written = self.shared_datanames.write_vec(self.param_keys, 0)
@@ -453,6 +790,55 @@ class RhcProfiling(SharedDataBase):
         self.rti_sol_time.synch_all(read=True, retry = True)
         self.solve_loop_dt.synch_all(read=True, retry = True)
 
+    def synch_hists(self):
+
+        self.solve_dt_hist.synch_all(read=True, retry = True)
+        self.solve_dt_max.synch_all(read=True, retry = True)
+
+    def get_percentiles(self,
+            metric: str,
+            q: List[float] = [50, 95, 99],
+            robot_idxs = None,
+            synch: bool = True):
+        
+        # latency percentiles of a metric (one of SolveDtHist.metrics) over
+        # the cluster (or over the given controllers) and its max
+        if metric not in SolveDtHist.metrics:
+            exception = f"Unknown metric {metric}. Available: {SolveDtHist.metrics}"
+            Journal.log(self.__class__.__name__,
+                "get_percentiles",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        if synch:
+            self.synch_hists()
+        metric_idx = SolveDtHist.metrics.index(metric)
+        counts = self.solve_dt_hist.get_numpy_mirror()[:, 
+                    (metric_idx * HIST_N_BINS):((metric_idx + 1) * HIST_N_BINS)]
+        max_dt = self.solve_dt_max.get_numpy_mirror()[:, metric_idx]
+        if robot_idxs is not None:
+            counts = counts[robot_idxs, :]
+            max_dt = max_dt[robot_idxs]
+        percentiles = hist_percentiles(counts, q=q)
+        stats = {f"p{quantile:g}": percentiles[i] for i, quantile in enumerate(q)}
+        stats["max"] = np.nan if np.all(np.isnan(max_dt)) else np.nanmax(max_dt).item()
+        return stats
+    
+    def get_all_percentiles(self,
+            q: List[float] = [50, 95, 99],
+            robot_idxs = None):
+
+        self.synch_hists()
+        return {metric: self.get_percentiles(metric=metric, q=q, robot_idxs=robot_idxs, synch=False) \
+                for metric in SolveDtHist.metrics}
+
+    def get_cntrl_profiling(self):
+
+        # latest flushed profiling data of each controller, by field
+        self.cntrl_profiling.synch_all(read=True, retry = True)
+        data = self.cntrl_profiling.get_numpy_mirror()
+        return {field: data[:, i].copy() for i, field in enumerate(CntrlProfiling.fields)}
+
     def get_all_info(self):
 
         self.synch_info()
@@ -468,6 +854,13 @@ class RhcProfiling(SharedDataBase):
         self.prb_update_dt.close()
         self.phase_shift_dt.close()
         self.task_ref_update_dt.close()
+        self.init_phases_dt.close()
+        self.process_ids.close()
+        self.solve_dt_hist.close()
+        self.solve_dt_max.close()
+        self.cntrl_profiling.close()
+        self.step_phases_dt.close()
+        self.step_phases_hist.close()
 
     def terminate(self):
 
@@ -0,0 +1,150 @@
+from SharsorIPCpp.PySharsor.wrappers.shared_data_view import SharedTWrapper
+from SharsorIPCpp.PySharsorIPC import VLevel
+from SharsorIPCpp.PySharsorIPC import LogType
+from SharsorIPCpp.PySharsorIPC import Journal
+
+from control_cluster_bridge.utilities.shared_data.state_encoding import contiguous_row_ranges
+
+from typing import List
+
+import torch
+
+# CPU <-> GPU staging for the mirrors of shared views: the CPU mirrors are
+# page-locked (pinned) in place and copies are issued as non-blocking transfers
+# on a dedicated CUDA stream, with an explicit fence to be called before the CPU
+# side is accessed. If CUDA is not available, plain (blocking) copies are used.
+# Views can also be staged on a mock (e.g. CPU) device, on buffers owned by the
+# staging, so that the copy path can be run without a GPU.
+
+class PinnedStaging:
+
+    def __init__(self,
+            views: List[SharedTWrapper],
+            device: str = "cuda", # device of the mirrors the CPU ones are staged to/from
+            verbose: bool = False,
+            vlevel: VLevel = VLevel.V1):
+
+        self._views = views # views must be running and have torch views
+
+        self._verbose = verbose
+        self._vlevel = vlevel
+
+        self._device = torch.device(device)
+        self._use_cuda = self._device.type == "cuda" and torch.cuda.is_available()
+
+        self._stream = None
+        self._event = None
+        self._pinned_ptrs = []
+
+        self._cpu_mirrors = [view.get_torch_mirror(gpu=False) for view in self._views]
+        self._gpu_mirrors = [self._device_mirror(view, cpu_mirror) \
+                        for view, cpu_mirror in zip(self._views, self._cpu_mirrors)]
+
+        if self._use_cuda:
+            self._stream = torch.cuda.Stream()
+            self._event = torch.cuda.Event()
+            self._pin()
+        elif self._device.type == "cuda":
+            Journal.log(self.__class__.__name__,
+                "__init__",
+                "CUDA not available: falling back to plain CPU copies.",
+                LogType.WARN,
+                throw_when_excep = True)
+
+    def __del__(self):
+
+        self.close()
+
+    def _device_mirror(self,
+            view: SharedTWrapper,
+            cpu_mirror: torch.Tensor):
+
+        if not self._device.type == "cuda":
+            return cpu_mirror.clone().to(self._device) # mock device
+        if view.gpu_mirror_exists():
+            return view.get_torch_mirror(gpu=True)
+        return None # nothing to stage
+
+    def get_device_mirrors(self):
+
+        # device side of the staged views (None for views which are not staged)
+        return self._gpu_mirrors
+
+    def _pin(self):
+
+        # page-locks the existing CPU mirrors (no extra buffers)
+        cudart = torch.cuda.cudart()
+        for cpu_mirror in self._cpu_mirrors:
+            if not cpu_mirror.is_contiguous():
+                continue
+            ptr = cpu_mirror.data_ptr()
+            res = cudart.cudaHostRegister(ptr,
+                        cpu_mirror.numel() * cpu_mirror.element_size(), 0)
+            try:
+                torch.cuda.check_error(res)
+                self._pinned_ptrs.append(ptr)
+            except torch.cuda.CudaError as e:
+                Journal.log(self.__class__.__name__,
+                    "_pin",
+                    f"Could not pin CPU mirror ({e}); copies from/to it will be synchronous.",
+                    LogType.WARN,
+                    throw_when_excep = True)
+
+    def _copy(self,
+            to_gpu: bool,
+            robot_idxs = None):
+
+        ranges = None
+        if robot_idxs is not None:
+            ranges = contiguous_row_ranges(robot_idxs)
+        for cpu_mirror, gpu_mirror in zip(self._cpu_mirrors, self._gpu_mirrors):
+            if gpu_mirror is None:
+                continue
+            src, dst = (cpu_mirror, gpu_mirror) if to_gpu else (gpu_mirror, cpu_mirror)
+            if ranges is None:
+                dst.copy_(src, non_blocking=self._use_cuda)
+            else:
+                for row, n_rows in ranges:
+                    dst[row:(row + n_rows), :].copy_(src[row:(row + n_rows), :],
+                                            non_blocking=self._use_cuda)
+
+    def to_cpu(self,
+            robot_idxs = None):
+
+        # GPU -> CPU (call fence() before accessing the CPU mirrors)
+        if self._use_cuda:
+            # copies have to happen after whatever was queued to fill the GPU data
+            self._stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(self._stream):
+                self._copy(to_gpu=False, robot_idxs=robot_idxs)
+            self._event.record(self._stream)
+        else:
+            self._copy(to_gpu=False, robot_idxs=robot_idxs)
+
+    def to_gpu(self,
+            robot_idxs = None):
+
+        # CPU -> GPU (call fence() before modifying the CPU mirrors again)
+        if self._use_cuda:
+            with torch.cuda.stream(self._stream):
+                self._copy(to_gpu=True, robot_idxs=robot_idxs)
+            self._event.record(self._stream)
+            # work queued afterwards on the current stream will see the copied data
+            torch.cuda.current_stream().wait_stream(self._stream)
+        else:
+            self._copy(to_gpu=True, robot_idxs=robot_idxs)
+
+    def fence(self):
+
+        # blocks until all copies issued so far are completed
+        if self._use_cuda:
+            self._event.synchronize()
+
+    def close(self):
+
+        if self._use_cuda and len(self._pinned_ptrs) > 0:
+            self.fence()
+            cudart = torch.cuda.cudart()
+            for ptr in self._pinned_ptrs:
+                cudart.cudaHostUnregister(ptr)
+            self._pinned_ptrs = []
@@ -9,6 +9,7 @@ from SharsorIPCpp.PySharsorIPC import StringTensorServer, StringTensorClient
 
 from control_cluster_bridge.utilities.shared_data.abstractions import SharedDataBase
 from control_cluster_bridge.utilities.shared_data.state_encoding import FullRobState
+from control_cluster_bridge.utilities.shared_data.state_encoding import contiguous_row_ranges
 
 import numpy as np
 
@@ -31,7 +32,8 @@ class RobotState(FullRobState):
             safe: bool = True,
             verbose: bool = False,
             vlevel: VLevel = VLevel.V1,
-            fill_value = 0):
+            fill_value = 0,
+            with_seqlock: bool = False):
 
         basename = "RobotState"
 
@@ -50,7 +52,8 @@ class RobotState(FullRobState):
             safe=safe,
             verbose=verbose,
             vlevel=vlevel,
-            fill_value=fill_value)
+            fill_value=fill_value,
+            with_seqlock=with_seqlock)
 
 class RhcCmds(FullRobState):
 
@@ -69,7 +72,8 @@ class RhcCmds(FullRobState):
             safe: bool = True,
             verbose: bool = False,
             vlevel: VLevel = VLevel.V1,
-            fill_value=0):
+            fill_value=0,
+            with_seqlock: bool = False):
 
         basename = "RhcCmds"
 
@@ -88,8 +92,356 @@ class RhcCmds(FullRobState):
             safe=safe,
             verbose=verbose,
             vlevel=vlevel,
-            fill_value=fill_value)
+            fill_value=fill_value,
+            with_seqlock=with_seqlock)
         
+class RhcSolRecord(SharedTWrapper):
+
+    # packed per-controller solution record: one contiguous row per controller
+    # holding the cmds and the solution status, so that each controller can publish
+    # its whole solution with a single write (instead of one write for each of the 
+    # RhcCmds and RhcStatus views). The server bulk-reads the record and unpacks it 
+    # into its RhcCmds and RhcStatus mirrors
+
+    def __init__(self,
+            namespace = "",
+            is_server = False, 
+            cluster_size: int = -1, 
+            n_jnts: int = -1,
+            n_contacts: int = -1,
+            n_nodes: int = -1,
+            verbose: bool = False, 
+            vlevel: VLevel = VLevel.V0,
+            force_reconnection: bool = False,
+            with_torch_view: bool = False):
+        
+        basename = "RhcSolRecord" # hardcoded
+
+        self.n_jnts = n_jnts
+        self.n_contacts = n_contacts
+        self.n_nodes = n_nodes # ub on the number of nodes (same as RhcStatus)
+
+        # layout of each row (names match the ones of the RhcCmds/RhcStatus views)
+        self._layout = [("jnts_state", 4 * self.n_jnts),
+                    ("contact_wrenches", 6 * self.n_contacts),
+                    ("rhc_cost", 1),
+                    ("rhc_constr_viol", 1),
+                    ("rhc_n_iter", 1),
+                    ("rhc_fail_idx", 1),
+                    ("rhc_nodes_cost", self.n_nodes),
+                    ("rhc_nodes_constr_viol", self.n_nodes),
+                    ("rhc_step_var", self.n_contacts * self.n_nodes)]
+        self._cmds_fields = ["jnts_state", "contact_wrenches"]
+        
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = cluster_size, 
+            n_cols = sum([n for _, n in self._layout]), 
+            verbose = verbose, 
+            vlevel = vlevel,
+            safe = False, # each controller only writes its own row
+            dtype=dtype.Float,
+            force_reconnection=force_reconnection,
+            with_gpu_mirror=False,
+            with_torch_view=with_torch_view,
+            fill_value = 0)
+
+        self._views = {}
+    
+    def run(self):
+
+        super().run()
+
+        expected_n_cols = sum([n for _, n in self._layout])
+        if not self.n_cols == expected_n_cols:
+            exception = f"Found {self.n_cols} columns on shared memory, while " + \
+                f"{expected_n_cols} were expected (n_jnts {self.n_jnts}, n_contacts " + \
+                f"{self.n_contacts}, n_nodes {self.n_nodes})!"
+            Journal.log(self.__class__.__name__,
+                "run",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        
+        self._init_views()
+
+    def _init_views(self):
+
+        if self._with_torch_view:
+            mirror = self.get_torch_mirror()
+        else:
+            mirror = self.get_numpy_mirror()
+        col = 0
+        for name, n in self._layout:
+            self._views[name] = mirror[:, col:(col + n)]
+            col += n
+    
+    def get(self, 
+        name: str):
+
+        return self._views[name]
+    
+    def write_row(self,
+        row_index: int):
+
+        # publishes a whole solution with a single write
+        return self.synch_retry(row_index=row_index, col_index=0,
+                        n_rows=1, n_cols=self.n_cols,
+                        read=False)
+    
+    def read(self,
+        robot_idxs = None):
+
+        # bulk read of the record (only the given rows, if provided)
+        if robot_idxs is None:
+            self.synch_all(read=True, retry=True)
+        else:
+            for row, n_rows in contiguous_row_ranges(robot_idxs):
+                self.synch_retry(row_index=row, col_index=0,
+                        n_rows=n_rows, n_cols=self.n_cols,
+                        read=True)
+    
+    def unpack(self,
+        rhc_cmds: RhcCmds,
+        rhc_status,
+        robot_idxs = None):
+        
+        # copies the (previously read) record into the local mirrors 
+        # of the RhcCmds and RhcStatus views (no shared mem access)
+        ranges = None
+        if robot_idxs is not None:
+            ranges = contiguous_row_ranges(robot_idxs)
+        for name, _ in self._layout:
+            if name in self._cmds_fields:
+                target = getattr(rhc_cmds, name)
+            else:
+                target = getattr(rhc_status, name)
+            if self._with_torch_view:
+                target_mirror = target.get_torch_mirror()
+            else:
+                target_mirror = target.get_numpy_mirror()
+            view = self._views[name]
+            if ranges is None:
+                target_mirror[:, :] = view
+            else:
+                for row, n_rows in ranges:
+                    target_mirror[row:(row + n_rows), :] = view[row:(row + n_rows), :]
+
+class RhcSolHistory(SharedDataBase):
+
+    # per-controller ring buffers holding the solution trajectories (q, v, a, f)
+    # of the last depth solves. Each controller writes one row per solve (trajectories
+    # flattened node-wise, nodes padded to n_nodes with nan) and then increments
+    # its write counter. Readers fetch the last k solutions of a set of controllers
+    # as a single batched array (k should be < depth, since the oldest slot may be
+    # being overwritten while it is read)
+
+    class Trajectories(SharedTWrapper):
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                depth: int = -1,
+                n_cols: int = -1,
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False):
+            
+            basename = "RhcSolHistory" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size * depth, # depth rows for each controller
+                n_cols = n_cols, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # each controller only writes its own rows
+                dtype=dtype.Float,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=False,
+                with_torch_view=False,
+                fill_value = np.nan)
+    
+    class WriteCounter(SharedTWrapper):
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False):
+            
+            basename = "RhcSolHistoryCounter" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size, 
+                n_cols = 1, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # each controller only writes its own row
+                dtype=dtype.Int,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=False,
+                with_torch_view=False,
+                fill_value = 0)
+
+    def __init__(self,
+            namespace = "",
+            is_server = False, 
+            cluster_size: int = -1, 
+            depth: int = -1,
+            n_jnts: int = -1,
+            n_contacts: int = -1,
+            n_nodes: int = -1,
+            verbose: bool = False, 
+            vlevel: VLevel = VLevel.V0,
+            force_reconnection: bool = False):
+
+        self.namespace = namespace
+        self.is_server = is_server
+        self.cluster_size = cluster_size
+        self.depth = depth
+        self.n_nodes = n_nodes # ub on the number of nodes (same as RhcStatus)
+
+        # dims of each trajectory (same as the RhcInternal ones)
+        self._layout = [("q", 3 + 4 + n_jnts),
+                    ("v", 3 + 3 + n_jnts),
+                    ("a", 3 + 3 + n_jnts),
+                    ("f", 6 * n_contacts)]
+        self.n_cols = sum([n_dims for _, n_dims in self._layout]) * self.n_nodes
+
+        self.trajectories = self.Trajectories(namespace=namespace,
+                                is_server=is_server,
+                                cluster_size=cluster_size,
+                                depth=depth,
+                                n_cols=self.n_cols,
+                                verbose=verbose,
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection)
+        self.counter = self.WriteCounter(namespace=namespace,
+                                is_server=is_server,
+                                cluster_size=cluster_size,
+                                verbose=verbose,
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection)
+        
+        self._n_writes = {} # writes of each controller using this client
+        self._row_buffer = None
+        self._is_runnning = False
+    
+    def is_running(self):
+    
+        return self._is_runnning
+    
+    def get_shared_mem(self):
+        return [self.trajectories.get_shared_mem(),
+            self.counter.get_shared_mem()]
+    
+    def run(self):
+
+        self.trajectories.run()
+        self.counter.run()
+
+        if not self.is_server:
+            self.cluster_size = self.counter.n_rows
+            self.depth = self.trajectories.n_rows // self.cluster_size
+        
+        if not self.trajectories.n_cols == self.n_cols:
+            exception = f"Found {self.trajectories.n_cols} columns on shared memory, while " + \
+                f"{self.n_cols} were expected (n_nodes {self.n_nodes})!"
+            Journal.log(self.__class__.__name__,
+                "run",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+        
+        self._row_buffer = np.full((1, self.n_cols), fill_value=np.nan, 
+                            dtype=self.trajectories.get_numpy_mirror().dtype)
+
+        self._is_runnning = True
+    
+    def close(self):
+        
+        if self.is_running():
+            self.trajectories.close()
+            self.counter.close()
+            self._is_runnning = False
+
+    def write(self,
+        row_index: int,
+        sol):
+        
+        # publishes the trajectories of a new solution of the given controller
+        # (sol maps "q", "v", "a", "f" to n_dims x n nodes arrays; None for missing ones)
+        self._row_buffer[:, :] = np.nan
+        col = 0
+        for name, n_dims in self._layout:
+            data = sol.get(name)
+            if data is not None:
+                n_rows = min(n_dims, data.shape[0])
+                n_nodes = min(self.n_nodes, data.shape[1])
+                block = self._row_buffer[0, col:(col + n_dims * self.n_nodes)].reshape(n_dims, self.n_nodes)
+                block[:n_rows, :n_nodes] = data[:n_rows, :n_nodes]
+            col += n_dims * self.n_nodes
+        n_writes = self._n_writes.get(row_index, 0)
+        self.trajectories.write_retry(self._row_buffer, 
+                            row_index=row_index * self.depth + n_writes % self.depth, 
+                            col_index=0)
+        # the counter is incremented only after the row is written
+        self._n_writes[row_index] = n_writes + 1
+        self.counter.write_retry(n_writes + 1, 
+                            row_index=row_index, 
+                            col_index=0)
+    
+    def read_last(self,
+        k: int = 1,
+        robot_idxs = None):
+
+        # returns a (n_robots x k x n_cols) array with the last k solutions (oldest
+        # first) of the given controllers (nan for solutions which were not written yet)
+        if robot_idxs is None:
+            robot_idxs = np.arange(self.cluster_size)
+        robot_idxs = np.asarray(robot_idxs).flatten()
+        k = min(k, self.depth)
+
+        self.counter.synch_all(read=True, retry=True)
+        n_writes = self.counter.get_numpy_mirror()[robot_idxs, :] # n_robots x 1
+        for row, n_rows in contiguous_row_ranges(robot_idxs):
+            self.trajectories.synch_retry(row_index=row * self.depth, col_index=0,
+                            n_rows=n_rows * self.depth, n_cols=self.n_cols,
+                            read=True)
+        
+        write_idxs = n_writes - k + np.arange(k).reshape(1, -1) # n_robots x k
+        slots = np.mod(write_idxs, self.depth)
+        mirror = self.trajectories.get_numpy_mirror().reshape(self.cluster_size, self.depth, self.n_cols)
+        history = mirror[robot_idxs.reshape(-1, 1), slots] # copy
+        history[write_idxs < 0] = np.nan
+        return history
+
+    def get(self,
+        history: np.ndarray,
+        name: str):
+
+        # view of a single trajectory in an array returned by read_last(),
+        # shaped as (..., n_dims, n_nodes)
+        col = 0
+        for field, n_dims in self._layout:
+            if field == name:
+                block = history[..., col:(col + n_dims * self.n_nodes)]
+                return block.reshape(history.shape[:-1] + (n_dims, self.n_nodes))
+            col += n_dims * self.n_nodes
+        Journal.log(self.__class__.__name__,
+            "get",
+            f"No trajectory named {name}!",
+            LogType.EXCEP,
+            throw_when_excep = True)
+
 class RhcRefs(SharedDataBase):
     
     class RobotFullConfigRef(FullRobState):
@@ -452,6 +804,123 @@ class RhcStatus(SharedDataBase):
                 with_gpu_mirror=with_gpu_mirror,
                 with_torch_view=with_torch_view,
                 fill_value = False)
+    
+    class ReadyFlagView(SharedTWrapper):
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False,
+                with_gpu_mirror: bool = False,
+                with_torch_view: bool = False):
+            
+            basename = "ClusterReadyFlag" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size, 
+                n_cols = 1, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # boolean operations are atomic on 64 bit systems
+                dtype=dtype.Bool,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=with_gpu_mirror,
+                with_torch_view=with_torch_view,
+                fill_value = False)
+            
+    class RespawnCounterView(SharedTWrapper):
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False,
+                with_gpu_mirror: bool = False,
+                with_torch_view: bool = False):
+            
+            basename = "ClusterRespawnCounter" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size, 
+                n_cols = 1, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # only written by the cluster client
+                dtype=dtype.Int,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=with_gpu_mirror,
+                with_torch_view=with_torch_view,
+                fill_value = 0)
+            
+    class HeartbeatView(SharedTWrapper):
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False,
+                with_gpu_mirror: bool = False,
+                with_torch_view: bool = False):
+            
+            basename = "ClusterHeartbeat" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size, 
+                n_cols = 1, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # each row is only written by its controller
+                dtype=dtype.Int,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=with_gpu_mirror,
+                with_torch_view=with_torch_view,
+                fill_value = 0)
+            
+    class InternalStreamingView(SharedTWrapper):
+
+        # runtime control of the RhcInternal streaming of each controller: 
+        # publication decimation (0 disables streaming) and one enable flag per field
+        # (-1 means not set, i.e. controllers use their defaults)
+        fields = ["q", "v", "a", "a_dot", "f", "f_dot", "eff", "costs", "constr"]
+
+        def __init__(self,
+                namespace = "",
+                is_server = False, 
+                cluster_size: int = -1, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                force_reconnection: bool = False,
+                with_gpu_mirror: bool = False,
+                with_torch_view: bool = False):
+            
+            basename = "RhcInternalStreaming" # hardcoded
+
+            super().__init__(namespace = namespace,
+                basename = basename,
+                is_server = is_server, 
+                n_rows = cluster_size, 
+                n_cols = 1 + len(RhcStatus.InternalStreamingView.fields), 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = False, # only written by the server (or GUI)
+                dtype=dtype.Int,
+                force_reconnection=force_reconnection,
+                with_gpu_mirror=with_gpu_mirror,
+                with_torch_view=with_torch_view,
+                fill_value = -1)
             
     class ControllersCounterView(SharedTWrapper):
 
@@ -682,6 +1151,29 @@ class RhcStatus(SharedDataBase):
         
         def tot_dim(self):
             return self.n_cols
+        
+        def set_many(self,
+                data,
+                robot_idx: int):
+            
+            # sets the step variables of all contacts of a robot at once (local mirror only):
+            # data is n_contacts x n (n <= n_nodes, the remaining nodes are left untouched)
+            if self._with_torch_view:
+                row = self.get_torch_mirror()[robot_idx, :]
+            else:
+                row = self.get_numpy_mirror()[robot_idx, :]
+            n_contacts = data.shape[0]
+            row.reshape(n_contacts, -1)[:, :data.shape[1]] = data
+        
+        def write_many(self,
+                data,
+                robot_idx: int):
+            
+            # same as set_many, but also writes the whole row with a single synch
+            self.set_many(data=data, robot_idx=robot_idx)
+            return self.synch_retry(row_index=robot_idx, col_index=0,
+                            n_rows=1, n_cols=self.n_cols,
+                            read=False)
     
     class RhcFailIndex(SharedTWrapper): 
 
@@ -782,6 +1274,42 @@ class RhcStatus(SharedDataBase):
                                 with_gpu_mirror=with_gpu_mirror,
                                 with_torch_view=with_torch_view)
 
+        self.ready = self.ReadyFlagView(namespace=self.namespace, 
+                                is_server=self.is_server, 
+                                cluster_size=self.cluster_size, 
+                                verbose=self.verbose, 
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection,
+                                with_gpu_mirror=with_gpu_mirror,
+                                with_torch_view=with_torch_view) # set by controllers once fully initialized
+        
+        self.respawns = self.RespawnCounterView(namespace=self.namespace, 
+                                is_server=self.is_server, 
+                                cluster_size=self.cluster_size, 
+                                verbose=self.verbose, 
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection,
+                                with_gpu_mirror=with_gpu_mirror,
+                                with_torch_view=with_torch_view) # incremented each time a controller is respawned
+        
+        self.heartbeat = self.HeartbeatView(namespace=self.namespace, 
+                                is_server=self.is_server, 
+                                cluster_size=self.cluster_size, 
+                                verbose=self.verbose, 
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection,
+                                with_gpu_mirror=with_gpu_mirror,
+                                with_torch_view=with_torch_view) # periodically incremented by live controllers
+        
+        self.internal_streaming = self.InternalStreamingView(namespace=self.namespace, 
+                                is_server=self.is_server, 
+                                cluster_size=self.cluster_size, 
+                                verbose=self.verbose, 
+                                vlevel=vlevel,
+                                force_reconnection=force_reconnection,
+                                with_gpu_mirror=with_gpu_mirror,
+                                with_torch_view=with_torch_view) # decimation and fields of RhcInternal streaming
+
         self.controllers_counter = self.ControllersCounterView(namespace=self.namespace, 
                                 is_server=self.is_server, 
                                 verbose=self.verbose, 
@@ -884,6 +1412,10 @@ class RhcStatus(SharedDataBase):
             self.trigger.get_shared_mem(),
             self.activation_state.get_shared_mem(),
             self.registration.get_shared_mem(),
+            self.ready.get_shared_mem(),
+            self.respawns.get_shared_mem(),
+            self.heartbeat.get_shared_mem(),
+            self.internal_streaming.get_shared_mem(),
             self.controllers_counter.get_shared_mem(),
             self.controllers_fail_counter.get_shared_mem(),
             self.rhc_cost.get_shared_mem(),
@@ -901,6 +1433,10 @@ class RhcStatus(SharedDataBase):
         self.fails.run()
         self.activation_state.run()
         self.registration.run()
+        self.ready.run()
+        self.respawns.run()
+        self.heartbeat.run()
+        self.internal_streaming.run()
         self.controllers_counter.run()
         self.controllers_fail_counter.run()
         self.rhc_cost.run()
@@ -928,6 +1464,10 @@ class RhcStatus(SharedDataBase):
             self.fails.close()    
             self.activation_state.close()
             self.registration.close()
+            self.ready.close()
+            self.respawns.close()
+            self.heartbeat.close()
+            self.internal_streaming.close()
             self.controllers_counter.close()
             self.controllers_fail_counter.close()
             self.rhc_n_iter.close()
@@ -1177,6 +1717,166 @@ class RhcInternal(SharedDataBase):
                     safe = safe,
                     force_reconnection = force_reconnection) 
     
+    class PackedTerms(SharedDataBase):
+
+        # costs (or constraints) packed in a single contiguous block (one row
+        # for each dimension of each term, one column per node), so that all of 
+        # them can be written with a single call. Names and dims are also shared,
+        # so that clients can unpack the block
+
+        def __init__(self,
+                basename: str,
+                names: List[str] = None, # not needed if client
+                dimensions: List[int] = None, # not needed if client
+                n_nodes: int = -1, # not needed if client 
+                namespace = "",
+                is_server = False, 
+                verbose: bool = False, 
+                vlevel: VLevel = VLevel.V0,
+                safe: bool = True,
+                force_reconnection: bool = False):
+
+            self.names = names
+            self.dimensions = dimensions
+            self.n_nodes = n_nodes
+            self.is_server = is_server
+
+            self._verbose = verbose
+
+            n_terms = len(names) if is_server else -1
+            
+            self.data = SharedTWrapper(namespace = namespace,
+                basename = basename + "Data",
+                is_server = is_server, 
+                n_rows = sum(dimensions) if is_server else -1, 
+                n_cols = n_nodes, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = safe,
+                dtype=dtype.Float,
+                force_reconnection=force_reconnection,
+                fill_value = np.nan)
+            self.dims = SharedTWrapper(namespace = namespace,
+                basename = basename + "Dims",
+                is_server = is_server, 
+                n_rows = 1, 
+                n_cols = n_terms, 
+                verbose = verbose, 
+                vlevel = vlevel,
+                safe = safe,
+                dtype=dtype.Int,
+                force_reconnection=force_reconnection,
+                fill_value = 0)
+            if is_server:
+                self._shared_names = StringTensorServer(length = n_terms, 
+                                        basename = basename + "Names", 
+                                        name_space = namespace,
+                                        verbose = verbose, 
+                                        vlevel = vlevel,
+                                        safe = safe,
+                                        force_reconnection = force_reconnection)
+            else:
+                self._shared_names = StringTensorClient(
+                                        basename = basename + "Names", 
+                                        name_space = namespace,
+                                        verbose = verbose, 
+                                        vlevel = vlevel,
+                                        safe = safe)
+            
+            self._offsets = {} # first row and n. of rows of each term
+            self._is_running = False
+        
+        def is_running(self):
+
+            return self._is_running
+        
+        def get_shared_mem(self):
+            return [self.data.get_shared_mem(),
+                self.dims.get_shared_mem(),
+                self._shared_names.get_shared_mem()]
+        
+        def run(self):
+
+            self.data.run()
+            self.dims.run()
+            self._shared_names.run()
+
+            if self.is_server:
+                self.dims.get_numpy_mirror()[0, :] = self.dimensions
+                self.dims.synch_all(read=False, retry=True)
+                if not self._shared_names.write_vec(self.names, 0):
+                    Journal.log(self.__class__.__name__,
+                        "run",
+                        "Could not write term names on shared memory!",
+                        LogType.EXCEP,
+                        throw_when_excep = True)
+            else:
+                self.dims.synch_all(read=True, retry=True)
+                self.dimensions = self.dims.get_numpy_mirror()[0, :].tolist()
+                self.names = [""] * len(self.dimensions)
+                while not self._shared_names.read_vec(self.names, 0):
+                    Journal.log(self.__class__.__name__,
+                        "run",
+                        "Could not read term names on shared memory. Retrying...",
+                        LogType.WARN,
+                        throw_when_excep = True)
+            
+            self.n_nodes = self.data.n_cols
+
+            row = 0
+            for name, dim in zip(self.names, self.dimensions):
+                self._offsets[name] = (row, dim)
+                row += dim
+
+            self._is_running = True
+
+        def close(self):
+
+            self.data.close()
+            self.dims.close()
+            self._shared_names.close()
+
+        def synch(self):
+
+            self.data.synch_all(read=True, retry=True)
+
+        def write(self,
+                data: np.ndarray,
+                name: str,
+                retry: bool = True):
+            
+            # single term
+            row, _ = self._offsets[name]
+            if retry:
+                self.data.write_retry(data=data,
+                        row_index=row, col_index=0)
+            else:
+                self.data.write(data=data,
+                        row_index=row, col_index=0)
+
+        def write_all(self,
+                data: List[np.ndarray],
+                retry: bool = True):
+            
+            # all terms (ordered as names) with a single write
+            mirror = self.data.get_numpy_mirror()
+            for name, term_data in zip(self.names, data):
+                if term_data is None:
+                    continue
+                row, dim = self._offsets[name]
+                term_data = np.reshape(term_data, (dim, -1))
+                mirror[row:(row + dim), :term_data.shape[1]] = term_data
+            if retry:
+                self.data.synch_all(read=False, retry=True)
+            else:
+                self.data.synch_all(read=False, retry=False)
+
+        def get(self,
+                name: str):
+            
+            row, dim = self._offsets[name]
+            return self.data.get_numpy_mirror()[row:(row + dim), :]
+    
     class Config():
 
         def __init__(self,
@@ -1193,9 +1893,13 @@ class RhcInternal(SharedDataBase):
             cost_dims: List[int] = None, 
             constr_dims: List[int] = None,
             enable_costs: bool = False,
-            enable_constr: bool = False):
+            enable_constr: bool = False,
+            pack_terms: bool = False):
 
             self.is_server = is_server
+            
+            self.pack_terms = pack_terms # if True, costs and constraints are each packed 
+            # in a single contiguous block (see PackedTerms), which has to match on clients
 
             self.enable_q = enable_q
             self.enable_v = enable_v
@@ -1426,7 +2130,18 @@ class RhcInternal(SharedDataBase):
                     force_reconnection=force_reconnection,
                     safe=safe)
             
-        if self.config.enable_costs:
+        if self.config.enable_costs and self.config.pack_terms:
+            self.costs = self.PackedTerms(basename = "RhcPackedCosts",
+                    names = self.config.cost_names, # not needed if client
+                    dimensions = self.config.cost_dims, # not needed if client
+                    n_nodes = n_nodes, # not needed if client 
+                    namespace = self.namespace,
+                    is_server = self._is_server, 
+                    verbose = verbose, 
+                    vlevel = vlevel,
+                    force_reconnection=force_reconnection,
+                    safe=safe)
+        elif self.config.enable_costs:
             self.costs = self.RHCosts(names = self.config.cost_names, # not needed if client
                     dimensions = self.config.cost_dims, # not needed if client
                     n_nodes = n_nodes, # not needed if client 
@@ -1437,7 +2152,18 @@ class RhcInternal(SharedDataBase):
                     force_reconnection=force_reconnection,
                     safe=safe)
         
-        if self.config.enable_constr:
+        if self.config.enable_constr and self.config.pack_terms:
+            self.cnstr = self.PackedTerms(basename = "RhcPackedConstr",
+                    names = self.config.constr_names, # not needed if client
+                    dimensions = self.config.constr_dims, # not needed if client
+                    n_nodes = n_nodes, # not needed if client 
+                    namespace = self.namespace,
+                    is_server = self._is_server, 
+                    verbose = verbose, 
+                    vlevel = vlevel,
+                    force_reconnection=force_reconnection,
+                    safe=safe)
+        elif self.config.enable_constr:
             self.cnstr = self.RHConstr(names = self.config.constr_names, # not needed if client
                     dimensions = self.config.constr_dims, # not needed if client
                     n_nodes = n_nodes, # not needed if client 
@@ -1735,6 +2461,22 @@ class RhcInternal(SharedDataBase):
                             name=cost_name,
                             retry=retry)
     
+    def write_costs(self, 
+                data: List[np.ndarray],
+                retry = True):
+
+        # all costs (ordered as config.cost_names), with a single write if packed
+        self._check_running_or_throw("write_costs")
+        if self.costs is not None:
+            if self.config.pack_terms:
+                self.costs.write_all(data=data,
+                            retry=retry)
+            else:
+                for cost_name, cost_data in zip(self.config.cost_names, data):
+                    self.write_cost(cost_name=cost_name,
+                            data=cost_data,
+                            retry=retry)
+    
     def read_cost(self, 
             cost_name: str,
             retry = True):
@@ -1761,6 +2503,22 @@ class RhcInternal(SharedDataBase):
                             name=constr_name,
                             retry=retry)
             
+    def write_constraints(self, 
+                data: List[np.ndarray],
+                retry = True):
+
+        # all constraints (ordered as config.constr_names), with a single write if packed
+        self._check_running_or_throw("write_constraints")
+        if self.cnstr is not None:
+            if self.config.pack_terms:
+                self.cnstr.write_all(data=data,
+                            retry=retry)
+            else:
+                for constr_name, constr_data in zip(self.config.constr_names, data):
+                    self.write_constr(constr_name=constr_name,
+                            data=constr_data,
+                            retry=retry)
+    
     def read_constr(self, 
             constr_name,
             retry = True):
@@ -13,6 +13,90 @@ from typing import List
 # robot data abstractions describing a robot state
 # (for both robot state and rhc cmds)
 
+def contiguous_row_ranges(robot_idxs):
+    
+    # groups (sorted) robot indexes into blocks of contiguous rows,
+    # returned as a list of (start row, n. rows)
+    idxs = np.asarray(robot_idxs).flatten()
+    if idxs.shape[0] == 0:
+        return []
+    splits = np.flatnonzero(np.diff(idxs) != 1) + 1
+    starts = np.concatenate(([0], splits))
+    ends = np.concatenate((splits, [idxs.shape[0]]))
+    return [(int(idxs[start]), int(end - start)) for start, end in zip(starts, ends)]
+
+class AccessPlan:
+
+    # column access to a (possibly remapped) view, compiled once: identity (or no) 
+    # remappings collapse to plain views, while permutations are gathered into a new
+    # array at each get(), unless an output buffer is given (e.g. preallocated by the 
+    # caller to avoid allocations when reading all robots at each step)
+
+    def __init__(self,
+            data,
+            remapping = None):
+
+        self.data = data
+        self._is_torch = not isinstance(data, np.ndarray)
+
+        self.remapping = None
+        if remapping is not None and \
+            not (np.asarray(remapping.tolist()) == np.arange(len(remapping))).all():
+            self.remapping = remapping
+    
+    def _rows(self,
+            robot_idxs):
+        
+        # robot idxs to be combined with the remapping (column vector
+        # for multiple robots, so that the two index arrays broadcast)
+        if np.ndim(robot_idxs) == 0:
+            return robot_idxs
+        if self._is_torch:
+            import torch
+            return torch.as_tensor(robot_idxs, device=self.data.device).reshape(-1, 1)
+        return np.asarray(robot_idxs).reshape(-1, 1)
+    
+    def get(self,
+            robot_idxs = None,
+            out = None):
+
+        if out is not None:
+            if robot_idxs is None and self.remapping is not None:
+                # gathered directly into out
+                if self._is_torch:
+                    import torch
+                    torch.index_select(self.data, 1, self.remapping, out=out)
+                else:
+                    np.take(self.data, self.remapping, axis=1, out=out)
+            else:
+                out[...] = self.get(robot_idxs=robot_idxs)
+            return out
+        if self.remapping is None:
+            if robot_idxs is None:
+                return self.data
+            else:
+                return self.data[robot_idxs, :]
+        if robot_idxs is None:
+            if self._is_torch:
+                import torch
+                return torch.index_select(self.data, 1, self.remapping)
+            return np.take(self.data, self.remapping, axis=1)
+        return self.data[self._rows(robot_idxs), self.remapping]
+    
+    def set(self,
+            data,
+            robot_idxs = None):
+
+        if self.remapping is None:
+            if robot_idxs is None:
+                self.data[:, :] = data
+            else:
+                self.data[robot_idxs, :] = data
+        elif robot_idxs is None:
+            self.data[:, self.remapping] = data
+        else:
+            self.data[self._rows(robot_idxs), self.remapping] = data
+
 class JntsState(SharedTWrapper):
 
     def __init__(self,
@@ -82,6 +166,10 @@ class JntsState(SharedTWrapper):
         self._v_gpu = None
         self._a_gpu = None
         self._eff_gpu = None
+
+        # access plans of each field (built upon run and remapping changes)
+        self._plans = {}
+        self._plans_gpu = {}
     
     def run(self,
         jnts_remapping: List[int] = None):
@@ -127,7 +215,20 @@ class JntsState(SharedTWrapper):
                         LogType.WARN,
                         throw_when_excep = True)
         self.set_jnts_remapping(jnts_remapping=jnts_remapping)
+        self._build_plans()
+
+    def _build_plans(self):
 
+        self._plans = {"q": AccessPlan(self._q, self._jnts_remapping),
+                    "v": AccessPlan(self._v, self._jnts_remapping),
+                    "a": AccessPlan(self._a, self._jnts_remapping),
+                    "eff": AccessPlan(self._eff, self._jnts_remapping)}
+        if self.gpu_mirror_exists():
+            self._plans_gpu = {"q": AccessPlan(self._q_gpu, self._jnts_remapping_gpu),
+                        "v": AccessPlan(self._v_gpu, self._jnts_remapping_gpu),
+                        "a": AccessPlan(self._a_gpu, self._jnts_remapping_gpu),
+                        "eff": AccessPlan(self._eff_gpu, self._jnts_remapping_gpu)}
+        
     def set_jnts_remapping(self, 
                 jnts_remapping: List[int] = None):
         
@@ -147,6 +248,8 @@ class JntsState(SharedTWrapper):
                     self._jnts_remapping_gpu = torch.tensor(jnts_remapping, dtype=torch.int64, device="cuda")
             else:
                 self._jnts_remapping = np.array(jnts_remapping, dtype=np.int64)
+            if len(self._plans) > 0:
+                self._build_plans() # remapping changed after run
         
     def _check_running(self,
                 calling_method: str):
@@ -187,28 +290,8 @@ class JntsState(SharedTWrapper):
                 name: str,
                 gpu: bool = False):
         
-        if not gpu:
-            if name == "q":
-                return self._q
-            elif name == "v":
-                return self._v
-            elif name == "a":
-                return self._a
-            elif name == "eff":
-                return self._eff
-            else:
-                return None
-        else:
-            if name == "q":
-                return self._q_gpu
-            elif name == "v":
-                return self._v_gpu
-            elif name == "a":
-                return self._a_gpu
-            elif name == "eff":
-                return self._eff_gpu
-            else:
-                return None
+        plan = (self._plans_gpu if gpu else self._plans).get(name)
+        return None if plan is None else plan.data
     
     def get_remapping(self):
 
@@ -220,38 +303,17 @@ class JntsState(SharedTWrapper):
             robot_idxs= None,
             gpu: bool = False):
 
-        internal_data = self._retrieve_data(name=data_type,
-                    gpu=gpu)
-        
-        if self._jnts_remapping is None:
-            if robot_idxs is None:
-                internal_data[:, :] = data
-            else:
-                internal_data[robot_idxs, :] = data
-        else:
-            if robot_idxs is None:
-                internal_data[:, self._jnts_remapping] = data
-            else:
-                internal_data[robot_idxs, self._jnts_remapping] = data
+        plans = self._plans_gpu if gpu else self._plans
+        plans[data_type].set(data, robot_idxs=robot_idxs)
 
     def get(self,
         data_type: str,
         robot_idxs = None,
-        gpu: bool = False):
+        gpu: bool = False,
+        out = None): # optional output buffer (filled and returned)
 
-        internal_data = self._retrieve_data(name=data_type,
-                    gpu=gpu)
-            
-        if self._jnts_remapping is None:
-            if robot_idxs is None:
-                return internal_data
-            else:
-                return internal_data[robot_idxs, :]
-        else:
-            if robot_idxs is None:
-                return internal_data[:, self._jnts_remapping]
-            else:
-                return internal_data[robot_idxs, self._jnts_remapping]
+        plans = self._plans_gpu if gpu else self._plans
+        return plans[data_type].get(robot_idxs=robot_idxs, out=out)
          
 class RootState(SharedTWrapper):
 
@@ -313,6 +375,10 @@ class RootState(SharedTWrapper):
         self._omega_gpu = None
         self._q_full_gpu = None
         self._twist_gpu = None 
+
+        # access plans of each field (built upon run and remapping changes)
+        self._plans = {}
+        self._plans_gpu = {}
         
     def run(self,
             q_remapping: List[int] = None):
@@ -323,6 +389,23 @@ class RootState(SharedTWrapper):
             self.n_robots = self.n_rows
         self._init_views()
         self.set_q_remapping(q_remapping)
+        self._build_plans()
+
+    def _build_plans(self):
+
+        self._plans = {"p": AccessPlan(self._p),
+                    "q": AccessPlan(self._q, self._q_remapping),
+                    "q_full": AccessPlan(self._q_full, self._q_full_remapping),
+                    "v": AccessPlan(self._v),
+                    "omega": AccessPlan(self._omega),
+                    "twist": AccessPlan(self._twist)}
+        if self.gpu_mirror_exists():
+            self._plans_gpu = {"p": AccessPlan(self._p_gpu),
+                        "q": AccessPlan(self._q_gpu, self._q_remapping_gpu),
+                        "q_full": AccessPlan(self._q_full_gpu, self._q_full_remapping_gpu),
+                        "v": AccessPlan(self._v_gpu),
+                        "omega": AccessPlan(self._omega_gpu),
+                        "twist": AccessPlan(self._twist_gpu)}
 
     def get_remapping(self):
 
@@ -354,6 +437,8 @@ class RootState(SharedTWrapper):
             else:
                 self._q_remapping = np.array(q_remapping, dtype=np.int64)
                 self._q_full_remapping = np.array(q_remap_full_list, dtype=np.int64)
+            if len(self._plans) > 0:
+                self._build_plans() # remapping changed after run
 
     def _init_views(self):
 
@@ -390,36 +475,10 @@ class RootState(SharedTWrapper):
                 name: str,
                 gpu: bool = False):
         
-        if not gpu:
-            if name == "p":
-                return self._p, None
-            elif name == "q":
-                return self._q, self._q_remapping
-            elif name == "q_full":
-                return self._q_full, self._q_full_remapping
-            elif name == "v":
-                return self._v, None
-            elif name == "omega":
-                return self._omega, None
-            elif name == "twist":
-                return self._twist, None
-            else:
-                return None, None
-        else:
-            if name == "p":
-                return self._p_gpu, None
-            elif name == "q":
-                return self._q_gpu, self._q_remapping_gpu
-            elif name == "q_full":
-                return self._q_full_gpu, self._q_full_remapping_gpu
-            elif name == "v":
-                return self._v_gpu, None
-            elif name == "omega":
-                return self._omega_gpu, None
-            elif name == "twist":
-                return self._twist_gpu, None
-            else:
-                return None, None
+        plan = (self._plans_gpu if gpu else self._plans).get(name)
+        if plan is None:
+            return None, None
+        return plan.data, plan.remapping
     
     def set(self,
             data,
@@ -427,38 +486,17 @@ class RootState(SharedTWrapper):
             robot_idxs= None,
             gpu: bool = False):
 
-        internal_data, remapping = self._retrieve_data(name=data_type,
-                    gpu=gpu)
-        
-        if remapping is None:
-            if robot_idxs is None:
-                internal_data[:, :] = data
-            else:
-                internal_data[robot_idxs, :] = data
-        else:
-            if robot_idxs is None:
-                internal_data[:, remapping] = data
-            else:
-                internal_data[robot_idxs, remapping] = data
+        plans = self._plans_gpu if gpu else self._plans
+        plans[data_type].set(data, robot_idxs=robot_idxs)
 
     def get(self,
         data_type: str,
         robot_idxs = None,
-        gpu: bool = False):
+        gpu: bool = False,
+        out = None): # optional output buffer (filled and returned)
 
-        internal_data, remapping = self._retrieve_data(name=data_type,
-                    gpu=gpu)
-            
-        if remapping is None:
-            if robot_idxs is None:
-                return internal_data
-            else:
-                return internal_data[robot_idxs, :]
-        else:
-            if robot_idxs is None:
-                return internal_data[:, remapping]
-            else:
-                return internal_data[robot_idxs, remapping]
+        plans = self._plans_gpu if gpu else self._plans
+        return plans[data_type].get(robot_idxs=robot_idxs, out=out)
             
 class ContactWrenches(SharedTWrapper):
 
@@ -641,6 +679,23 @@ class ContactWrenches(SharedTWrapper):
             else:
                 internal_data[robot_idxs, (contact_idx * 3):((contact_idx+1) * 3)] = data
         
+    def set_all_contacts(self,
+            data,
+            data_type: str,
+            robot_idxs = None,
+            gpu: bool = False):
+
+        # sets the data of all contacts at once (ordered as contact_names): data is
+        # n_contacts x 3, or n_robots x n_contacts x 3 for multiple robots
+        internal_data = self._retrieve_data(name=data_type,
+                    gpu=gpu)
+        n_robots = internal_data.shape[0] if robot_idxs is None else np.size(robot_idxs)
+        data = data.reshape(n_robots, self.n_contacts * 3)
+        if robot_idxs is None:
+            internal_data[:, :] = data
+        else:
+            internal_data[robot_idxs, :] = data
+        
     def get(self,
             data_type: str,
             contact_name: str = None,
@@ -670,6 +725,36 @@ class ContactWrenches(SharedTWrapper):
             else:
                 return internal_data[robot_idxs, :]
             
+class SeqCounterView(SharedTWrapper):
+
+    # per-robot sequence counters implementing a seqlock on top of safe=False 
+    # views: the writer of a row bumps its counter before (-> odd) and after (-> even) 
+    # writing it, readers retry only if a counter was odd or changed during the read
+
+    def __init__(self,
+            namespace = "",
+            is_server = False, 
+            n_robots: int = -1, 
+            verbose: bool = False, 
+            vlevel: VLevel = VLevel.V0,
+            force_reconnection: bool = False):
+        
+        basename = "SeqCounter" # hardcoded
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server, 
+            n_rows = n_robots, 
+            n_cols = 1, 
+            verbose = verbose, 
+            vlevel = vlevel,
+            safe = False, # each row has a single writer
+            dtype=sharsor_dtype.Int,
+            force_reconnection=force_reconnection,
+            with_gpu_mirror=False,
+            with_torch_view=False,
+            fill_value = 0)
+
 class FullRobState(SharedDataBase):
 
     def __init__(self,
@@ -688,7 +773,8 @@ class FullRobState(SharedDataBase):
             safe: bool = True,
             verbose: bool = False,
             vlevel: VLevel = VLevel.V1,
-            fill_value = 0):
+            fill_value = 0,
+            with_seqlock: bool = False):
 
         self._namespace = namespace
         self._basename = basename
@@ -751,6 +837,18 @@ class FullRobState(SharedDataBase):
                             with_torch_view=with_torch_view,
                             fill_value=fill_value)
         
+        self._seq_counter = None # only used with the seqlock (has to be enabled on both sides)
+        if with_seqlock:
+            self._seq_counter = SeqCounterView(namespace=self._namespace + self._basename, 
+                            is_server=self._is_server,
+                            n_robots=self._n_robots,
+                            verbose=self._verbose,
+                            vlevel=self._vlevel,
+                            force_reconnection=self._force_reconnection)
+        self._seq_modulo = 2**30 # even -> parity is preserved at wrap-around
+        self._seq_max_retries = 1000 # a writer dying mid-write leaves its counter odd (until the
+        # next write of that row, see _seq_bump())
+        
         self._is_running = False
     
     def __del__(self):
@@ -758,9 +856,12 @@ class FullRobState(SharedDataBase):
         self.close()
     
     def get_shared_mem(self):
-        return [self.root_state.get_shared_mem(),
+        shared_mem = [self.root_state.get_shared_mem(),
             self.jnts_state.get_shared_mem(),
             self.contact_wrenches.get_shared_mem()]
+        if self._seq_counter is not None:
+            shared_mem.append(self._seq_counter.get_shared_mem())
+        return shared_mem
     
     def n_robots(self):
 
@@ -805,6 +906,13 @@ class FullRobState(SharedDataBase):
 
         self.contact_wrenches.run()
 
+        if self._seq_counter is not None:
+            self._seq_counter.run()
+            if not self._is_server:
+                # we start from the counters currently on shared mem
+                self._seq_counter.synch_all(read=True, retry=True)
+                self._check_seq_parity()
+
         if not self._is_server:
 
             self._n_robots = self.jnts_state.n_robots
@@ -829,36 +937,183 @@ class FullRobState(SharedDataBase):
                 # synchs root_state and jnt_state (which will normally live on GPU)
                 # with the shared state data using the aggregate view (normally on CPU)
                 # this requires (not so nice) COPIES FROM GPU TO CPU
-                self.root_state.synch_mirror(from_gpu=True)
-                self.jnts_state.synch_mirror(from_gpu=True)
-                self.contact_wrenches.synch_mirror(from_gpu=True)
+                self.synch_mirror_views(from_gpu=True)
                 self.synch_to_shared_mem()
             else:
                 self.synch_from_shared_mem()
                 # copy from CPU to GPU
-                self.root_state.synch_mirror(from_gpu=False)
-                self.jnts_state.synch_mirror(from_gpu=False)
-                self.contact_wrenches.synch_mirror(from_gpu=False)
+                self.synch_mirror_views(from_gpu=False)
 
             #torch.cuda.synchronize() # this way we ensure that after this the state on GPU
             # is fully updated
     
-    def synch_from_shared_mem(self):
+    def synch_mirror_views(self,
+                from_gpu: bool,
+                robot_idxs = None):
 
-        # reads from shared mem
-        self.root_state.synch_all(read = True, retry = True)
-        self.jnts_state.synch_all(read = True, retry = True)
-        self.contact_wrenches.synch_all(read = True, retry = True)
+        # only synchs the CPU and GPU mirrors of all views 
+        # (shared memory is not touched)
+        if self._with_gpu_mirror:
+            if robot_idxs is None:
+                self.root_state.synch_mirror(from_gpu=from_gpu)
+                self.jnts_state.synch_mirror(from_gpu=from_gpu)
+                self.contact_wrenches.synch_mirror(from_gpu=from_gpu)
+            else:
+                # only copies the rows of the given robots
+                for view in [self.root_state, self.jnts_state, self.contact_wrenches]:
+                    cpu_mirror = view.get_torch_mirror(gpu=False)
+                    gpu_mirror = view.get_torch_mirror(gpu=True)
+                    for row, n_rows in contiguous_row_ranges(robot_idxs):
+                        if from_gpu:
+                            cpu_mirror[row:(row + n_rows), :].copy_(gpu_mirror[row:(row + n_rows), :])
+                        else:
+                            gpu_mirror[row:(row + n_rows), :].copy_(cpu_mirror[row:(row + n_rows), :])
+    
+    def synch_from_shared_mem(self,
+                robot_idxs = None):
 
+        # reads from shared mem
+        if self._seq_counter is not None:
+            if robot_idxs is None:
+                self._seq_read(ranges=[(0, self._n_robots)])
+            else:
+                self._seq_read(ranges=contiguous_row_ranges(robot_idxs))
+        elif robot_idxs is None:
+            self.root_state.synch_all(read = True, retry = True)
+            self.jnts_state.synch_all(read = True, retry = True)
+            self.contact_wrenches.synch_all(read = True, retry = True)
+        else:
+            # only reads the rows of the given robots (one 
+            # synch per block of contiguous rows)
+            for row, n_rows in contiguous_row_ranges(robot_idxs):
+                self._synch_rows(row_index=row,
+                            n_rows=n_rows,
+                            read=True)
+
+    def synch_row_from_shared_mem(self,
+                row_index: int):
+
+        # only reads the root, jnts and contacts state of
+        # a single robot (e.g. the one of a controller)
+        if self._seq_counter is not None:
+            self._seq_read(ranges=[(row_index, 1)])
+        else:
+            self._synch_rows(row_index=row_index,
+                        n_rows=1,
+                        read=True)
+        
     def synch_to_shared_mem(self):
 
         # write to shared mem
+        self._seq_bump(begin=True) # -> odd (write in progress)
         self.root_state.synch_all(read = False, retry = True)
         self.jnts_state.synch_all(read = False, retry = True)
         self.contact_wrenches.synch_all(read = False, retry = True)
+        self._seq_bump(begin=False) # -> even (write completed)
+
+    def synch_row_to_shared_mem(self,
+                row_index: int,
+                views: List[str] = None):
+
+        # only writes the given views (defaults to all) of a single 
+        # robot (e.g. the cmds of a controller)
+        if views is None:
+            views = ["root_state", "jnts_state", "contact_wrenches"]
+        self._seq_bump(begin=True, row_index=row_index, n_rows=1)
+        for view_name in views:
+            view = getattr(self, view_name)
+            view.synch_retry(row_index=row_index, col_index=0, 
+                        n_rows=1, n_cols=view.n_cols,
+                        read=False)
+        self._seq_bump(begin=False, row_index=row_index, n_rows=1)
+    
+    def _seq_bump(self,
+                begin: bool,
+                row_index: int = None,
+                n_rows: int = None):
+        
+        if self._seq_counter is None:
+            return
+        counters = self._seq_counter.get_numpy_mirror()
+        rows = slice(None) if row_index is None else slice(row_index, row_index + n_rows)
+        if begin:
+            # -> odd. A counter which is already odd was left by a writer which died 
+            # mid-write (each row has a single writer): it's first rounded up to even, so
+            # that the parity of the row is recovered with this write
+            counters[rows, :] = (counters[rows, :] + 1 + counters[rows, :] % 2) % self._seq_modulo
+        else:
+            counters[rows, :] = (counters[rows, :] + 1) % self._seq_modulo # -> even
+        if row_index is None:
+            self._seq_counter.synch_all(read=False, retry=True)
+        else:
+            self._seq_counter.synch_retry(row_index=row_index, col_index=0, 
+                                n_rows=n_rows, n_cols=1,
+                                read=False)
+    
+    def _check_seq_parity(self):
+
+        # odd counters are either rows being written or rows whose writer died mid-write
+        # (readers of the latter would retry until their writer writes them again)
+        odd_rows = np.flatnonzero(self._seq_counter.get_numpy_mirror()[:, 0] % 2 == 1).tolist()
+        if len(odd_rows) > 0:
+            Journal.log(self.__class__.__name__,
+                "_check_seq_parity",
+                f"Rows {odd_rows} have an odd sequence counter (write in progress or interrupted). " + \
+                    "Interrupted writes are recovered by the next write of the row.",
+                LogType.WARN,
+                throw_when_excep = True)
+
+    def _seq_read(self,
+                ranges):
+        
+        # seqlock read of the given (start row, n. rows) blocks: only 
+        # the rows which were being written during the read are read again
+        counters = self._seq_counter.get_numpy_mirror()
+        for _ in range(self._seq_max_retries):
+            for row, n_rows in ranges:
+                self._seq_counter.synch_retry(row_index=row, col_index=0, 
+                                n_rows=n_rows, n_cols=1,
+                                read=True)
+            before = [counters[row:(row + n_rows), 0].copy() for row, n_rows in ranges]
+            for row, n_rows in ranges:
+                self._synch_rows(row_index=row,
+                        n_rows=n_rows,
+                        read=True)
+            torn_rows = []
+            for (row, n_rows), seq_before in zip(ranges, before):
+                self._seq_counter.synch_retry(row_index=row, col_index=0, 
+                                n_rows=n_rows, n_cols=1,
+                                read=True)
+                torn = (seq_before != counters[row:(row + n_rows), 0]) | (seq_before % 2 == 1)
+                torn_rows.extend((row + np.flatnonzero(torn)).tolist())
+            if len(torn_rows) == 0:
+                return
+            ranges = contiguous_row_ranges(torn_rows)
+        Journal.log(self.__class__.__name__,
+            "_seq_read",
+            f"Could not get a consistent read of rows {torn_rows} after {self._seq_max_retries} attempts!",
+            LogType.WARN,
+            throw_when_excep = True)
+        
+    def _synch_rows(self,
+                row_index: int,
+                n_rows: int,
+                read: bool):
+
+        self.root_state.synch_retry(row_index=row_index, col_index=0, 
+                                n_rows=n_rows, n_cols=self.root_state.n_cols,
+                                read=read)
+        self.jnts_state.synch_retry(row_index=row_index, col_index=0, 
+                                n_rows=n_rows, n_cols=self.jnts_state.n_cols,
+                                read=read)
+        self.contact_wrenches.synch_retry(row_index=row_index, col_index=0, 
+                                n_rows=n_rows, n_cols=self.contact_wrenches.n_cols,
+                                read=read)
         
     def close(self):
 
         self.root_state.close()
         self.jnts_state.close()
         self.contact_wrenches.close()
+        if self._seq_counter is not None:
+            self._seq_counter.close()
@@ -0,0 +1,220 @@
+from SharsorIPCpp.PySharsor.wrappers.shared_data_view import SharedTWrapper
+from SharsorIPCpp.PySharsorIPC import dtype
+from SharsorIPCpp.PySharsorIPC import VLevel
+from SharsorIPCpp.PySharsorIPC import LogType
+from SharsorIPCpp.PySharsorIPC import Journal
+
+from control_cluster_bridge.utilities.shared_data.state_encoding import FullRobState
+
+# fused per-step data published by the cluster server: for each controller,
+# a header (step sequence number, registration and activation flags and trigger flag) 
+# followed by the robot state (root, jnts and contacts, with the same layout as the 
+# FullRobState views). A whole cluster step (trigger + state) is published with a single 
+# write, framed by two writes of the sequence numbers (seqlock: odd while the step is being 
+# written), and each controller retrieves its own request with a single read of its row.
+# Registration and activation flags are written by whoever changes them (on top of the 
+# RhcStatus views) and are read by the server with a single synch before each step.
+# When the packet is used, state and trigger flags are ONLY exchanged through it (the 
+# RobotState and RhcStatus trigger views on shared mem are not updated by the server)
+
+class StepPacket(SharedTWrapper):
+
+    def __init__(self,
+            namespace = "",
+            is_server = False,
+            n_robots: int = -1,
+            n_jnts: int = -1,
+            n_contacts: int = -1, # flags only clients (see write_flags()) can leave n_jnts 
+            # and n_contacts to -1
+            verbose: bool = False,
+            vlevel: VLevel = VLevel.V0,
+            force_reconnection: bool = False,
+            with_torch_view: bool = False):
+
+        basename = "StepPacket" # hardcoded
+
+        self.n_jnts = n_jnts
+        self.n_contacts = n_contacts
+
+        self.seq_modulo = 2**23 # seq is stored as float (2 * seq + 1 while writing) -> 
+        # we keep it exactly representable
+        self.seq_max_retries = 1000
+
+        # layout of each row
+        self._header = [("seq", 1), # step sequence number
+                    ("registered", 1), # written by controllers (and the cluster client supervisor)
+                    ("active", 1), # written by controllers, the server and the debugger
+                    ("trigger", 1)] # whether the controller has to solve
+        self._layout = self._header + [("root_state", 13),
+                    ("jnts_state", 4 * self.n_jnts),
+                    ("contact_wrenches", 6 * self.n_contacts)]
+        self._state_fields = ["root_state", "jnts_state", "contact_wrenches"]
+
+        super().__init__(namespace = namespace,
+            basename = basename,
+            is_server = is_server,
+            n_rows = n_robots,
+            n_cols = sum([n for _, n in self._layout]),
+            verbose = verbose,
+            vlevel = vlevel,
+            safe = False, # rows are framed by the seq number and the flags are single elements
+            dtype=dtype.Float,
+            force_reconnection=force_reconnection,
+            with_gpu_mirror=False,
+            with_torch_view=with_torch_view,
+            fill_value = 0)
+
+        self._views = {}
+        self._cols = {}
+        col = 0
+        for name, n in self._layout:
+            self._cols[name] = col
+            col += n
+        self._flags_only = not is_server and n_jnts < 0
+
+    def run(self):
+
+        super().run()
+
+        expected_n_cols = sum([n for _, n in self._layout])
+        if not self._flags_only and not self.n_cols == expected_n_cols:
+            exception = f"Found {self.n_cols} columns on shared memory, while " + \
+                f"{expected_n_cols} were expected (n_jnts {self.n_jnts}, n_contacts " + \
+                f"{self.n_contacts})!"
+            Journal.log(self.__class__.__name__,
+                "run",
+                exception,
+                LogType.EXCEP,
+                throw_when_excep = True)
+
+        self._init_views()
+
+    def _init_views(self):
+
+        if self._with_torch_view:
+            mirror = self.get_torch_mirror()
+        else:
+            mirror = self.get_numpy_mirror()
+        layout = self._header if self._flags_only else self._layout
+        for name, n in layout:
+            col = self._cols[name]
+            self._views[name] = mirror[:, col:(col + n)]
+
+    def get(self,
+        name: str):
+
+        return self._views[name]
+
+    def publish(self,
+        robot_state: FullRobState,
+        trigger,
+        seq: int):
+
+        # packs the latest state and trigger flags and writes
+        # the whole step with a single synch (server side)
+        for name in self._state_fields:
+            view = getattr(robot_state, name)
+            if self._with_torch_view:
+                self._views[name][:, :] = view.get_torch_mirror(gpu=False)
+            else:
+                self._views[name][:, :] = view.get_numpy_mirror()
+        self._views["trigger"][:, :] = trigger
+        seq = seq % self.seq_modulo
+        self._write_seq(2 * seq + 1) # -> odd (step being written)
+        # trigger and state are contiguous (flags are not overwritten)
+        trigger_col = self._cols["trigger"]
+        self.synch_retry(row_index=0, col_index=trigger_col,
+                    n_rows=self.n_rows, n_cols=self.n_cols - trigger_col,
+                    read=False)
+        self._write_seq(2 * seq) # -> even (step completed)
+
+    def _write_seq(self,
+        value: int):
+
+        self._views["seq"][:, :] = value
+        self.synch_retry(row_index=0, col_index=self._cols["seq"],
+                    n_rows=self.n_rows, n_cols=1,
+                    read=False)
+
+    def _read_seq(self,
+        row_index: int):
+
+        self.synch_retry(row_index=row_index, col_index=self._cols["seq"],
+                    n_rows=1, n_cols=1,
+                    read=True)
+        return int(self._views["seq"][row_index, 0])
+
+    def read_row(self,
+        row_index: int):
+
+        # reads header and state of a single controller with a single synch: the read 
+        # is retried if the step was being written (odd seq) or changed during the read
+        for _ in range(self.seq_max_retries):
+            seq_before = self._read_seq(row_index=row_index)
+            if seq_before % 2 == 1:
+                continue
+            self.synch_retry(row_index=row_index, col_index=0,
+                        n_rows=1, n_cols=self.n_cols,
+                        read=True)
+            if self._read_seq(row_index=row_index) == seq_before:
+                return True
+        Journal.log(self.__class__.__name__,
+            "read_row",
+            f"Could not get a consistent read of row {row_index} after {self.seq_max_retries} attempts!",
+            LogType.WARN,
+            throw_when_excep = True)
+        return False
+
+    def unpack_row(self,
+        robot_state: FullRobState,
+        row_index: int):
+
+        # copies the (previously read) state of a controller to the
+        # local mirrors of robot_state (no shared mem access)
+        for name in self._state_fields:
+            view = getattr(robot_state, name)
+            if self._with_torch_view:
+                target = view.get_torch_mirror(gpu=False)
+            else:
+                target = view.get_numpy_mirror()
+            target[row_index, :] = self._views[name][row_index, :]
+
+    def triggered(self,
+        row_index: int):
+
+        return self._views["trigger"][row_index, 0] > 0.5
+
+    def seq(self,
+        row_index: int):
+
+        # sequence number of the (previously read) step
+        return int(self._views["seq"][row_index, 0]) // 2
+
+    def clear_trigger(self,
+        row_index: int):
+
+        # signals that the request was processed (controller side)
+        self.write_retry(0.0, row_index=row_index, col_index=self._cols["trigger"])
+
+    def read_triggers(self):
+
+        # only reads the trigger column of all controllers
+        self.synch_retry(row_index=0, col_index=self._cols["trigger"],
+                    n_rows=self.n_rows, n_cols=1,
+                    read=True)
+        return self._views["trigger"]
+
+    def read_flags(self):
+
+        # reads registration and activation flags of all controllers with a single synch
+        self.synch_retry(row_index=0, col_index=self._cols["registered"],
+                    n_rows=self.n_rows, n_cols=2,
+                    read=True)
+        return self._views["registered"], self._views["active"]
+
+    def write_flag(self,
+        name: str, # "registered" or "active"
+        value: bool,
+        row_index: int):
+
+        self.write_retry(float(value), row_index=row_index, col_index=self._cols[name])